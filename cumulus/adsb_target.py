@@ -1,10 +1,17 @@
+# What ownship reports without a GPS that gives accuracy estimates
+DEFAULT_NACP = 8
+DEFAULT_VERTICAL_MERIT = 50
+
 # Container for ADSB target
 class AdsbTarget:
   lat = 0
   lon = 0
   altitude = 0
+  geometric_altitude = 0
   horizontal_speed = 0
   vertical_rate = 0
+  nacp = DEFAULT_NACP
+  vertical_merit = DEFAULT_VERTICAL_MERIT
   track = 0
   callsign = "-"
   mode_s_code = 0x000000
@@ -9,12 +9,29 @@ import queue
 import frozendict
 import datetime
 import enum
+import atexit
 
 from . import gdl90encoder
 from . import adsb_target
 from . import dump1090_provider
 from . import nmea_gps_provider
+from . import ubx_gps_provider
 from . import dump978_provider
+from . import traffic_table
+from . import gdl90_output
+from . import efb_clients
+from . import target_mailbox
+from . import report_scheduler
+from . import uplink_relay
+from . import input_log
+from . import frame_stats
+from . import mode_s
+from . import uat
+from . import metrics
+from . import event_log
+from . import supervisor
+from . import frame_scheduler
+from .event_log import LOG
 
 # Default options for GDL90 output
 DEF_SEND_ADDR = "192.168.8.255"
@@ -23,14 +40,30 @@ DEF_SEND_PORT = 4000
 # Default for dump1090
 HOST_1090 = "localhost"
 PORT_1090 = 30003
-
-MAX_MERGE_COUNT_PER_FRAME = 500
-MAX_UAT_UPLINK_PER_FRAME = 5
+PORT_1090_BEAST = 30005
 
 MAX_TARGET_KEEP_TIMEOUT = 30
 INS_TIMEOUT_S = .25
 UPDATE_PERIOD_S = .25
-DEFAULT_TARGET = {'lat': None, 'lon': None, 'altitude': 0, 'horizontal_speed': 0, 'vertical_rate': 0, 'track': 0, 'callsign': '---', 'last_seen': 0, 'updated': True, 'distance': None}
+OUTPUT_STATS_PERIOD_S = 10
+DEFAULT_TARGET = {'lat': None, 'lon': None, 'altitude': 0, 'horizontal_speed': 0, 'vertical_rate': 0, 'track': 0, 'callsign': '---', 'last_seen': 0, 'updated': True, 'distance': None, 'emitter_category': 1, 'nic': 8, 'nacp': 8}
+
+# Traffic report misc field: airborne, true track, and whether the report is updated or extrapolated
+TRAFFIC_MISC_UPDATED = 0x9
+TRAFFIC_MISC_EXTRAPOLATED = 0xd
+
+# SX heartbeat, sent once a second like stratux does, status byte 1 flags
+SX_HEARTBEAT_PERIOD_S = 1
+SX_STATUS_GPS_VALID = 0x80
+SX_STATUS_UAT_ENABLED = 0x08
+SX_STATUS_ES_ENABLED = 0x04
+SX_STATUS_GPS_ENABLED = 0x02
+
+# Heartbeat status byte 2 flag, the time stamp is UTC from the GPS
+HEARTBEAT_UTC_OK = 0x01
+
+# Frame time percentiles on the metrics endpoint
+FRAME_TIME_QUANTILES = (0.5, 0.9, 0.99)
 
 METERS_TO_FT = 3.28084
 def meters_to_feet(meters):
@@ -42,6 +75,8 @@ def meters_per_second_to_kts(mps):
   # Then, convert to kts
   return (mps * METERS_PER_SECOND_TO_KTS)
 
+NM_TO_SM = 1.15078
+
 EARTH_RADIUS_SM = 3958.8
 def calculate_distance_between_coords(a, b):
   # Convert to rad
@@ -60,11 +95,217 @@ def calculate_distance_between_coords(a, b):
 
 	return EARTH_RADIUS_SM * ec
 
+def update_ownship(ownship, gps_situation):
+  """Copy a GPS situation into the ownship target, returns whether the position is valid"""
+  if (gps_situation == None):
+    return False
+
+  ownship.lat = gps_situation.lat
+  ownship.lon = gps_situation.lon
+  ownship.altitude = int(meters_to_feet(gps_situation.alt))
+  ownship.horizontal_speed = int(gps_situation.h_speed)
+
+  # Only UBX has these, NMEA keeps the defaults: level, geometric altitude the same as MSL, NACp 8 and a merit of 50 m
+  ownship.vertical_rate = (int(meters_to_feet(gps_situation.v_speed) * 60) if gps_situation.v_speed != None else 0)
+  ownship.geometric_altitude = (int(meters_to_feet(gps_situation.geo_alt)) if gps_situation.geo_alt != None else ownship.altitude)
+  ownship.nacp = (gps_situation.nacp if gps_situation.nacp != None else adsb_target.DEFAULT_NACP)
+  ownship.vertical_merit = (gps_situation.vertical_merit if gps_situation.vertical_merit != None else adsb_target.DEFAULT_VERTICAL_MERIT)
+
+  # Don't wander on heading if we have no speed
+  if (ownship.horizontal_speed > 0):
+    ownship.track = int(gps_situation.course)
+
+  return True
+
+def select_relevant_targets(target_table, ownship, position_valid, range_sm, altitude_band):
+  """Compute distance and bearing, for every target or (with a range) only for those the grid says are close
+  Returns the rows within range_sm and altitude_band feet of ownship, or None if everything is relevant"""
+  if (not position_valid):
+    target_table.clear_geometry()
+    return None
+
+  if (range_sm == None):
+    target_table.update_geometry(ownship.lat, ownship.lon)
+    if (altitude_band == None):
+      return None
+
+    return target_table.filter_rows(target_table.active_rows(), altitude = ownship.altitude, altitude_band = altitude_band)
+
+  candidates = target_table.query_range(ownship.lat, ownship.lon, range_sm)
+  target_table.update_geometry(ownship.lat, ownship.lon, rows = candidates)
+  return target_table.filter_rows(candidates, max_distance = range_sm, altitude = ownship.altitude, altitude_band = altitude_band)
+
+def get_traffic_filter(config):
+  """(range in statute miles, altitude band in feet) from the config, None where there is no limit"""
+  range_nm = config.getfloat('traffic', 'range_nm', fallback = 0)
+  altitude_band = config.getint('traffic', 'altitude_band_ft', fallback = 0)
+  return ((range_nm * NM_TO_SM) if range_nm > 0 else None, altitude_band if altitude_band > 0 else None)
+
+def get_1090_iq_source(config):
+  """[dump1090] iq_source, None to run rtl_sdr on device_sn"""
+  return config.get('dump1090', 'iq_source', fallback = '').strip() or None
+
+def get_input_recorder(config):
+  """Recorder for every raw receiver input into [input_log] record, None when not recording"""
+  path = config.get('input_log', 'record', fallback = '').strip()
+  if (len(path) == 0):
+    return None
+
+  recorder = input_log.InputRecorder(path)
+  atexit.register(recorder.close)
+  LOG.info('input_log', 'Recording inputs to %s', path)
+  return recorder
+
+def get_input_replay(config):
+  """Replay of the [input_log] replay log at replay_speed in place of the receivers, None for live input"""
+  path = config.get('input_log', 'replay', fallback = '').strip()
+  if (len(path) == 0):
+    return None
+
+  replay = input_log.InputReplay(path, config.getfloat('input_log', 'replay_speed', fallback = 1.0))
+  sources = ', '.join(input_log.SOURCE_NAMES.get(source, str(source)) for source in sorted(replay.log.sources))
+  LOG.info('input_log', 'Replaying %s: %d records over %.1fs (%s)', path, replay.log.records_total, replay.log.duration(), sources)
+  return replay
+
+def get_gps_provider(config, recorder=None, replay=None):
+  """GPS provider for [gps] protocol, nmea (the default) or ubx at rate_hz, switched to ubx_baud if set"""
+  port = config['gps']['device']
+  baud = int(config['gps']['baud'])
+
+  if (config.get('gps', 'protocol', fallback = 'nmea').strip().lower() == 'ubx'):
+    return ubx_gps_provider.UbxGpsProvider(port, baud,
+      rate_hz = config.getfloat('gps', 'rate_hz', fallback = ubx_gps_provider.DEFAULT_RATE_HZ),
+      ubx_baud = (config.getint('gps', 'ubx_baud', fallback = 0) or None),
+      recorder = recorder,
+      replay = (replay.stream(input_log.SOURCE_UBX) if replay != None else None))
+
+  return nmea_gps_provider.NmeaGpsProvider(port, baud,
+    recorder = recorder,
+    replay = (replay.stream(input_log.SOURCE_NMEA) if replay != None else None))
+
+def get_frame_scheduler(config):
+  """Frame deadlines UPDATE_PERIOD_S apart, on GPS time with [gps] align_frames"""
+  return frame_scheduler.FrameScheduler(UPDATE_PERIOD_S, align = config.getboolean('gps', 'align_frames', fallback = False))
+
+def get_uplink_relay(config):
+  """FIS-B uplink relay rate limited as [dump978] uplink_rate frames per second, bursting to uplink_burst"""
+  return uplink_relay.UplinkRelay(rate = config.getfloat('dump978', 'uplink_rate', fallback = uplink_relay.DEFAULT_RATE),
+    burst = config.getint('dump978', 'uplink_burst', fallback = uplink_relay.DEFAULT_BURST),
+    max_queued = config.getint('dump978', 'uplink_queue_size', fallback = uplink_relay.DEFAULT_MAX_QUEUED))
+
+def log_uplink_stats(relay, now):
+  mean_age = (relay.queue_age_sum / relay.relayed_total) if (relay.relayed_total > 0) else 0.0
+  LOG.info('stats', f'UAT uplinks: {relay.received_total:d} received, {relay.dedup_hits_total:d} duplicates, {relay.dropped_total:d} dropped, '
+    f'{relay.expired_total:d} expired, {relay.relayed_total:d} relayed, {len(relay):d} queued (oldest {relay.oldest_age(now):.1f}s), '
+    f'queue age mean {mean_age:.2f}s max {relay.queue_age_max:.2f}s')
+
+def get_max_extrapolation_age(config):
+  """Seconds a target's position may be dead reckoned past its last reception, 0 to report positions as received"""
+  return config.getfloat('traffic', 'extrapolation_max_age_s', fallback = 0)
+
+def get_report_scheduler(config, frame_period=0):
+  """Proximity tiered report scheduler from [traffic] report_tiers, None to report every update each frame
+  frame_period is how often the scheduler is asked for due reports, 0 if it is asked at its deadlines"""
+  report_tiers = config.get('traffic', 'report_tiers', fallback = '').strip()
+  if (len(report_tiers) == 0):
+    return None
+
+  return report_scheduler.ReportScheduler(report_scheduler.parse_report_tiers(report_tiers), frame_period = frame_period)
+
+def log_report_tier_stats(scheduler):
+  for tier in scheduler.tiers:
+    LOG.info('stats', f'  Tier {tier}: {tier.reports_total:d} reports, {tier.skipped_total:d} skipped')
+
+def encode_sx_heartbeat(encoder, target_table, position_valid, rate_978, rate_1090):
+  """SX heartbeat with the number of targets heard on each receiver and their messages per minute"""
+  receiver_counts = target_table.receiver_counts()
+  return encoder.msgSXHeartbeat(st1 = (SX_STATUS_UAT_ENABLED | SX_STATUS_ES_ENABLED | SX_STATUS_GPS_ENABLED | (SX_STATUS_GPS_VALID if position_valid else 0)),
+    num978 = receiver_counts.get(uat.RECEIVER_978, 0),
+    num1090 = receiver_counts.get(mode_s.RECEIVER_1090, 0),
+    rate978 = int(rate_978),
+    rate1090 = int(rate_1090))
+
+def log_frame_stats(label, stats):
+  if (stats.frames == 0):
+    return
+
+  LOG.info('stats', f'{label}: {stats.frames_total:d} frames, {stats.overruns_total:d} overruns, busy mean {stats.busy_sum / stats.frames * 1000:.2f}ms max {stats.busy_max * 1000:.2f}ms')
+  LOG.info('stats', '  ' + ', '.join(f'{stage} {stats.stage_sum[stage] / stats.frames * 1000:.2f}/{stats.stage_max[stage] * 1000:.2f}ms' for stage in stats.stages))
+  LOG.info('stats', '  Late: ' + ', '.join(f'{bucket} {count:d}' for bucket, count in stats.late_histogram()))
+  if (sum(stats.overrun_counts) > 0):
+    LOG.info('stats', '  Overrun by: ' + ', '.join(f'{bucket} {count:d}' for bucket, count in stats.overrun_histogram()))
+
+def get_frame_time(gps, now):
+  """(UTC datetime, whether it is GPS time) at time.monotonic() now for the heartbeat and message 101, from the
+  system clock while there is no GPS time"""
+  utc = gps.utc_time(now)
+  gps_time = (utc != None)
+  return (datetime.datetime.fromtimestamp(utc if gps_time else time.time(), datetime.timezone.utc), gps_time)
+
+def encode_heartbeat(encoder, dt, gps_time):
+  """Heartbeat time stamped with dt's seconds since UTC midnight, flagged as UTC if it is GPS time"""
+  return encoder.msgHeartbeat(st2 = (HEARTBEAT_UTC_OK if gps_time else 0), ts = ((dt.hour * 3600) + (dt.minute * 60) + dt.second))
+
+def register_metrics(registry, target_table, output, stats, uat_uplinks, gps, frame_clock):
+  """Metrics every engine has, read from the components' own counters whenever the endpoint is scraped"""
+  registry.gauge('cumulus_targets', 'Targets in the traffic table', lambda: len(target_table))
+  for receiver in (mode_s.RECEIVER_1090, uat.RECEIVER_978):
+    registry.gauge('cumulus_targets_by_receiver', 'Targets in the traffic table by the receiver they were last heard on',
+      lambda receiver = receiver: target_table.receiver_counts().get(receiver, 0), {'receiver': receiver})
+
+  registry.gauge('cumulus_uplink_queue_depth', 'FIS-B uplinks waiting to be relayed', lambda: len(uat_uplinks))
+  registry.gauge('cumulus_uplink_queue_oldest_seconds', 'Age of the oldest queued FIS-B uplink', lambda: uat_uplinks.oldest_age(time.time()))
+  registry.counter('cumulus_uplinks_received_total', 'FIS-B uplinks received', lambda: uat_uplinks.received_total)
+  registry.counter('cumulus_uplinks_duplicate_total', 'FIS-B uplinks dropped as rebroadcasts', lambda: uat_uplinks.dedup_hits_total)
+  registry.counter('cumulus_uplinks_dropped_total', 'FIS-B uplinks dropped with the queue full', lambda: uat_uplinks.dropped_total)
+  registry.counter('cumulus_uplinks_expired_total', 'FIS-B uplinks dropped as stale', lambda: uat_uplinks.expired_total)
+  registry.counter('cumulus_uplinks_relayed_total', 'FIS-B uplinks relayed', lambda: uat_uplinks.relayed_total)
+
+  registry.counter('cumulus_gdl90_frames_total', 'GDL90 frames sent', lambda: output.frames_total)
+  registry.counter('cumulus_gdl90_packets_total', 'UDP datagrams sent', lambda: output.packets_total)
+  registry.counter('cumulus_gdl90_bytes_total', 'UDP payload bytes sent', lambda: output.bytes_total)
+  registry.counter('cumulus_gdl90_syscalls_total', 'Send system calls', lambda: output.syscalls_total)
+  registry.counter('cumulus_gdl90_send_errors_total', 'Failed sends', lambda: output.send_errors_total)
+
+  registry.summary('cumulus_frame_seconds', 'Time to build and send a frame, percentiles over the recent frames',
+    lambda: (stats.busy_quantiles(FRAME_TIME_QUANTILES), stats.busy_total, stats.frames_total))
+  registry.counter('cumulus_frame_overruns_total', 'Frames which took longer than the frame period', lambda: stats.overruns_total)
+  registry.histogram('cumulus_frame_lateness_seconds', 'How late frames started against their deadline', stats.late_buckets)
+  registry.histogram('cumulus_frame_overrun_seconds', 'How far frames which overran went past the frame period', stats.overrun_buckets)
+  registry.counter('cumulus_frames_skipped_total', 'Frames skipped by a frame loop a whole period or more behind', lambda: frame_clock.skipped_total)
+  registry.gauge('cumulus_frame_gps_offset_seconds', 'Frame deadline against GPS time before the last alignment', lambda: frame_clock.align_offset)
+
+  registry.gauge('cumulus_gps_fix_age_seconds', 'Time since the last GPS fix', gps.fix_age)
+  registry.counter('cumulus_provider_reconnects_total', 'Times a provider lost and reopened its input', lambda: gps.reconnects_total, {'provider': 'gps'})
+  registry.counter('cumulus_gps_sentences_total', 'NMEA sentences or UBX messages parsed', lambda: gps.sentences_total)
+  registry.counter('cumulus_gps_sentence_errors_total', 'NMEA sentences or UBX messages dropped', lambda: gps.checksum_errors_total, {'error': 'checksum'})
+  registry.counter('cumulus_gps_sentence_errors_total', 'NMEA sentences or UBX messages dropped', lambda: gps.parse_errors_total, {'error': 'parse'})
+  registry.counter('cumulus_gps_sentence_errors_total', 'NMEA sentences or UBX messages dropped', lambda: gps.unsupported_total, {'error': 'unsupported'})
+
+  registry.counter('cumulus_log_events_total', 'Log events written', lambda: LOG.written_total)
+  registry.counter('cumulus_log_dropped_total', 'Log events overwritten before they were written', lambda: LOG.dropped_total)
+  registry.counter('cumulus_log_suppressed_total', 'Log events over their rate limit', lambda: LOG.suppressed_total)
+
+def encode_traffic_report(encoder, target):
+  return encoder.msgTrafficReport(latitude = target['lat'],
+    longitude = target['lon'],
+    altitude = target['altitude'],
+    misc = (TRAFFIC_MISC_EXTRAPOLATED if target.get('extrapolated') else TRAFFIC_MISC_UPDATED),
+    hVelocity = target['horizontal_speed'],
+    vVelocity = target['vertical_rate'],
+    trackHeading = target['track'],
+    callSign = target['callsign'],
+    address = target['mode_s_code'],
+    emitterCat = target['emitter_category'],
+    navIntegrityCat = target['nic'],
+    navAccuracyCat = target['nacp'])
+
 class Cumulus(threading.Thread):
   def __init__(self, config):
     super().__init__()
 
     self.config = config
+    event_log.configure(config)
 
   def run(self):
     # GDL90 output
@@ -72,151 +313,181 @@ class Cumulus(threading.Thread):
     s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
 
-    target_update_queue = queue.Queue()
-    uat_uplink_queue = queue.Queue()
-
-    # Start the dump1090 provider
-    dump1090_provider_ = dump1090_provider.Dump1090Provider(HOST_1090, PORT_1090, target_update_queue)
+    # Frames are packed into as few datagrams as possible, unless the EFB needs one frame per packet
+    output = gdl90_output.Gdl90Output(s, (DEF_SEND_ADDR, DEF_SEND_PORT),
+      max_datagram_size = self.config.getint('gdl90', 'max_datagram_size', fallback = gdl90_output.DEFAULT_MAX_DATAGRAM_SIZE),
+      coalesce = self.config.getboolean('gdl90', 'coalesce', fallback = True))
+    output_stats_time = time.time()
+
+    # Unicast to the EFBs we know about instead of broadcasting, broadcast while none are known
+    client_registry = None
+    if (self.config.getboolean('gdl90', 'unicast', fallback = False)):
+      client_registry = efb_clients.EfbClientRegistry(DEF_SEND_PORT,
+        dhcp_leases_path = self.config.get('gdl90', 'dhcp_leases', fallback = efb_clients.DEFAULT_DHCP_LEASES_PATH))
+      client_registry.start()
+
+    target_update_mailbox = target_mailbox.TargetMailbox()
+    uat_uplink_queue = get_uplink_relay(self.config)
+
+    # Inputs either live, and then possibly recorded, or replayed from a recording
+    recorder = get_input_recorder(self.config)
+    replay = get_input_replay(self.config)
+
+    # Start the dump1090 provider, either on the SBS1 text feed or the beast binary feed, or demodulating I/Q itself
+    # A replay is fed to the provider for the feed that was recorded
+    dump1090_format = self.config.get('dump1090', 'format', fallback='sbs1')
+    if (replay != None):
+      if (input_log.SOURCE_BEAST in replay.log.sources):
+        dump1090_provider_ = dump1090_provider.Dump1090BeastProvider(HOST_1090, PORT_1090_BEAST, target_update_mailbox,
+          replay = replay.stream(input_log.SOURCE_BEAST))
+      else:
+        dump1090_provider_ = dump1090_provider.Dump1090Provider(HOST_1090, PORT_1090, target_update_mailbox,
+          replay = replay.stream(input_log.SOURCE_SBS1))
+    elif (dump1090_format == 'iq'):
+      dump1090_provider_ = dump1090_provider.Dump1090IqProvider(int(self.config['dump1090']['device_sn']), target_update_mailbox,
+        iq_source = get_1090_iq_source(self.config))
+    elif (dump1090_format == 'beast'):
+      dump1090_provider_ = dump1090_provider.Dump1090BeastProvider(HOST_1090, PORT_1090_BEAST, target_update_mailbox, recorder = recorder)
+    else:
+      dump1090_provider_ = dump1090_provider.Dump1090Provider(HOST_1090, PORT_1090, target_update_mailbox, recorder = recorder)
     dump1090_provider_.start()
 
+    # dump1090's output is only seen by its provider, it is alive as long as messages keep coming
+    supervisor.SUPERVISOR.watch('dump1090', lambda: dump1090_provider_.messages_total)
+
     # Start the dump978 provider
-    dump978_provider_ = dump978_provider.Dump978Provider(int(self.config['dump978']['device_sn']), uat_uplink_queue, target_update_queue)
+    dump978_provider_ = dump978_provider.Dump978Provider(int(self.config['dump978']['device_sn']), uat_uplink_queue, target_update_mailbox,
+      receiver = self.config.get('dump978', 'receiver', fallback = dump978_provider.RECEIVER_DUMP978),
+      recorder = recorder,
+      replay = (replay.stream(input_log.SOURCE_DUMP978) if replay != None else None))
     dump978_provider_.start()
 
-    # Start nmea gps provider
+    # Start the gps provider
     gps_situation = None
-    nmea_gps = nmea_gps_provider.NmeaGpsProvider(self.config['gps']['device'], int(self.config['gps']['baud']))
-    nmea_gps.start()
+    gps = get_gps_provider(self.config, recorder = recorder, replay = replay)
+    gps.start()
 
     packet_total = 0
-    encoder = gdl90encoder.Encoder()
+    encoder = gdl90encoder.FastEncoder()
 
     ownship = adsb_target.AdsbTarget(0, 0, 0, 0, 0, 0, self.config['ownship']['callsign'], int(self.config['ownship']['mode_s_code'], base = 16))
 
-    target_table = {}
+    target_table = traffic_table.TrafficTable(DEFAULT_TARGET)
     position_valid = False
+    (traffic_range, traffic_altitude_band) = get_traffic_filter(self.config)
+    scheduler = get_report_scheduler(self.config, frame_period = UPDATE_PERIOD_S)
+    max_extrapolation_age = get_max_extrapolation_age(self.config)
+
+    # Frame loop instrumentation, and the receiver rates for the SX heartbeat
+    stats = frame_stats.FrameStats(UPDATE_PERIOD_S)
+    rate_978 = frame_stats.RateMeter()
+    rate_1090 = frame_stats.RateMeter()
+    sx_heartbeat_time = 0
+    frame_clock = get_frame_scheduler(self.config)
+
+    register_metrics(metrics.REGISTRY, target_table, output, stats, uat_uplink_queue, gps, frame_clock)
+    metrics.REGISTRY.gauge('cumulus_target_updates_pending', 'Targets with updates waiting for the next frame', lambda: len(target_update_mailbox.pending))
+    metrics.REGISTRY.counter('cumulus_target_updates_total', 'Target updates from the providers', lambda: target_update_mailbox.updates_total)
+    metrics.REGISTRY.counter('cumulus_target_updates_merged_total', 'Target updates merged into one already pending', lambda: target_update_mailbox.merged_total)
+    metrics.REGISTRY.counter('cumulus_target_updates_dropped_total', 'Target updates dropped with too many targets pending', lambda: target_update_mailbox.dropped_total)
+    metrics.REGISTRY.counter('cumulus_receiver_messages_total', 'Messages received', lambda: dump1090_provider_.messages_total, {'receiver': mode_s.RECEIVER_1090})
+    metrics.REGISTRY.counter('cumulus_receiver_messages_total', 'Messages received', lambda: dump978_provider_.messages_total, {'receiver': uat.RECEIVER_978})
+    metrics.REGISTRY.counter('cumulus_provider_reconnects_total', 'Times a provider lost and reopened its input',
+      lambda: getattr(dump1090_provider_, 'reconnects_total', 0), {'provider': 'dump1090'})
 
     while True:
+      frame_start = time.monotonic()
       timestamp_start = time.time()
-      dt = datetime.datetime.fromtimestamp(timestamp_start)
+      (dt, gps_time) = get_frame_time(gps, frame_start)
+      stats.start_frame(frame_clock.start_frame(frame_start))
 
       # Fetch GPS situation
-      gps_situation = nmea_gps.get_situation()
-      if (gps_situation == None):
-        position_valid = False
-        print('No GPS')
-      else:
-        position_valid = True
-        ownship.lat = gps_situation.lat
-        ownship.lon = gps_situation.lon
-        ownship.altitude = int(meters_to_feet(gps_situation.alt))
-        ownship.horizontal_speed = int(meters_per_second_to_kts(gps_situation.h_speed))
-
-        # Don't wander on heading if we have no speed
-        if (ownship.horizontal_speed > 0):
-          ownship.track = int(gps_situation.course)
-
-      # Merge traffic data
-      for x in range(0, MAX_MERGE_COUNT_PER_FRAME):
-        try:
-          target_update = target_update_queue.get_nowait()
-        except queue.Empty:
-          break
-
-        # Get the new target update mode s code
-        new_mode_s_code = list(target_update.keys())[0]
-
-        # Check if we need to add a new target
-        if (not (new_mode_s_code in target_table.keys())):
-          print(f'Adding {new_mode_s_code:x}')
-          target_table.update({new_mode_s_code: DEFAULT_TARGET})
-        else:
-          print(f'Updating {new_mode_s_code:x}')
-
-        # Update the target entry
-        target_table[new_mode_s_code] = {**target_table[new_mode_s_code], **target_update[new_mode_s_code], 'updated': True}
+      gps_situation = gps.get_situation()
+      position_valid = update_ownship(ownship, gps_situation)
+      if (not position_valid):
+        LOG.warning('no_gps', 'No GPS')
+      stats.mark('gps')
+
+      # Merge traffic data, everything the providers coalesced since the last frame
+      target_updates = target_update_mailbox.swap()
+
+      (added, updated) = target_table.upsert(target_updates.values())
+      for new_mode_s_code in added:
+        LOG.info('target_added', 'Adding %x', new_mode_s_code)
+      if (LOG.level <= event_log.DEBUG):
+        for new_mode_s_code in updated:
+          LOG.debug('target_updated', 'Updating %x', new_mode_s_code)
+      stats.mark('merge')
 
       # Prune old targets
-      purge_list = []
-      for mode_s_code, target in target_table.items():
-        if (timestamp_start - target['last_seen'] > MAX_TARGET_KEEP_TIMEOUT):
-          print(f'Removing {mode_s_code:x}')
-          purge_list.append(mode_s_code)
-
-      for purge_mode_s_code in purge_list:
-        del target_table[purge_mode_s_code]
-
-      # Update target meta data
-      for mode_s_code, target in target_table.items():
-        # Calculate the distance to the target
-        if (position_valid and target['lat'] != None and target['lon'] != None):
-          target_distance = calculate_distance_between_coords((ownship.lat, ownship.lon), (target['lat'], target['lon']))
-        else:
-          target_distance = None
-
-        target_table[mode_s_code].update({'distance': target_distance})
-
-      # Send UAT uplink messages
-      for x in range(0, MAX_UAT_UPLINK_PER_FRAME):
-        try:
-          new_uplink_message = uat_uplink_queue.get_nowait()
-        except queue.Empty:
-          break
+      purged = target_table.prune(timestamp_start, MAX_TARGET_KEEP_TIMEOUT)
+      for purge_mode_s_code in purged:
+        LOG.info('target_removed', 'Removing %x', purge_mode_s_code)
+
+      if (scheduler != None):
+        scheduler.add(added, timestamp_start)
+        scheduler.remove(purged)
+      stats.mark('prune')
+
+      # Update target meta data, distance and bearing to the targets which could be relevant
+      relevant_rows = select_relevant_targets(target_table, ownship, position_valid, traffic_range, traffic_altitude_band)
+      stats.mark('distance')
 
+      # Send UAT uplink messages, as many as the relay's rate allows
+      for new_uplink_message in uat_uplink_queue.take(timestamp_start):
         buf = encoder.msgUatUplink(None, new_uplink_message)
-        s.sendto(buf, (DEF_SEND_ADDR, DEF_SEND_PORT))
+        output.queue(buf)
         packet_total += 1
+      stats.mark('uplink')
 
       # Heartbeat message
-      buf = encoder.msgHeartbeat(ts = ((dt.hour * 3600) + (dt.minute * 60) + dt.second))
-      s.sendto(buf, (DEF_SEND_ADDR, DEF_SEND_PORT))
+      buf = encode_heartbeat(encoder, dt, gps_time)
+      output.queue(buf)
       packet_total += 1
 
+      # SX heartbeat, receiver health for the EFB
+      if (timestamp_start - sx_heartbeat_time >= SX_HEARTBEAT_PERIOD_S):
+        sx_heartbeat_time = timestamp_start
+        buf = encode_sx_heartbeat(encoder, target_table, position_valid,
+          rate_978.update(timestamp_start, dump978_provider_.messages_total),
+          rate_1090.update(timestamp_start, dump1090_provider_.messages_total))
+        output.queue(buf)
+        packet_total += 1
+
       # Ownership report
       if (position_valid):
         buf = encoder.msgOwnershipReport(latitude = ownship.lat,
           longitude = ownship.lon,
           altitude = ownship.altitude,
+          navAccuracyCat = ownship.nacp,
           hVelocity = ownship.horizontal_speed,
           vVelocity = ownship.vertical_rate,
           trackHeading = ownship.track,
           callSign = ownship.callsign)
-        s.sendto(buf, (DEF_SEND_ADDR, DEF_SEND_PORT))
+        output.queue(buf)
         packet_total += 1
 
       # Ownership geometric altitude
-      buf = encoder.msgOwnershipGeometricAltitude(altitude = ownship.altitude)
-      s.sendto(buf, (DEF_SEND_ADDR, DEF_SEND_PORT))
+      buf = encoder.msgOwnershipGeometricAltitude(altitude = ownship.geometric_altitude, merit = ownship.vertical_merit)
+      output.queue(buf)
       packet_total += 1
 
-      # Traffic reports
-      for mode_s_code, target in target_table.items():
-        # Only send the target if it's an update
-        if (not target['updated']):
-          continue
-
-        # Clear update flag
-        target['updated'] = False
-
-        # Do not include targets which lack lat/lon
-        if (target['lat'] == None or target['lon'] == None):
-          continue
-
-        # Do not include ownship
-        if (mode_s_code == ownship.mode_s_code):
-          continue
-
-        # Pack the message
-        buf = encoder.msgTrafficReport(latitude = target['lat'],
-          longitude = target['lon'],
-          altitude = target['altitude'],
-          hVelocity = target['horizontal_speed'],
-          vVelocity = target['vertical_rate'],
-          trackHeading = target['track'],
-          callSign = target['callsign'],
-          address = target['mode_s_code'])
-
-        s.sendto(buf, (DEF_SEND_ADDR, DEF_SEND_PORT))
+      # Traffic reports, only targets with a position which were updated since the last frame, nearest first
+      # With report tiers, only those due by their tier's interval
+      if (scheduler != None):
+        targets = scheduler.take_due_reports(target_table, timestamp_start,
+          own_altitude = (ownship.altitude if position_valid else None),
+          exclude_mode_s_code = ownship.mode_s_code,
+          relevant_rows = relevant_rows,
+          nearest_first = position_valid,
+          max_extrapolation_age = max_extrapolation_age)
+      else:
+        targets = target_table.take_updated(exclude_mode_s_code = ownship.mode_s_code, now = timestamp_start, rows = relevant_rows,
+          nearest_first = position_valid, max_extrapolation_age = max_extrapolation_age)
+
+      for target in targets:
+        buf = encode_traffic_report(encoder, target)
+        output.queue(buf)
         packet_total += 1
 
       # GPS Time, Custom 101 Message
@@ -225,14 +496,37 @@ class Cumulus(threading.Thread):
         hour = dt.hour,
         minute = dt.minute)
 
-      s.sendto(buf, (DEF_SEND_ADDR, DEF_SEND_PORT))
+      output.queue(buf)
       packet_total += 1
-
-      # Delay for the rest of this second
-      sleep_period = UPDATE_PERIOD_S - (time.time() - timestamp_start)
-
-      # Should never happen, but have seen it in the field
-      if (sleep_period < 0):
-        sleep_period = UPDATE_PERIOD_S
-
-      time.sleep(sleep_period)
\ No newline at end of file
+      stats.mark('encode')
+
+      if (client_registry != None):
+        output.set_destinations(client_registry.get_clients(timestamp_start) or [(DEF_SEND_ADDR, DEF_SEND_PORT)])
+
+      output.flush()
+      stats.mark('send')
+      stats.end_frame()
+
+      if (timestamp_start - output_stats_time > OUTPUT_STATS_PERIOD_S):
+        output_stats_time = timestamp_start
+        (packet_rate, byte_rate, syscall_rate) = output.rates()
+        LOG.info('stats', f'GDL90 out: {packet_rate:.1f} packets/s, {byte_rate:.0f} bytes/s, {syscall_rate:.1f} syscalls/s, {output.send_errors_total:d} send errors')
+        for (ip, port), (packets, nbytes, errors) in output.destination_counters.items():
+          LOG.info('stats', f'  {ip}:{port:d}: {packets:d} packets, {nbytes:d} bytes, {errors:d} errors')
+        LOG.info('stats', f'Target updates: {target_update_mailbox.updates_total:d} received, {target_update_mailbox.merged_total:d} merged, {target_update_mailbox.dropped_total:d} dropped')
+        log_uplink_stats(uat_uplink_queue, timestamp_start)
+        if (recorder != None):
+          LOG.info('stats', f'Input log: {recorder.records_total:d} records, {recorder.bytes_total:d} bytes')
+        if (scheduler != None):
+          log_report_tier_stats(scheduler)
+        log_frame_stats('Frames', stats)
+        stats.reset()
+
+      # Wait for the next deadline. Past it already, the next frame starts straight away to catch up
+      now = time.monotonic()
+      deadline = frame_clock.next_deadline(now)
+      if (now > deadline):
+        LOG.warning('frame_overrun', 'Frame overran by %.0fms', (now - deadline) * 1000)
+
+      frame_clock.align_to(gps.utc_time(now), now)
+      frame_clock.wait()
\ No newline at end of file
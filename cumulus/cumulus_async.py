@@ -0,0 +1,512 @@
+#### file: cumulus_async.py
+
+import asyncio
+import os
+import socket
+import threading
+import time
+import serial
+
+from . import gdl90encoder
+from . import gdl90_output
+from . import efb_clients
+from . import adsb_target
+from . import traffic_table
+from . import mode_s
+from . import uat
+from . import supervisor
+from . import dump1090_provider
+from . import dump978_provider
+from . import nmea_gps_provider
+from . import ubx_gps_provider
+from . import input_log
+from . import frame_stats
+from . import metrics
+from . import event_log
+from .event_log import LOG
+from .cumulus import (DEF_SEND_ADDR, DEF_SEND_PORT, HOST_1090, PORT_1090, PORT_1090_BEAST,
+  MAX_TARGET_KEEP_TIMEOUT, UPDATE_PERIOD_S, OUTPUT_STATS_PERIOD_S, DEFAULT_TARGET,
+  update_ownship, encode_traffic_report, select_relevant_targets, get_traffic_filter, get_report_scheduler, log_report_tier_stats,
+  get_max_extrapolation_age, get_uplink_relay, log_uplink_stats, get_1090_iq_source, get_input_recorder, get_input_replay, get_gps_provider,
+  encode_sx_heartbeat, log_frame_stats, SX_HEARTBEAT_PERIOD_S, register_metrics, FRAME_TIME_QUANTILES,
+  get_frame_scheduler, get_frame_time, encode_heartbeat)
+
+# A target is reported as soon as it changes, but at most once per this many seconds
+DEFAULT_MIN_REPORT_INTERVAL_S = .25
+
+class _LoopSink:
+  """Stands in for the uplink queue or the target mailbox of a provider running on another thread, whatever the
+  provider puts or merges is handed to function on the loop"""
+  def __init__(self, loop, function):
+    self.loop = loop
+    self.function = function
+
+  def put(self, item):
+    self.loop.call_soon_threadsafe(self.function, item)
+
+  def merge(self, items):
+    self.loop.call_soon_threadsafe(self.function, items)
+
+class _DiscoveryProtocol(asyncio.DatagramProtocol):
+  def __init__(self, registry):
+    self.registry = registry
+
+  def datagram_received(self, data, address):
+    self.registry.process_discovery(data, address[0])
+
+class AsyncCumulus(threading.Thread):
+  """Same job as Cumulus, but every provider is a stream on one asyncio loop
+  Providers merge straight into the traffic table, and a changed target goes out as soon as its rate limit allows
+  instead of waiting for the next 250 ms frame. Heartbeat, ownship and uplinks stay on the fixed frame period"""
+  def __init__(self, config):
+    super().__init__()
+
+    self.config = config
+    event_log.configure(config)
+    self.min_report_interval = config.getfloat('cumulus', 'min_report_interval', fallback = DEFAULT_MIN_REPORT_INTERVAL_S)
+    (self.traffic_range, self.traffic_altitude_band) = get_traffic_filter(config)
+    self.scheduler = get_report_scheduler(config)
+    self.max_extrapolation_age = get_max_extrapolation_age(config)
+    self.position_valid = False
+
+    # Instrumentation: the fixed period frames, the event driven traffic report passes, and the receiver message counts
+    self.frame_stats = frame_stats.FrameStats(UPDATE_PERIOD_S, stages = ('gps', 'prune', 'uplink', 'encode', 'send'))
+    self.report_stats = frame_stats.FrameStats(self.min_report_interval, stages = ('distance', 'encode', 'send'))
+    self.messages_1090_total = 0
+    self.messages_978_total = 0
+    self.reconnects_1090_total = 0
+    self.restarts_1090_total = 0
+    self.messages_1090_iq_seen = 0
+
+  def run(self):
+    asyncio.run(self.main())
+
+  async def main(self):
+    # GDL90 output
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+
+    self.output = gdl90_output.Gdl90Output(s, (DEF_SEND_ADDR, DEF_SEND_PORT),
+      max_datagram_size = self.config.getint('gdl90', 'max_datagram_size', fallback = gdl90_output.DEFAULT_MAX_DATAGRAM_SIZE),
+      coalesce = self.config.getboolean('gdl90', 'coalesce', fallback = True))
+    self.encoder = gdl90encoder.FastEncoder()
+    self.packet_total = 0
+
+    self.ownship = adsb_target.AdsbTarget(0, 0, 0, 0, 0, 0, self.config['ownship']['callsign'], int(self.config['ownship']['mode_s_code'], base = 16))
+    self.target_table = traffic_table.TrafficTable(DEFAULT_TARGET)
+    self.traffic_changed = asyncio.Event()
+    self.uat_uplinks = get_uplink_relay(self.config)
+
+    # The NMEA provider is only used for its parser and situation, its thread is never started
+    self.gps = get_gps_provider(self.config)
+
+    self.frame_clock = get_frame_scheduler(self.config)
+
+    register_metrics(metrics.REGISTRY, self.target_table, self.output, self.frame_stats, self.uat_uplinks, self.gps, self.frame_clock)
+    metrics.REGISTRY.summary('cumulus_traffic_report_pass_seconds', 'Time to select, encode and send the due traffic reports, percentiles over the recent passes',
+      lambda: (self.report_stats.busy_quantiles(FRAME_TIME_QUANTILES), self.report_stats.busy_total, self.report_stats.frames_total))
+    metrics.REGISTRY.counter('cumulus_receiver_messages_total', 'Messages received', lambda: self.messages_1090_total, {'receiver': mode_s.RECEIVER_1090})
+    metrics.REGISTRY.counter('cumulus_receiver_messages_total', 'Messages received', lambda: self.messages_978_total, {'receiver': uat.RECEIVER_978})
+    metrics.REGISTRY.counter('cumulus_provider_reconnects_total', 'Times a provider lost and reopened its input', lambda: self.reconnects_1090_total, {'provider': 'dump1090'})
+    metrics.REGISTRY.counter('cumulus_sdr_restarts_total', 'Times an SDR subprocess exited and was started again', lambda: self.restarts_1090_total, {'process': 'rtl_sdr_1090'})
+
+    tasks = [
+      self._frame_task(),
+      self._traffic_report_task(),
+    ]
+
+    # Inputs either live, and then possibly recorded, or replayed from a recording in one task, in recorded order
+    self.recorder = get_input_recorder(self.config)
+    replay = get_input_replay(self.config)
+    if (replay != None):
+      tasks.append(self._replay_task(replay))
+    else:
+      tasks.extend([self._dump1090_task(), self._dump978_task(), self._gps_task()])
+
+    # Unicast to the EFBs we know about instead of broadcasting, broadcast while none are known
+    self.client_registry = None
+    if (self.config.getboolean('gdl90', 'unicast', fallback = False)):
+      self.client_registry = efb_clients.EfbClientRegistry(DEF_SEND_PORT,
+        dhcp_leases_path = self.config.get('gdl90', 'dhcp_leases', fallback = efb_clients.DEFAULT_DHCP_LEASES_PATH))
+      tasks.append(self._client_registry_task())
+
+    await asyncio.gather(*tasks)
+
+  def _merge_targets(self, updates):
+    if (len(updates) == 0):
+      return
+
+    (added, updated) = self.target_table.upsert(updates)
+    for new_mode_s_code in added:
+      LOG.info('target_added', 'Adding %x', new_mode_s_code)
+    if (LOG.level <= event_log.DEBUG):
+      for new_mode_s_code in updated:
+        LOG.debug('target_updated', 'Updating %x', new_mode_s_code)
+
+    if (self.scheduler != None):
+      self.scheduler.add(added, time.time())
+
+    self.traffic_changed.set()
+
+  async def _dump1090_task(self):
+    dump1090_format = self.config.get('dump1090', 'format', fallback = 'sbs1')
+    if (dump1090_format == 'iq'):
+      await self._dump1090_iq_task()
+      return
+
+    beast = (dump1090_format == 'beast')
+    source = input_log.SOURCE_BEAST if beast else input_log.SOURCE_SBS1
+    decoder = mode_s.ModeSDecoder()
+
+    # dump1090's output is only seen here, it is alive as long as messages keep coming
+    supervisor.SUPERVISOR.watch('dump1090', lambda: self.messages_1090_total)
+
+    while True:
+      try:
+        (reader, writer) = await asyncio.open_connection(HOST_1090, PORT_1090_BEAST if beast else PORT_1090)
+      except OSError:
+        self.reconnects_1090_total += 1
+        await asyncio.sleep(dump1090_provider.RECONNECT_WAIT_TIME)
+        continue
+
+      tail = b''
+      while True:
+        try:
+          data = await reader.read(dump1090_provider.BUFFER_SIZE_1090)
+        except OSError:
+          break
+
+        # dump1090 went away
+        if (len(data) == 0):
+          break
+
+        if (self.recorder != None):
+          self.recorder.record(source, data)
+
+        tail = self._process_1090_block(tail + data, beast, decoder)
+
+      writer.close()
+      self.reconnects_1090_total += 1
+      await asyncio.sleep(dump1090_provider.RECONNECT_WAIT_TIME)
+
+  def _process_1090_block(self, block, beast, decoder):
+    """Merge the targets in the complete messages of a block of the dump1090 feed, returns the partial message left"""
+    timestamp = time.time()
+
+    if (beast):
+      (messages, consumed) = dump1090_provider.Dump1090BeastProvider.parse_beast(block)
+      self.messages_1090_total += len(messages)
+      updates = [update for update in (decoder.decode(msg, timestamp) for msg in messages) if update != None]
+      decoder.prune(timestamp)
+      self._merge_targets(updates)
+      return block[consumed:]
+
+    last_stop = block.rfind(dump1090_provider.SBS1_STOP_KEY)
+    if (last_stop < 0):
+      return block if (len(block) < dump1090_provider.BUFFER_SIZE_1090) else b''
+
+    updates = dump1090_provider.Dump1090Provider.parse_sentences(block[0:last_stop].split(dump1090_provider.SBS1_STOP_KEY))
+
+    # Ignore a mode_s_code of 0, it's a heartbeat
+    updates = [update for update in updates if update['mode_s_code'] != 0]
+    self.messages_1090_total += len(updates)
+    for update in updates:
+      update['last_seen'] = timestamp
+      update['receiver'] = mode_s.RECEIVER_1090
+      if ('lat' in update):
+        update['position_time'] = timestamp
+
+    self._merge_targets(updates)
+    return block[last_stop + len(dump1090_provider.SBS1_STOP_KEY):]
+
+  async def _dump1090_iq_task(self):
+    """Demodulate 1090 I/Q in Python, the blocking reads and the demodulation run on an executor thread
+    rtl_sdr runs as a pipeline of the supervisor, on an executor thread of its own"""
+    loop = asyncio.get_running_loop()
+    iq_source = get_1090_iq_source(self.config)
+    provider = dump1090_provider.Dump1090IqProvider(int(self.config['dump1090']['device_sn']), None, iq_source = iq_source)
+
+    if (iq_source == None):
+      provider.target_update_mailbox = _LoopSink(loop, lambda updates: self._merge_iq_updates(provider, updates))
+      await loop.run_in_executor(None, provider.run)
+      return
+
+    while True:
+      stream = await loop.run_in_executor(None, provider.open_stream)
+
+      try:
+        while True:
+          updates = await loop.run_in_executor(None, provider.read_updates, stream)
+          if (updates == None):
+            break
+
+          self._merge_iq_updates(provider, updates)
+      finally:
+        provider.close_stream(stream)
+
+      # A recording is done once it has been read
+      if (os.path.isfile(iq_source)):
+        LOG.info('dump1090', '1090 I/Q: End of %s', iq_source)
+        return
+
+      LOG.warning('dump1090', '1090 I/Q stream ended')
+      self.restarts_1090_total += 1
+      await asyncio.sleep(dump1090_provider.RECONNECT_WAIT_TIME)
+
+  def _merge_iq_updates(self, provider, updates):
+    self.messages_1090_total += provider.messages_total - self.messages_1090_iq_seen
+    self.messages_1090_iq_seen = provider.messages_total
+    self._merge_targets(updates)
+
+  async def _dump978_task(self):
+    """rtl_sdr and dump978 or uat_demod as a pipeline of the supervisor, on an executor thread, like the threaded engine
+    runs them. Frames are decoded there and handed to the loop"""
+    loop = asyncio.get_running_loop()
+    provider = dump978_provider.Dump978Provider(int(self.config['dump978']['device_sn']),
+      _LoopSink(loop, self._uat_uplink_from_thread), _LoopSink(loop, self._uat_downlink_from_thread),
+      receiver = self.config.get('dump978', 'receiver', fallback = dump978_provider.RECEIVER_DUMP978),
+      recorder = self.recorder)
+
+    await loop.run_in_executor(None, provider.run)
+
+  def _uat_uplink_from_thread(self, frame):
+    self.messages_978_total += 1
+    self.uat_uplinks.put(frame)
+
+  def _uat_downlink_from_thread(self, updates):
+    self.messages_978_total += 1
+    self._merge_targets(updates)
+
+  def _process_uat_frame(self, new_frame):
+    self.messages_978_total += 1
+
+    if (new_frame.type == dump978_provider.UatFrameType.UPLINK):
+      self.uat_uplinks.put(new_frame.frame)
+    else:
+      update = uat.decode_uat_downlink(new_frame.frame, time.time())
+      if (update != None):
+        self._merge_targets([update])
+
+  async def _gps_task(self):
+    loop = asyncio.get_running_loop()
+
+    # UBX comes in binary frames, not lines, the provider reads them on its own thread. It never returns, so not an
+    # executor thread, which would hold up the exit
+    if (isinstance(self.gps, ubx_gps_provider.UbxGpsProvider)):
+      self.gps.recorder = self.recorder
+      self.gps.daemon = True
+      self.gps.start()
+      return
+
+    while True:
+      serial_port = getattr(self.gps, 'serial_port', None)
+      if (serial_port == None or not serial_port.is_open):
+        try:
+          serial_port = serial.Serial(self.gps.port, self.gps.baud, timeout = nmea_gps_provider.SERIAL_TIMEOUT)
+          self.gps.serial_port = serial_port
+        except serial.SerialException:
+          self.gps.reconnects_total += 1
+          await asyncio.sleep(nmea_gps_provider.RECONNECT_WAIT_TIME)
+          continue
+
+      # A tty is a character device, so the loop can watch it like a pipe
+      reader = asyncio.StreamReader()
+      (transport, protocol) = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), serial_port)
+
+      try:
+        while True:
+          line = await reader.readline()
+          if (len(line) == 0):
+            break
+
+          if (self.recorder != None):
+            self.recorder.record(input_log.SOURCE_NMEA, line)
+
+          self.gps.process_line(line)
+      except (OSError, ValueError):
+        pass
+      finally:
+        transport.close()
+
+      self.gps.reconnects_total += 1
+      await asyncio.sleep(nmea_gps_provider.RECONNECT_WAIT_TIME)
+
+  async def _replay_task(self, replay):
+    """Every record of a recording through the same parsing as the live tasks, each once the replay clock says it is due"""
+    decoder = mode_s.ModeSDecoder()
+    tails = {input_log.SOURCE_SBS1: b'', input_log.SOURCE_BEAST: b''}
+
+    for (timestamp, source, data) in replay.log.records():
+      # Always yield, even flat out, so the frame and report tasks keep running
+      await asyncio.sleep(max(replay.clock.delay(timestamp), 0))
+
+      if (source in tails):
+        tails[source] = self._process_1090_block(tails[source] + bytes(data), source == input_log.SOURCE_BEAST, decoder)
+      elif (source == input_log.SOURCE_DUMP978):
+        new_frame = dump978_provider.parse_dump978_line(bytes(data))
+        if (new_frame != None):
+          self._process_uat_frame(new_frame)
+      elif (source == input_log.SOURCE_NMEA):
+        self.gps.process_line(bytes(data))
+      elif (source == input_log.SOURCE_UBX and isinstance(self.gps, ubx_gps_provider.UbxGpsProvider)):
+        self.gps.process_bytes(bytes(data))
+
+    LOG.info('input_log', 'Replay: End of log')
+
+  async def _client_registry_task(self):
+    loop = asyncio.get_running_loop()
+    await loop.create_datagram_endpoint(lambda: _DiscoveryProtocol(self.client_registry),
+      local_addr = ('0.0.0.0', efb_clients.DISCOVERY_PORT))
+
+    while True:
+      self.client_registry.read_leases()
+      await asyncio.sleep(efb_clients.LEASE_POLL_PERIOD_S)
+
+  async def _traffic_report_task(self):
+    relevant_rows = None
+    while True:
+      # Sleep until something changes or a rate limited target comes due
+      # With report tiers, until the earliest deadline or a new target
+      # Targets the last pass filtered out keep their update flag, and are not waited for
+      if (self.scheduler != None):
+        next_report_time = self.scheduler.next_deadline()
+      else:
+        next_report_time = self.target_table.next_report_time(self.min_report_interval, rows = relevant_rows)
+      timeout = None if (next_report_time == None) else max(next_report_time - time.time(), 0)
+
+      try:
+        await asyncio.wait_for(self.traffic_changed.wait(), timeout)
+      except asyncio.TimeoutError:
+        pass
+
+      self.traffic_changed.clear()
+      self.report_stats.start_frame(0.0 if (next_report_time == None) else max(time.time() - next_report_time, 0.0))
+
+      relevant_rows = select_relevant_targets(self.target_table, self.ownship, self.position_valid, self.traffic_range, self.traffic_altitude_band)
+      self.report_stats.mark('distance')
+      if (self.scheduler != None):
+        targets = self.scheduler.take_due_reports(self.target_table, time.time(),
+          own_altitude = (self.ownship.altitude if self.position_valid else None),
+          exclude_mode_s_code = self.ownship.mode_s_code,
+          relevant_rows = relevant_rows,
+          nearest_first = self.position_valid,
+          max_extrapolation_age = self.max_extrapolation_age)
+      else:
+        targets = self.target_table.take_updated(exclude_mode_s_code = self.ownship.mode_s_code,
+          now = time.time(), min_interval = self.min_report_interval, rows = relevant_rows, nearest_first = self.position_valid,
+          max_extrapolation_age = self.max_extrapolation_age)
+
+      for target in targets:
+        self.output.queue(encode_traffic_report(self.encoder, target))
+        self.packet_total += 1
+      self.report_stats.mark('encode')
+
+      self.output.flush()
+      self.report_stats.mark('send')
+      self.report_stats.end_frame()
+
+  async def _frame_task(self):
+    frame_clock = self.frame_clock
+    output_stats_time = time.time()
+    encoder = self.encoder
+    output = self.output
+    ownship = self.ownship
+    stats = self.frame_stats
+    rate_978 = frame_stats.RateMeter()
+    rate_1090 = frame_stats.RateMeter()
+    sx_heartbeat_time = 0
+
+    while True:
+      frame_start = time.monotonic()
+      timestamp_start = time.time()
+      (dt, gps_time) = get_frame_time(self.gps, frame_start)
+      stats.start_frame(frame_clock.start_frame(frame_start))
+
+      # Fetch GPS situation
+      position_valid = update_ownship(ownship, self.gps.get_situation())
+      self.position_valid = position_valid
+      if (not position_valid):
+        LOG.warning('no_gps', 'No GPS')
+      stats.mark('gps')
+
+      # Prune old targets
+      purged = self.target_table.prune(timestamp_start, MAX_TARGET_KEEP_TIMEOUT)
+      for purge_mode_s_code in purged:
+        LOG.info('target_removed', 'Removing %x', purge_mode_s_code)
+
+      if (self.scheduler != None):
+        self.scheduler.remove(purged)
+      stats.mark('prune')
+
+      # Send UAT uplink messages, as many as the relay's rate allows
+      for new_uplink_message in self.uat_uplinks.take(timestamp_start):
+        output.queue(encoder.msgUatUplink(None, new_uplink_message))
+        self.packet_total += 1
+      stats.mark('uplink')
+
+      # Heartbeat message
+      output.queue(encode_heartbeat(encoder, dt, gps_time))
+      self.packet_total += 1
+
+      # SX heartbeat, receiver health for the EFB
+      if (timestamp_start - sx_heartbeat_time >= SX_HEARTBEAT_PERIOD_S):
+        sx_heartbeat_time = timestamp_start
+        output.queue(encode_sx_heartbeat(encoder, self.target_table, position_valid,
+          rate_978.update(timestamp_start, self.messages_978_total),
+          rate_1090.update(timestamp_start, self.messages_1090_total)))
+        self.packet_total += 1
+
+      # Ownership report
+      if (position_valid):
+        output.queue(encoder.msgOwnershipReport(latitude = ownship.lat,
+          longitude = ownship.lon,
+          altitude = ownship.altitude,
+          navAccuracyCat = ownship.nacp,
+          hVelocity = ownship.horizontal_speed,
+          vVelocity = ownship.vertical_rate,
+          trackHeading = ownship.track,
+          callSign = ownship.callsign))
+        self.packet_total += 1
+
+      # Ownership geometric altitude
+      output.queue(encoder.msgOwnershipGeometricAltitude(altitude = ownship.geometric_altitude, merit = ownship.vertical_merit))
+      self.packet_total += 1
+
+      # GPS Time, Custom 101 Message
+      output.queue(encoder.msgGpsTime(count = self.packet_total,
+        quality = (2 if position_valid else 0),
+        hour = dt.hour,
+        minute = dt.minute))
+      self.packet_total += 1
+      stats.mark('encode')
+
+      if (self.client_registry != None):
+        output.set_destinations(self.client_registry.get_clients(timestamp_start) or [(DEF_SEND_ADDR, DEF_SEND_PORT)])
+
+      output.flush()
+      stats.mark('send')
+      stats.end_frame()
+
+      if (timestamp_start - output_stats_time > OUTPUT_STATS_PERIOD_S):
+        output_stats_time = timestamp_start
+        (packet_rate, byte_rate, syscall_rate) = output.rates()
+        LOG.info('stats', f'GDL90 out: {packet_rate:.1f} packets/s, {byte_rate:.0f} bytes/s, {syscall_rate:.1f} syscalls/s, {output.send_errors_total:d} send errors')
+        log_uplink_stats(self.uat_uplinks, timestamp_start)
+        if (self.recorder != None):
+          LOG.info('stats', f'Input log: {self.recorder.records_total:d} records, {self.recorder.bytes_total:d} bytes')
+        if (self.scheduler != None):
+          log_report_tier_stats(self.scheduler)
+        log_frame_stats('Frames', stats)
+        log_frame_stats('Traffic report passes', self.report_stats)
+        stats.reset()
+        self.report_stats.reset()
+
+      # Wait for the next deadline. Past it already, the next frame starts straight away to catch up
+      now = time.monotonic()
+      deadline = frame_clock.next_deadline(now)
+      if (now > deadline):
+        LOG.warning('frame_overrun', 'Frame overran by %.0fms', (now - deadline) * 1000)
+
+      frame_clock.align_to(self.gps.utc_time(now), now)
+      await asyncio.sleep(max(frame_clock.deadline - time.monotonic(), 0))
@@ -1,11 +1,21 @@
 #### file: dump_1090_provider.py
  
+import os
+import sys
 import socket
 import threading
 import time
 from functools import partial
+
+from . import mode_s
+from . import mode_s_demod
+from . import input_log
+from . import supervisor
+from .event_log import LOG
  
-BUFFER_SIZE_1090 = 100
+# Size of the receive buffer, large enough to hold several hundred SBS1 lines per recv
+BUFFER_SIZE_1090 = 65536
+RECONNECT_WAIT_TIME = 1
  
 # Dump1090 uses the SBS1 message format
 # http://woodair.net/SBS/Article/Barebones42_Socket_Data.htm
@@ -20,78 +30,140 @@ SBS1_MESSAGE_FORMAT[12] = ('horizontal_speed', int)
 SBS1_MESSAGE_FORMAT[16] = ('vertical_rate', int)
 SBS1_MESSAGE_FORMAT[13] = ('track', int)
 SBS1_MESSAGE_FORMAT[10] = ('callsign', str)
+
+SBS1_START_KEY = b'MSG'
+SBS1_STOP_KEY = b'\r\n'
+
+# Beast binary format (port 30005)
+# <esc> <type> <6 byte MLAT timestamp> <1 byte signal level> <message>, any <esc> in the body is doubled
+BEAST_ESCAPE = 0x1a
+BEAST_ESCAPE_BYTE = b'\x1a'
+BEAST_TYPE_MODE_S_LONG = 0x33
+BEAST_HEADER_BYTES = 7
+BEAST_FRAME_LENGTHS = {
+  0x31: BEAST_HEADER_BYTES + 2,
+  0x32: BEAST_HEADER_BYTES + mode_s.MODE_S_SHORT_MSG_BYTES,
+  0x33: BEAST_HEADER_BYTES + mode_s.MODE_S_LONG_MSG_BYTES,
+}
+
+def _decode_ascii(value):
+  return value.decode('ascii')
+
+# Same table as above, but only the fields we keep, with parsers that accept bytes directly
+# int() and float() take bytes as is, str needs an explicit decode
+SBS1_BYTES_FIELDS = tuple((index, fieldname, (_decode_ascii if parser is str else parser))
+  for index, (fieldname, parser) in enumerate(SBS1_MESSAGE_FORMAT) if parser != None)
  
 class SBS1ParseError(Exception):
   """Error parsing an SBS1 message """
  
 class Dump1090Provider(threading.Thread):
-  def __init__(self, host, port, target_update_queue):
+  """SBS1 feed from dump1090, or with replay an input_log.ReplayStream in place of the socket
+  With a recorder, everything received is logged as it comes in"""
+  record_source = input_log.SOURCE_SBS1
+
+  def __init__(self, host, port, target_update_mailbox, recorder=None, replay=None):
     super().__init__()
      
     self.host = host
     self.port = port
-    self.target_update_queue = target_update_queue
+    self.target_update_mailbox = target_update_mailbox
+    self.recorder = recorder
+    self.replay = replay
     self.socket = None
+
+    # Counters
+    self.messages_total = 0
+    self.reconnects_total = 0
+
+    # Reusable receive buffer. Holds at most one partial sentence between reads
+    self._buffer = bytearray(BUFFER_SIZE_1090)
+    self._view = memoryview(self._buffer)
+    self._fill = 0
  
   def run(self):
+    self._connect()
+    
+    while True:
+      # Fetch and parse every complete sentence we have from the network
+      sentences = self.read_sentences()
+      targets = self.parse_sentences(sentences)
+
+      # Ignore a mode_s_code of 0, it's a heartbeat
+      targets = [target for target in targets if target['mode_s_code'] != 0]
+      self.messages_total += len(targets)
+
+      # Record time now, once for the whole batch
+      last_seen = time.time()
+      for target in targets:
+        target['last_seen'] = last_seen
+        target['receiver'] = mode_s.RECEIVER_1090
+        if ('lat' in target):
+          target['position_time'] = last_seen
+        
+      self.target_update_mailbox.merge(targets)
+
+  def read_sentences(self):
+    """Block until at least one complete sentence is buffered, return all complete sentences as bytes"""
+    while True:
+      nbytes = self._recv_into(self._view[self._fill:])
+      if (nbytes == 0):
+        continue
+
+      # Only the newly received bytes (and a possible split stop key) can hold a new stop key
+      scan_start = max(self._fill - 1, 0)
+      self._fill += nbytes
+      last_stop = self._buffer.rfind(SBS1_STOP_KEY, scan_start, self._fill)
+
+      if (last_stop < 0):
+        # A line this long is not SBS1, drop it and resync on the next stop key
+        if (self._fill == len(self._buffer)):
+          self._fill = 0
+        continue
+
+      # Copy out the complete sentences in one go and split them in C
+      block = self._view[0:last_stop].tobytes()
+
+      # Move the partial sentence (if any) to the front of the buffer
+      tail_start = last_stop + len(SBS1_STOP_KEY)
+      tail_length = self._fill - tail_start
+      self._view[0:tail_length] = self._view[tail_start:self._fill]
+      self._fill = tail_length
+
+      return block.split(SBS1_STOP_KEY)
+
+  def _connect(self):
+    if (self.socket != None):
+      self.socket.close()
+
+    # Anything left in the buffer belongs to the old stream
+    self._fill = 0
+
+    if (self.replay != None):
+      self.socket = self.replay
+      return
+
     try:
       self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
       self.socket.connect((self.host, self.port))
     except:
-      time.sleep(1)
-    
-    while True:
-      try:
-        # Fetch and parse sentence from the network
-        sentence = self.read_sentence()
-        target = self.parse_sentence(sentence)
-
-        # Ignore a mode_s_code of 0, it's a heartbeat
-        if (target['mode_s_code'] == 0):
-          continue
-        
-        # Record time now
-        target['last_seen'] = time.time()
-        
-        # Generate and enqueue the dict to emit
-        target_update_data = {}
-        target_update_data[target['mode_s_code']] = target
-        self.target_update_queue.put(target_update_data)
-        
-      except SBS1ParseError as e:
-        pass
- 
-  def read_sentence(self, startkey=b"MSG", stopkey=b"\r\n"):
-    syncbuffer = bytearray()
-    sentence = bytearray()
- 
-    # Wait for start key
-    while startkey not in syncbuffer[0:len(startkey)]:
-      syncbuffer += self._readbytes(1)
-      del syncbuffer[0:-len(startkey)]
- 
-    # Accumulate until stop key
-    while stopkey not in sentence:
-      sentence += self._readbytes(1)
- 
-    return str(sentence)
+      pass
  
-  def _readbytes(self, nbytes, timeout=1):
-    # This really is a shortcoming of the python standard library
-    val = bytes()
-    while not val:
-      try:
-        val = self.socket.recv(nbytes)
-      except socket.error:
-        time.sleep(timeout)
-        try:
-          self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-          self.socket.connect((self.host, self.port))
-        except:
-          pass
-        continue
+  def _recv_into(self, view, timeout=RECONNECT_WAIT_TIME):
+    try:
+      nbytes = self.socket.recv_into(view)
+      if (nbytes > 0):
+        if (self.recorder != None):
+          self.recorder.record(self.record_source, view[0:nbytes])
+        return nbytes
+    except socket.error:
+      pass
 
-    return val
+    # Either the connection failed or dump1090 closed it, reconnect
+    self.reconnects_total += 1
+    time.sleep(timeout)
+    self._connect()
+    return 0
  
   @classmethod
   def parse_sentence(self, sentence):
@@ -113,4 +185,225 @@ class Dump1090Provider(threading.Thread):
     if 'mode_s_code' not in message:
       raise SBS1ParseError(f"MSG with no S code received: {sentence}")
 
-    return message
\ No newline at end of file
+    return message
+
+  @classmethod
+  def parse_sentences(self, sentences):
+    """Parse a batch of raw SBS1 sentences (bytes), silently skipping any that are not valid MSG lines"""
+    messages = []
+    field_count = len(SBS1_MESSAGE_FORMAT)
+
+    for sentence in sentences:
+      if (not sentence.startswith(SBS1_START_KEY)):
+        continue
+
+      fields = sentence.split(b',')
+      if (len(fields) != field_count):
+        continue
+
+      message = {}
+      for index, fieldname, parser in SBS1_BYTES_FIELDS:
+        value = fields[index]
+        if value:
+          try:
+            message[fieldname] = parser(value)
+          except Exception as e:
+            pass
+
+      if 'mode_s_code' not in message:
+        continue
+
+      messages.append(message)
+
+    return messages
+
+def _unescape_beast(block, start, length):
+  """Unescape a beast frame body, returns (body, next index), body is None if the block ends first and b'' if the frame was cut short"""
+  body = bytearray()
+  i = start
+  end = len(block)
+
+  while (len(body) < length):
+    if (i >= end):
+      return (None, i)
+
+    c = block[i]
+    if (c == BEAST_ESCAPE):
+      if (i + 1 >= end):
+        return (None, i)
+
+      # A lone escape is the start of the next frame
+      if (block[i + 1] != BEAST_ESCAPE):
+        return (b'', i)
+
+      i += 1
+
+    body.append(c)
+    i += 1
+
+  return (bytes(body), i)
+
+class Dump1090BeastProvider(Dump1090Provider):
+  """Same as Dump1090Provider, but ingests the beast binary feed and decodes extended squitters itself"""
+  record_source = input_log.SOURCE_BEAST
+
+  def __init__(self, host, port, target_update_mailbox, recorder=None, replay=None):
+    super().__init__(host, port, target_update_mailbox, recorder, replay)
+
+    self.decoder = mode_s.ModeSDecoder()
+
+  def run(self):
+    self._connect()
+
+    while True:
+      messages = self.read_messages()
+      timestamp = time.time()
+      self.messages_total += len(messages)
+
+      targets = [target for target in (self.decoder.decode(msg, timestamp) for msg in messages) if target != None]
+      self.target_update_mailbox.merge(targets)
+
+      self.decoder.prune(timestamp)
+
+  def read_messages(self):
+    """Block until at least one Mode S long message is buffered, return all complete ones"""
+    while True:
+      nbytes = self._recv_into(self._view[self._fill:])
+      if (nbytes == 0):
+        continue
+
+      self._fill += nbytes
+      (messages, consumed) = self.parse_beast(self._view[0:self._fill].tobytes())
+
+      # Nothing we can frame in a full buffer, throw it away
+      if (consumed == 0 and self._fill == len(self._buffer)):
+        self._fill = 0
+        continue
+
+      # Move the partial frame (if any) to the front of the buffer
+      tail_length = self._fill - consumed
+      self._view[0:tail_length] = self._view[consumed:self._fill]
+      self._fill = tail_length
+
+      if (len(messages) > 0):
+        return messages
+
+  @classmethod
+  def parse_beast(self, block):
+    """Frame a block of beast data, returns (Mode S long messages, number of bytes consumed)"""
+    messages = []
+    end = len(block)
+    i = block.find(BEAST_ESCAPE_BYTE)
+
+    while (i >= 0 and i + 1 < end):
+      frame_type = block[i + 1]
+      length = BEAST_FRAME_LENGTHS.get(frame_type)
+
+      # Not a frame start (escaped data or junk), resync on the next escape
+      if (length == None):
+        i = block.find(BEAST_ESCAPE_BYTE, i + (2 if frame_type == BEAST_ESCAPE else 1))
+        continue
+
+      start = i + 2
+      stop = start + length
+      if (stop > end):
+        break
+
+      body = block[start:stop]
+
+      # Slow path, the body has escaped bytes in it
+      if (BEAST_ESCAPE in body):
+        (body, stop) = _unescape_beast(block, start, length)
+        if (body == None):
+          break
+
+      if (frame_type == BEAST_TYPE_MODE_S_LONG and len(body) == length):
+        messages.append(body[BEAST_HEADER_BYTES:])
+
+      i = stop
+      if (i < end and block[i] != BEAST_ESCAPE):
+        i = block.find(BEAST_ESCAPE_BYTE, i)
+
+    return (messages, (end if i < 0 else i))
+
+def rtl_sdr_1090_command(device_index):
+  return ['rtl_sdr', f'-d{device_index:d}', '-f1090000000', f'-s{mode_s_demod.SAMPLE_RATE:d}', '-g48', '-']
+
+class Dump1090IqProvider(threading.Thread):
+  """Does without dump1090: demodulates 2 Msps rtl_sdr I/Q itself and decodes the extended squitters
+  The I/Q comes from rtl_sdr on device_sn, run as a pipeline of the supervisor, or from iq_source: a recording,
+  a named pipe, or - for stdin"""
+  def __init__(self, device_sn, target_update_mailbox, iq_source=None, supervisor_=supervisor.SUPERVISOR):
+    super().__init__()
+
+    self.device_sn = device_sn
+    self.target_update_mailbox = target_update_mailbox
+    self.iq_source = iq_source
+    self.supervisor = supervisor_
+
+    self.demodulator = mode_s_demod.ModeSDemodulator()
+    self.decoder = mode_s.ModeSDecoder()
+
+    # Counters
+    self.messages_total = 0
+    self.bytes_total = 0
+    self.restarts_total = 0
+
+    self.pipeline = supervisor.SupervisedPipeline('rtl_sdr_1090', device_sn, lambda device_index: [rtl_sdr_1090_command(device_index)],
+      consume = self._consume, activity = lambda: self.bytes_total, liveness_timeout = supervisor.IQ_LIVENESS_TIMEOUT_S)
+
+  def _consume(self, stream):
+    while True:
+      updates = self.read_updates(stream)
+      if (updates == None):
+        return
+
+      self.target_update_mailbox.merge(updates)
+
+  def run(self):
+    if (self.iq_source == None):
+      self.supervisor.add(self.pipeline, start = False)
+      self.pipeline.run()
+      return
+
+    while True:
+      stream = self.open_stream()
+      self._consume(stream)
+      self.close_stream(stream)
+
+      # A recording is done once it has been read, a pipe writer may come back
+      if (os.path.isfile(self.iq_source)):
+        LOG.info('dump1090', '1090 I/Q: End of %s', self.iq_source)
+        return
+
+      LOG.warning('dump1090', '1090 I/Q stream ended')
+      self.restarts_total += 1
+      time.sleep(RECONNECT_WAIT_TIME)
+
+  def open_stream(self):
+    """Binary stream of the iq_source I/Q, rtl_sdr itself is only ever started by the pipeline"""
+    if (self.iq_source == '-'):
+      return sys.stdin.buffer
+
+    return open(self.iq_source, 'rb')
+
+  def close_stream(self, stream):
+    if (stream is not sys.stdin.buffer):
+      stream.close()
+
+  def read_updates(self, stream):
+    """Read, demodulate and decode one block, returns the target updates in it or None at the end of the stream"""
+    block = stream.read(mode_s_demod.DEFAULT_BLOCK_BYTES)
+    if (len(block) == 0):
+      return None
+
+    self.bytes_total += len(block)
+
+    timestamp = time.time()
+    messages = self.demodulator.process(block)
+    self.messages_total += len(messages)
+
+    updates = [update for update in (self.decoder.decode(msg, timestamp) for (sample, msg) in messages) if update != None]
+    self.decoder.prune(timestamp)
+
+    return updates
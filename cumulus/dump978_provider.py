@@ -3,11 +3,12 @@
 import socket
 import threading
 import time
-import subprocess
 import enum
-import atexit
 
-from . import rtl_sdr_tools
+from . import uat
+from . import uat_demod
+from . import input_log
+from . import supervisor
 
 class UatFrameType(enum.Enum):
   UPLINK = 0
@@ -18,77 +19,127 @@ class UatFrame:
     self.type = type
     self.frame = frame
 
-# Hack for now...
-def close_sub_processes(processes):
-  for process in processes:
-    process.kill()
+def parse_dump978_line(line):
+  """Parse one line of dump978 output (bytes), returns a UatFrame or None"""
+  if (len(line) == 0):
+    return None
+
+  # Is this an uplink or downlink?
+  if (line[0] == ord('+')):
+    new_frame_type = UatFrameType.UPLINK
+  elif (line[0] == ord('-')):
+    new_frame_type = UatFrameType.DOWNLINK
+  else:
+    return None
+
+  # Try to parse the frame and extract binary contents
+  try:
+    # Get the end of the data (if there is one)
+    data_end = line.index(ord(';')) - 1
+
+    # Get the binary content of the frame (if it is properly aligned)
+    frame = bytearray.fromhex(line[1:1 + data_end].decode('utf-8'))
+  except:
+    return None
+
+  return UatFrame(new_frame_type, frame)
+
+def format_dump978_line(frame):
+  """A UatFrame as the line dump978 would have printed for it, without the trailing fields"""
+  return (b'+' if frame.type == UatFrameType.UPLINK else b'-') + bytes(frame.frame).hex().encode('ascii') + b';\n'
 
 DUMP978_PATH = './dump978'
-DEVICE_WAIT_TIMEOUT = 5
+
+# dump978 demodulates rtl_sdr's output in its own process, internal does it in Python with uat_demod
+RECEIVER_DUMP978 = 'dump978'
+RECEIVER_INTERNAL = 'internal'
+
+def rtl_sdr_command(device_index):
+  return ['rtl_sdr', f'-d{device_index:d}', '-f978000000', '-s2083334', '-g48', '-']
+
+def dump978_command():
+  return [f'{DUMP978_PATH}/dump978']
 
 class Dump978Provider(threading.Thread):
-  def __init__(self, device_sn, uat_uplink_frame_queue, traffic_update_queue):
+  """UAT from rtl_sdr through dump978 or uat_demod, or with replay dump978 lines from an input_log.ReplayStream
+  With a recorder, every dump978 line is logged, the internal receiver logs its frames as dump978 lines
+  The processes run as a pipeline of the supervisor, which restarts them when they exit or their output stops"""
+  def __init__(self, device_sn, uat_uplink_frame_queue, traffic_update_mailbox, receiver=RECEIVER_DUMP978, recorder=None, replay=None,
+      supervisor_=supervisor.SUPERVISOR):
     super().__init__()
     
     self.device_sn = device_sn
+    self.receiver = receiver
+    self.recorder = recorder
+    self.replay = replay
+    self.supervisor = supervisor_
     self.uat_uplink_frame_queue = uat_uplink_frame_queue
-    self.traffic_update_queue = traffic_update_queue
+    self.traffic_update_mailbox = traffic_update_mailbox
+
+    # Counters
+    self.messages_total = 0
+    self.bytes_total = 0
+
+    # The internal receiver reads I/Q, which never stops while the SDR works, dump978 only prints what it decodes
+    if (receiver == RECEIVER_INTERNAL):
+      self.pipeline = supervisor.SupervisedPipeline('dump978', device_sn, lambda device_index: [rtl_sdr_command(device_index)],
+        consume = self._run_internal_receiver, activity = lambda: self.bytes_total, liveness_timeout = supervisor.IQ_LIVENESS_TIMEOUT_S)
+    else:
+      self.pipeline = supervisor.SupervisedPipeline('dump978', device_sn, lambda device_index: [rtl_sdr_command(device_index), dump978_command()],
+        consume = self._run_dump978_lines, activity = lambda: self.messages_total)
+
+  @property
+  def restarts_total(self):
+    return self.pipeline.restarts_total
     
   def _process_uat_frame(self, new_frame):
+    self.messages_total += 1
+
     if (new_frame.type == UatFrameType.UPLINK):
       self.uat_uplink_frame_queue.put(new_frame.frame)
+    else:
+      update = uat.decode_uat_downlink(new_frame.frame, time.time())
+      if (update != None):
+        self.traffic_update_mailbox.merge([update])
+
+  def _run_internal_receiver(self, stream):
+    demodulator = uat_demod.UatDemodulator()
 
-  def run(self):
-    # Get the index of the target sdr
-    device_index = None
-    while (device_index == None):
-      device_index = rtl_sdr_tools.get_rtl_sdr_index_from_serial(self.device_sn)
-
-      if (device_index == None):
-        time.sleep(DEVICE_WAIT_TIMEOUT)
-        
-    print(f'dump978: Using device {device_index:d}')
-
-    # Start rtl_sdr
-    process_rtl_sdr = subprocess.Popen(['rtl_sdr', f'-d{device_index:d}', '-f978000000', '-s2083334', '-g48', '-'],
-      stdout=subprocess.PIPE,
-      stderr=subprocess.PIPE,
-      shell=False)
-
-    # Start dump978
-    process_dump978 = subprocess.Popen([f'{DUMP978_PATH}/dump978'],
-      stdin=process_rtl_sdr.stdout,
-      stdout=subprocess.PIPE,
-      stderr=subprocess.PIPE,
-      shell=False)
-
-    # Register our handler to close the subprocesses we started
-    atexit.register(close_sub_processes, [process_rtl_sdr, process_dump978])
-    
     while True:
-      line = process_dump978.stdout.readline()
-      new_frame_type = None
-      frame = bytearray()
-      
+      block = stream.read(uat_demod.DEFAULT_BLOCK_BYTES)
+      if (len(block) == 0):
+        return
+
+      self.bytes_total += len(block)
+
+      for new_frame in demodulator.process(block):
+        if (self.recorder != None):
+          self.recorder.record(input_log.SOURCE_DUMP978, format_dump978_line(new_frame))
+        self._process_uat_frame(new_frame)
+
+  def _run_dump978_lines(self, stream):
+    while True:
+      line = stream.readline()
+
+      # dump978 exited, or the end of a replay
       if (len(line) == 0):
-        continue
+        return
 
-      # Is this an uplink or downlink?
-      if (line[0] == ord('+')):
-        new_frame_type = UatFrameType.UPLINK
-      elif (line[0] == ord('-')):
-        new_frame_type = UatFrameType.DOWNLINK
-      else:
-        continue
-      
-      # Try to parse the frame and extract binary contents
-      try:
-        # Get the end of the data (if there is one)
-        data_end = line.index(ord(';')) - 1
-        
-        # Get the binary content of the frame (if it is properly aligned)
-        frame = bytearray.fromhex(line[1:1 + data_end].decode('utf-8'))
-      except:
+      if (self.recorder != None):
+        self.recorder.record(input_log.SOURCE_DUMP978, line)
+
+      new_frame = parse_dump978_line(line)
+
+      if (new_frame == None):
         continue
 
-      self._process_uat_frame(UatFrame(new_frame_type, frame))
\ No newline at end of file
+      self._process_uat_frame(new_frame)
+
+  def run(self):
+    if (self.replay != None):
+      self._run_dump978_lines(self.replay)
+      return
+
+    # Runs on this thread until the supervisor stops it
+    self.supervisor.add(self.pipeline, start = False)
+    self.pipeline.run()
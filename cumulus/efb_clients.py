@@ -0,0 +1,137 @@
+#### file: efb_clients.py
+
+import socket
+import threading
+import time
+import json
+
+from .event_log import LOG
+
+# ForeFlight (and apps copying it) broadcast {"App":"ForeFlight","GDL90":{"port":4000}} to this port every few seconds
+DISCOVERY_PORT = 63093
+DISCOVERY_BUFFER_SIZE = 1024
+
+DEFAULT_DHCP_LEASES_PATH = '/var/lib/misc/dnsmasq.leases'
+ARP_TABLE_PATH = '/proc/net/arp'
+
+# ARP entry flag for a resolved neighbour
+ARP_FLAG_COMPLETE = 0x2
+
+# Clients heard through discovery are dropped after this long without an announcement
+DISCOVERY_CLIENT_TIMEOUT_S = 30
+
+LEASE_POLL_PERIOD_S = 5
+SOCKET_TIMEOUT_S = 1
+
+class EfbClientRegistry(threading.Thread):
+  """Learns which EFBs are on the network, from discovery broadcasts and the DHCP leases file
+  get_clients() hands the frame loop the current list of (ip, port) to unicast to"""
+  def __init__(self, default_port, dhcp_leases_path=DEFAULT_DHCP_LEASES_PATH, discovery_port=DISCOVERY_PORT):
+    super().__init__()
+
+    self.default_port = default_port
+    self.dhcp_leases_path = dhcp_leases_path
+    self.discovery_port = discovery_port
+
+    # ip: {'port', 'source', 'last_seen', 'expiry'}
+    self.clients = {}
+    self.lock = threading.Lock()
+
+  def get_clients(self, now=None):
+    """Current unicast destinations, expiring clients that went idle"""
+    if (now == None):
+      now = time.time()
+
+    with self.lock:
+      for ip in [ip for ip, client in self.clients.items() if client['expiry'] != 0 and client['expiry'] < now]:
+        LOG.info('efb_client', 'EFB client %s expired', ip)
+        del self.clients[ip]
+
+      return [(ip, client['port']) for ip, client in self.clients.items()]
+
+  def _learn(self, ip, port, source, expiry):
+    with self.lock:
+      client = self.clients.get(ip)
+      if (client == None):
+        LOG.info('efb_client', 'EFB client %s:%d learned from %s', ip, port, source)
+
+      # Discovery knows the port the app listens on, don't let the leases file override it
+      if (client != None and client['source'] == 'discovery' and source != 'discovery'):
+        return
+
+      self.clients[ip] = {'port': port, 'source': source, 'last_seen': time.time(), 'expiry': expiry}
+
+  def process_discovery(self, data, ip):
+    try:
+      announcement = json.loads(data)
+      port = int(announcement.get('GDL90', {}).get('port', self.default_port))
+    except (ValueError, AttributeError, TypeError):
+      return
+
+    self._learn(ip, port, 'discovery', time.time() + DISCOVERY_CLIENT_TIMEOUT_S)
+
+  def read_leases(self):
+    """Learn clients from the dnsmasq leases file, skipping any the ARP table says are gone"""
+    try:
+      with open(self.dhcp_leases_path, 'r') as leases_file:
+        leases = leases_file.readlines()
+    except OSError:
+      return
+
+    unreachable = self._read_unreachable()
+    now = time.time()
+
+    for lease in leases:
+      # <expiry epoch> <mac> <ip> <hostname> <client id>
+      fields = lease.split()
+      if (len(fields) < 3):
+        continue
+
+      try:
+        expiry = int(fields[0])
+      except ValueError:
+        continue
+
+      ip = fields[2]
+      if (ip in unreachable or (expiry != 0 and expiry < now)):
+        continue
+
+      # Refreshed every poll, so lapse quickly once the lease or ARP entry goes away
+      self._learn(ip, self.default_port, 'dhcp', now + (3 * LEASE_POLL_PERIOD_S))
+
+  def _read_unreachable(self):
+    """IPs with an unresolved ARP entry, the client has left the network"""
+    unreachable = set()
+
+    try:
+      with open(ARP_TABLE_PATH, 'r') as arp_file:
+        # IP address, HW type, Flags, HW address, Mask, Device
+        for line in arp_file.readlines()[1:]:
+          fields = line.split()
+          if (len(fields) >= 3 and (int(fields[2], 16) & ARP_FLAG_COMPLETE) == 0):
+            unreachable.add(fields[0])
+    except (OSError, ValueError):
+      pass
+
+    return unreachable
+
+  def run(self):
+    discovery_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    discovery_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    discovery_socket.bind(('', self.discovery_port))
+    discovery_socket.settimeout(SOCKET_TIMEOUT_S)
+
+    last_lease_poll = 0
+
+    while True:
+      try:
+        (data, (ip, port)) = discovery_socket.recvfrom(DISCOVERY_BUFFER_SIZE)
+        self.process_discovery(data, ip)
+      except socket.timeout:
+        pass
+      except OSError:
+        time.sleep(SOCKET_TIMEOUT_S)
+
+      if (time.time() - last_lease_poll > LEASE_POLL_PERIOD_S):
+        last_lease_poll = time.time()
+        self.read_leases()
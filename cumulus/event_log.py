@@ -0,0 +1,183 @@
+#### file: event_log.py
+
+import atexit
+import sys
+import threading
+import time
+
+# Levels, same numbers as the logging module
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: 'debug', INFO: 'info', WARNING: 'warning', ERROR: 'error'}
+
+DEFAULT_CAPACITY = 8192
+DEFAULT_FLUSH_PERIOD_S = 0.5
+
+# Events of one type logged per second, and the burst allowed above it. The rest are only counted
+DEFAULT_RATE_LIMIT = 20
+RATE_LIMIT_BURST_FACTOR = 5
+
+def parse_level(name):
+  """Level from its name (debug, info, warning, error) or number"""
+  for level, level_name in LEVEL_NAMES.items():
+    if (level_name == name.strip().lower()):
+      return level
+
+  return int(name)
+
+class EventLog:
+  """Logger for the hot paths: log() only checks the level and the event's rate limit and stores the unformatted
+  event in a preallocated ring, a background thread formats and writes whatever is there in one batch
+  A full ring overwrites its oldest events rather than wait, those and the rate limited events are counted, and the
+  rate limited ones show up as a summary line per flush"""
+  def __init__(self, stream=None, level=INFO, capacity=DEFAULT_CAPACITY, rate_limit=DEFAULT_RATE_LIMIT, flush_period=DEFAULT_FLUSH_PERIOD_S):
+    self.stream = stream
+    self.level = level
+    self.capacity = capacity
+    self.flush_period = flush_period
+    self.set_rate_limit(rate_limit)
+
+    # (time, level, event, format, args) per slot, head is where the next one goes, tail the oldest unwritten one
+    self.ring = [None] * capacity
+    self.head = 0
+    self.tail = 0
+    self.lock = threading.Lock()
+    self.wake = threading.Event()
+    self.thread = None
+
+    # event: [tokens, last refill]
+    self.buckets = {}
+
+    # Counters
+    self.logged_total = 0
+    self.written_total = 0
+    self.dropped_total = 0
+    self.suppressed_total = 0
+
+    # event: suppressed since the last flush, and in total up to it
+    self.suppressed = {}
+    self.suppressed_by_event = {}
+
+  def set_rate_limit(self, rate_limit):
+    """Events per second per event type, 0 or None for no limit"""
+    self.rate_limit = rate_limit or 0
+    self.burst = self.rate_limit * RATE_LIMIT_BURST_FACTOR
+
+  def log(self, level, event, format, *args):
+    """Log format % args as event, once the flush thread gets to it"""
+    if (level < self.level):
+      return
+
+    now = time.time()
+
+    with self.lock:
+      if (self.rate_limit > 0):
+        bucket = self.buckets.get(event)
+        if (bucket == None):
+          bucket = self.buckets[event] = [self.burst, now]
+        else:
+          tokens = bucket[0] + ((now - bucket[1]) * self.rate_limit)
+          bucket[0] = tokens if (tokens < self.burst) else self.burst
+          bucket[1] = now
+
+        if (bucket[0] < 1):
+          suppressed = self.suppressed
+          suppressed[event] = suppressed.get(event, 0) + 1
+          self.suppressed_total += 1
+          return
+
+        bucket[0] -= 1
+
+      # Full, the oldest event goes
+      if (self.head - self.tail >= self.capacity):
+        self.tail += 1
+        self.dropped_total += 1
+
+      self.ring[self.head % self.capacity] = (now, level, event, format, args)
+      self.head += 1
+      self.logged_total += 1
+
+      # Half full, don't wait for the flush period
+      if (self.head - self.tail == self.capacity // 2):
+        self.wake.set()
+
+    if (self.thread == None):
+      self.start()
+
+  def debug(self, event, format, *args):
+    self.log(DEBUG, event, format, *args)
+
+  def info(self, event, format, *args):
+    self.log(INFO, event, format, *args)
+
+  def warning(self, event, format, *args):
+    self.log(WARNING, event, format, *args)
+
+  def error(self, event, format, *args):
+    self.log(ERROR, event, format, *args)
+
+  def start(self):
+    with self.lock:
+      if (self.thread != None):
+        return
+
+      self.thread = threading.Thread(target=self._run, daemon=True)
+      self.thread.start()
+
+    # Whatever is still in the ring when the process exits
+    atexit.register(self.flush)
+
+  def _run(self):
+    while True:
+      self.wake.wait(self.flush_period)
+      self.wake.clear()
+      self.flush()
+
+  def _take(self):
+    """Events waiting to be written and the suppression counts since the last take"""
+    with self.lock:
+      entries = [self.ring[x % self.capacity] for x in range(self.tail, self.head)]
+      self.tail = self.head
+      (suppressed, self.suppressed) = (self.suppressed, {})
+
+    for event, count in suppressed.items():
+      self.suppressed_by_event[event] = self.suppressed_by_event.get(event, 0) + count
+
+    return (entries, suppressed)
+
+  def flush(self):
+    """Format and write everything logged so far, in one write"""
+    (entries, suppressed) = self._take()
+    if (len(entries) == 0 and len(suppressed) == 0):
+      return
+
+    lines = []
+    for (timestamp, level, event, format, args) in entries:
+      try:
+        message = (format % args) if (len(args) > 0) else format
+      except (TypeError, ValueError) as e:
+        message = f'{format!r} % {args!r}: {e}'
+
+      lines.append(f'{message}\n' if (level < WARNING) else f'{LEVEL_NAMES.get(level, level).capitalize()}: {message}\n')
+
+    for event, count in suppressed.items():
+      lines.append(f'Log: {count:d} {event} events suppressed\n')
+
+    stream = self.stream or sys.stdout
+    try:
+      stream.write(''.join(lines))
+      stream.flush()
+    except (OSError, ValueError):
+      return
+
+    self.written_total += len(entries)
+
+# The process wide log, configured by configure()
+LOG = EventLog()
+
+def configure(config, log=LOG):
+  """[logging] level and rate_limit"""
+  log.level = parse_level(config.get('logging', 'level', fallback = 'info'))
+  log.set_rate_limit(config.getfloat('logging', 'rate_limit', fallback = DEFAULT_RATE_LIMIT))
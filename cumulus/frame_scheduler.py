@@ -0,0 +1,79 @@
+#### file: frame_scheduler.py
+
+import time
+
+# Most a deadline moves per frame to line up with GPS time once it is lined up, so frames don't bunch up or gap
+# when the GPS time estimate wanders by the receiver's output latency
+MAX_ALIGN_SLEW_S = 0.005
+
+# Further off than this and the schedule steps onto GPS time in one go
+ALIGN_STEP_S = 0.05
+
+class FrameScheduler:
+  """Frame deadlines a period apart on the monotonic clock, so wall clock steps (NTP, a GPS setting the clock) don't
+  move them and a late frame doesn't push the rest back
+  A frame which overruns is followed by the next one straight away, which catches up. A whole period or more behind,
+  the missed frames are skipped and the schedule carries on from the next deadline. With alignment, deadlines are
+  moved onto GPS time so frames start on the second and its fractions of the period"""
+  def __init__(self, period, align=False):
+    self.period = period
+    self.align = align
+    self.deadline = None
+
+    # Counters
+    self.frames_total = 0
+    self.skipped_total = 0
+    self.align_steps_total = 0
+    self.align_offset = None
+
+  def start_frame(self, now=None):
+    """A frame starts at monotonic now, returns how late it is"""
+    if (now == None):
+      now = time.monotonic()
+    if (self.deadline == None):
+      self.deadline = now
+
+    self.frames_total += 1
+    return max(now - self.deadline, 0.0)
+
+  def next_deadline(self, now=None):
+    """The frame is done at monotonic now, returns the monotonic deadline of the next one"""
+    if (now == None):
+      now = time.monotonic()
+
+    self.deadline += self.period
+    behind = now - self.deadline
+    if (behind >= self.period):
+      missed = int(behind // self.period)
+      self.deadline += missed * self.period
+      self.skipped_total += missed
+
+    return self.deadline
+
+  def align_to(self, utc, now=None):
+    """Move the next deadline towards the nearest multiple of the period in GPS time, utc being GPS time at
+    monotonic now. Call between next_deadline() and the wait for it"""
+    if (not self.align or utc == None or self.deadline == None):
+      return
+
+    if (now == None):
+      now = time.monotonic()
+
+    # How far past a multiple of the period GPS time will be at the deadline, between -period / 2 and period / 2
+    offset = (utc + (self.deadline - now)) % self.period
+    if (offset > self.period / 2):
+      offset -= self.period
+    self.align_offset = offset
+
+    if (abs(offset) > ALIGN_STEP_S):
+      self.align_steps_total += 1
+    else:
+      offset = max(min(offset, MAX_ALIGN_SLEW_S), -MAX_ALIGN_SLEW_S)
+
+    self.deadline -= offset
+
+  def wait(self, now=None):
+    """Sleep until the deadline, for threaded loops"""
+    delay = self.deadline - (time.monotonic() if now == None else now)
+    if (delay > 0):
+      time.sleep(delay)
@@ -0,0 +1,155 @@
+#### file: frame_stats.py
+
+import collections
+import math
+import time
+
+# Stages of the frame loop, in the order Cumulus.run goes through them
+FRAME_STAGES = ('gps', 'merge', 'prune', 'distance', 'uplink', 'encode', 'send')
+
+# How late frames start against their schedule, upper edges of the histogram buckets in seconds, the last is open
+LATE_BUCKETS_S = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25)
+
+# How far frames which overran went past the period, the same way
+OVERRUN_BUCKETS_S = (0.01, 0.05, 0.1, 0.25, 1.0)
+
+# Receiver message rates are taken over this window
+RATE_WINDOW_S = 60
+
+# Frame times kept for percentiles, the most recent ones
+RECENT_FRAMES = 1024
+
+class FrameStats:
+  """Time spent in each stage of a periodic loop, frames which took longer than the period and by how much, and how
+  late frames started. Stage figures and the histograms cover the window since the last reset, the frame and overrun
+  counts and the histogram totals everything"""
+  def __init__(self, period, stages=FRAME_STAGES):
+    self.period = period
+    self.stages = stages
+
+    # Counters
+    self.frames_total = 0
+    self.overruns_total = 0
+    self.busy_total = 0.0
+    self.late_totals = [0] * (len(LATE_BUCKETS_S) + 1)
+    self.late_sum = 0.0
+    self.overrun_totals = [0] * (len(OVERRUN_BUCKETS_S) + 1)
+    self.overrun_sum = 0.0
+
+    # Ring of the last RECENT_FRAMES frame times
+    self.recent = [0.0] * RECENT_FRAMES
+
+    self._frame_start = None
+    self._last_mark = None
+    self.reset()
+
+  def reset(self):
+    self.frames = 0
+    self.stage_sum = dict.fromkeys(self.stages, 0.0)
+    self.stage_max = dict.fromkeys(self.stages, 0.0)
+    self.busy_sum = 0.0
+    self.busy_max = 0.0
+    self.late_counts = [0] * (len(LATE_BUCKETS_S) + 1)
+    self.overrun_counts = [0] * (len(OVERRUN_BUCKETS_S) + 1)
+
+  def start_frame(self, lateness=0.0):
+    """A frame starts, lateness seconds after it was due"""
+    bucket = _bucket(LATE_BUCKETS_S, lateness)
+    self.late_counts[bucket] += 1
+    self.late_totals[bucket] += 1
+    self.late_sum += lateness
+
+    self._frame_start = time.perf_counter()
+    self._last_mark = self._frame_start
+
+  def mark(self, stage):
+    """stage is done, it took the time since the frame started or since the last mark"""
+    now = time.perf_counter()
+    elapsed = now - self._last_mark
+    self._last_mark = now
+
+    self.stage_sum[stage] += elapsed
+    if (elapsed > self.stage_max[stage]):
+      self.stage_max[stage] = elapsed
+
+  def end_frame(self):
+    """The frame is done, returns how long it took"""
+    busy = time.perf_counter() - self._frame_start
+
+    self.recent[self.frames_total % RECENT_FRAMES] = busy
+    self.frames += 1
+    self.frames_total += 1
+    self.busy_total += busy
+    self.busy_sum += busy
+    self.busy_max = max(self.busy_max, busy)
+    if (busy > self.period):
+      self.overruns_total += 1
+      bucket = _bucket(OVERRUN_BUCKETS_S, busy - self.period)
+      self.overrun_counts[bucket] += 1
+      self.overrun_totals[bucket] += 1
+      self.overrun_sum += busy - self.period
+
+    return busy
+
+  def busy_quantiles(self, quantiles):
+    """{quantile: frame time} over the recent frames, nearest rank"""
+    recent = sorted(self.recent[0:min(self.frames_total, RECENT_FRAMES)])
+    if (len(recent) == 0):
+      return {quantile: math.nan for quantile in quantiles}
+
+    return {quantile: recent[min(int(quantile * len(recent)), len(recent) - 1)] for quantile in quantiles}
+
+  def late_histogram(self):
+    """[(bucket label, frames)] for the window"""
+    return _labeled(LATE_BUCKETS_S, self.late_counts)
+
+  def overrun_histogram(self):
+    """[(bucket label, frames)] of the window's overruns"""
+    return _labeled(OVERRUN_BUCKETS_S, self.overrun_counts)
+
+  def late_buckets(self):
+    """([(upper edge, frames up to it)], sum, count) of every frame"""
+    return (_cumulative(LATE_BUCKETS_S, self.late_totals), self.late_sum, sum(self.late_totals))
+
+  def overrun_buckets(self):
+    """([(upper edge, overruns up to it)], sum, count) of every overrun"""
+    return (_cumulative(OVERRUN_BUCKETS_S, self.overrun_totals), self.overrun_sum, self.overruns_total)
+
+def _bucket(edges, value):
+  bucket = 0
+  while (bucket < len(edges) and value > edges[bucket]):
+    bucket += 1
+
+  return bucket
+
+def _labeled(edges, counts):
+  labels = ['0'] + [f'{edge * 1000:g}' for edge in edges]
+  labels = [f'{low}-{high}ms' for low, high in zip(labels[0:-1], labels[1:])] + [f'>{labels[-1]}ms']
+  return list(zip(labels, counts))
+
+def _cumulative(edges, counts):
+  running = 0
+  buckets = []
+  for edge, count in zip(edges + (math.inf,), counts):
+    running += count
+    buckets.append((edge, running))
+
+  return buckets
+
+class RateMeter:
+  """Per minute rate of a running total, over the last RATE_WINDOW_S"""
+  def __init__(self, window=RATE_WINDOW_S):
+    self.window = window
+    self.samples = collections.deque()
+
+  def update(self, now, total):
+    """Take a sample of total, returns the rate per minute"""
+    self.samples.append((now, total))
+    while (len(self.samples) > 2 and now - self.samples[1][0] >= self.window):
+      self.samples.popleft()
+
+    (first_time, first_total) = self.samples[0]
+    if (now <= first_time):
+      return 0.0
+
+    return (total - first_total) * 60.0 / (now - first_time)
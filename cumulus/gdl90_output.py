@@ -0,0 +1,201 @@
+#### file: gdl90_output.py
+
+import sys
+import socket
+import ctypes
+import ctypes.util
+import time
+
+# Largest UDP payload that fits a 1500 byte ethernet/wifi MTU without fragmentation
+DEFAULT_MAX_DATAGRAM_SIZE = 1472
+
+# Most datagrams sendmmsg hands to the kernel per call
+SENDMMSG_BATCH = 64
+
+# Python's socket module has no sendmmsg, so go through libc where it exists (Linux)
+class _Iovec(ctypes.Structure):
+  _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+class _SockaddrIn(ctypes.Structure):
+  _fields_ = [('sin_family', ctypes.c_ushort), ('sin_port', ctypes.c_uint16), ('sin_addr', ctypes.c_uint32), ('sin_zero', ctypes.c_char * 8)]
+
+class _Msghdr(ctypes.Structure):
+  _fields_ = [('msg_name', ctypes.c_void_p), ('msg_namelen', ctypes.c_uint32),
+    ('msg_iov', ctypes.POINTER(_Iovec)), ('msg_iovlen', ctypes.c_size_t),
+    ('msg_control', ctypes.c_void_p), ('msg_controllen', ctypes.c_size_t), ('msg_flags', ctypes.c_int)]
+
+class _Mmsghdr(ctypes.Structure):
+  _fields_ = [('msg_hdr', _Msghdr), ('msg_len', ctypes.c_uint)]
+
+def _load_sendmmsg():
+  try:
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    sendmmsg = libc.sendmmsg
+  except (OSError, AttributeError, TypeError):
+    return None
+
+  sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_Mmsghdr), ctypes.c_uint, ctypes.c_int]
+  sendmmsg.restype = ctypes.c_int
+  return sendmmsg
+
+_sendmmsg = _load_sendmmsg()
+
+class Gdl90Output:
+  """Collects the GDL90 frames of one output frame and sends them as few datagrams as possible
+  GDL90 frames are self delimiting (0x7e flags), so several can share one UDP payload. Some EFBs only
+  accept one frame per datagram, for those set coalesce to False
+  Datagrams are built once per flush and the same buffers are sent to every destination"""
+  def __init__(self, sock, address, max_datagram_size=DEFAULT_MAX_DATAGRAM_SIZE, coalesce=True, use_sendmmsg=True):
+    self.sock = sock
+    self.max_datagram_size = max_datagram_size
+    self.coalesce = coalesce
+    self.use_sendmmsg = use_sendmmsg and (_sendmmsg != None) and (sock.family == socket.AF_INET)
+
+    # (ip, port) list, a single broadcast address unless set_destinations says otherwise
+    self.destinations = [address]
+
+    # Datagrams ready to go, and the frames of the one still being filled
+    self.datagrams = []
+    self.pending = []
+    self.pending_size = 0
+
+    # Counters
+    self.frames_total = 0
+    self.packets_total = 0
+    self.bytes_total = 0
+    self.syscalls_total = 0
+    self.send_errors_total = 0
+
+    # (ip, port): [packets, bytes, errors]
+    self.destination_counters = {}
+
+    # Last snapshot for rates()
+    self._rate_time = time.monotonic()
+    self._rate_counts = (0, 0, 0)
+
+    # (ip, port): sockaddr_in for sendmmsg
+    self._sockaddrs = {}
+
+  def set_destinations(self, addresses):
+    self.destinations = list(addresses)
+
+  def _get_sockaddr(self, address):
+    sockaddr = self._sockaddrs.get(address)
+
+    if (sockaddr == None):
+      sockaddr = _SockaddrIn()
+      sockaddr.sin_family = socket.AF_INET
+      sockaddr.sin_port = socket.htons(address[1])
+      sockaddr.sin_addr = int.from_bytes(socket.inet_aton(address[0]), sys.byteorder)
+      self._sockaddrs[address] = sockaddr
+
+    return sockaddr
+
+  def _get_counters(self, address):
+    counters = self.destination_counters.get(address)
+
+    if (counters == None):
+      counters = [0, 0, 0]
+      self.destination_counters[address] = counters
+
+    return counters
+
+  def queue(self, frame):
+    """Add one encoded GDL90 frame to the output"""
+    self.frames_total += 1
+
+    if (not self.coalesce):
+      self.datagrams.append(bytes(frame))
+      return
+
+    if (self.pending_size + len(frame) > self.max_datagram_size and self.pending_size > 0):
+      self._close_datagram()
+
+    self.pending.append(frame)
+    self.pending_size += len(frame)
+
+  def _close_datagram(self):
+    self.datagrams.append(b''.join(self.pending))
+    self.pending = []
+    self.pending_size = 0
+
+  def flush(self):
+    """Send everything queued since the last flush to every destination"""
+    if (self.pending_size > 0):
+      self._close_datagram()
+
+    datagrams = self.datagrams
+    self.datagrams = []
+
+    messages = [(datagram, address) for address in self.destinations for datagram in datagrams]
+    if (len(messages) == 0):
+      return
+
+    sent = 0
+    if (self.use_sendmmsg):
+      sent = self._send_mmsg(messages)
+
+    # Fallback, and whatever sendmmsg did not take
+    for datagram, address in messages[sent:]:
+      counters = self._get_counters(address)
+      self.syscalls_total += 1
+
+      try:
+        self.sock.sendto(datagram, address)
+      except OSError:
+        self.send_errors_total += 1
+        counters[2] += 1
+        continue
+
+      self.packets_total += 1
+      self.bytes_total += len(datagram)
+      counters[0] += 1
+      counters[1] += len(datagram)
+
+  def _send_mmsg(self, messages):
+    """Send as many (datagram, address) as the kernel takes through sendmmsg, returns how many went out"""
+    sent = 0
+    fd = self.sock.fileno()
+
+    while (sent < len(messages)):
+      batch = messages[sent:sent + SENDMMSG_BATCH]
+      count = len(batch)
+
+      # The buffers only need to live until sendmmsg returns, batch keeps them referenced
+      iovecs = (_Iovec * count)()
+      msgs = (_Mmsghdr * count)()
+      for x, (datagram, address) in enumerate(batch):
+        iovecs[x].iov_base = ctypes.cast(ctypes.c_char_p(datagram), ctypes.c_void_p)
+        iovecs[x].iov_len = len(datagram)
+        msgs[x].msg_hdr.msg_name = ctypes.cast(ctypes.pointer(self._get_sockaddr(address)), ctypes.c_void_p)
+        msgs[x].msg_hdr.msg_namelen = ctypes.sizeof(_SockaddrIn)
+        msgs[x].msg_hdr.msg_iov = ctypes.pointer(iovecs[x])
+        msgs[x].msg_hdr.msg_iovlen = 1
+
+      self.syscalls_total += 1
+      result = _sendmmsg(fd, msgs, count, 0)
+
+      # Let the sendto path deal with (and count) the failure
+      if (result <= 0):
+        break
+
+      for datagram, address in batch[0:result]:
+        counters = self._get_counters(address)
+        counters[0] += 1
+        counters[1] += len(datagram)
+        self.bytes_total += len(datagram)
+      self.packets_total += result
+      sent += result
+
+    return sent
+
+  def rates(self):
+    """(packets/s, bytes/s, syscalls/s) since the last call"""
+    now = time.monotonic()
+    counts = (self.packets_total, self.bytes_total, self.syscalls_total)
+    period = max(now - self._rate_time, 1e-6)
+    rates = tuple((count - last) / period for count, last in zip(counts, self._rate_counts))
+
+    self._rate_time = now
+    self._rate_counts = counts
+    return rates
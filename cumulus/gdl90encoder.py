@@ -15,7 +15,23 @@ SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import sys
 import struct
-from .gdl90fcs import crcCompute
+from .gdl90fcs import crcCompute, crcComputeFast
+
+# Precompiled layouts for FastEncoder, message ID byte included
+# Message 10/20: the 24 bit fields are folded into 16/32 bit words
+#   I: status/addrType (8) + address (24)
+#   H, I: latitude (24) + longitude (24)
+#   H: altitude (12) + misc (4)
+#   I: hVelocity (12) + vVelocity (12) + track (8)
+_STRUCT_HEARTBEAT = struct.Struct('>BBBHH')
+_STRUCT_REPORT = struct.Struct('>BIHIHBIB8sB')
+_STRUCT_GEOMETRIC_ALTITUDE = struct.Struct('>BHH')
+# Message 101: count (24, LSB first) + hour (8) folded into one little endian word
+_STRUCT_GPS_TIME = struct.Struct('<BBBBIBBBB')
+_STRUCT_CRC = struct.Struct('<H')
+
+_FLAG_BYTE = b'\x7e'
+_ESCAPE_BYTE = b'\x7d'
 
 class Encoder(object):
   """GDL-90 data link interface decoder class"""
@@ -223,8 +239,11 @@ class Encoder(object):
     
     msg = bytearray()
     msg.append(0x1d)
-    fmt = '>ccBBLLHHBBHHHHHB'
-    msg.extend(struct.pack(fmt,'S','X',1,1,fv,hv,st1,st2,satLock,satConn,num978,num1090,rate978,rate1090,cpuTemp,len(towers)))
+    fmt = '>ccBBLLBBBBHHHHhB'
+
+    # Counts and rates are 16 bit, saturate rather than wrap
+    (num978, num1090, rate978, rate1090) = (min(int(x), 0xffff) for x in (num978, num1090, rate978, rate1090))
+    msg.extend(struct.pack(fmt,b'S',b'X',1,1,fv,hv,st1,st2,satLock,satConn,num978,num1090,rate978,rate1090,cpuTemp,len(towers)))
 
     for tower in towers:
       (lat, lon) = tower[0:2]
@@ -262,4 +281,141 @@ class Encoder(object):
     # Full contents of the payload
     msg.extend(uplink_payload)
     
-    return(self._preparedMessage(msg))
\ No newline at end of file
+    return(self._preparedMessage(msg))
+
+class FastEncoder(Encoder):
+  """GDL-90 encoder producing the same bytes as Encoder for the hot path messages (0, 10, 11, 20, 101, 7)
+  Messages are packed with precompiled structs into preallocated frame buffers, CRC and escaping run in C"""
+  def __init__(self):
+    super().__init__()
+
+    # Each buffer holds <flag> <message> <crc> <flag>
+    self._heartbeatBuf = self._frameBuffer(_STRUCT_HEARTBEAT.size)
+    self._reportBuf = self._frameBuffer(_STRUCT_REPORT.size)
+    self._geometricAltitudeBuf = self._frameBuffer(_STRUCT_GEOMETRIC_ALTITUDE.size)
+    self._gpsTimeBuf = self._frameBuffer(_STRUCT_GPS_TIME.size)
+
+  def _frameBuffer(self, size):
+    buf = bytearray(size + 4)
+    buf[0] = 0x7e
+    buf[-1] = 0x7e
+    return buf
+
+  def _finishFrame(self, buf):
+    """add the CRC to the message packed in buf, returns the escaped frame"""
+    end = len(buf) - 3
+    body = memoryview(buf)[1:end]
+    _STRUCT_CRC.pack_into(buf, end, crcComputeFast(body))
+    body.release()
+
+    # Nearly every frame needs no escaping, hand back a single copy of the buffer
+    if (buf.find(_FLAG_BYTE, 1, -1) < 0 and buf.find(_ESCAPE_BYTE, 1, -1) < 0):
+      return bytes(buf)
+
+    return _FLAG_BYTE + self._escapeFast(bytes(buf[1:-1])) + _FLAG_BYTE
+
+  def _escapeFast(self, msg):
+    """escape 0x7d and 0x7e characters, 0x7d first so the escapes added for 0x7e are left alone"""
+    return msg.replace(_ESCAPE_BYTE, b'\x7d\x5d').replace(_FLAG_BYTE, b'\x7d\x5e')
+
+  def msgHeartbeat(self, st1=0x81, st2=0x00, ts=0, mc=0x0000):
+    # Move 17-bit into status byte 2 if necessary
+    if (ts & 0x10000) != 0:
+      ts = ts & 0x0ffff
+      st2 = st2 | 0x80
+
+    buf = self._heartbeatBuf
+    _STRUCT_HEARTBEAT.pack_into(buf, 1, 0x00, st1, st2, ts, mc)
+    return self._finishFrame(buf)
+
+  def _msgType10and20(self, msgid, status, addrType, address, latitude, longitude, altitude, misc, navIntegrityCat, navAccuracyCat, hVelocity, vVelocity, trackHeading, emitterCat, callSign, code):
+    """construct message ID 10 or 20"""
+    latitude = self._makeLatitude(latitude)
+    longitude = self._makeLongitude(longitude)
+
+    altitude = int((altitude + 1000) / 25)
+
+    if (altitude < 0):
+      altitude = 0
+
+    if (altitude > 0xffe):
+      altitude = 0xffe
+
+    if hVelocity is None:
+      hVelocity = 0xfff
+    elif hVelocity < 0:
+      hVelocity = 0
+    elif hVelocity > 0xffe:
+      hVelocity = 0xffe
+
+    if vVelocity is None:
+      vVelocity = 0x800
+    else:
+      if vVelocity > 32576:
+        vVelocity = 0x1fe
+      elif vVelocity < -32576:
+        vVelocity = 0xe02
+      else:
+        vVelocity = int(vVelocity / 64)  # convert to 64fpm increments, 2s complement by the mask below
+
+    trackHeading = int(trackHeading / (360. / 256)) # convert to 1.4 deg single byte
+
+    callSign = str(callSign + ' '*8)[:8]
+
+    buf = self._reportBuf
+    _STRUCT_REPORT.pack_into(buf, 1,
+      msgid,
+      (((status & 0xf) << 4) | (addrType & 0xf)) << 24 | (address & 0xffffff),
+      latitude >> 8,
+      ((latitude & 0xff) << 24) | longitude,
+      ((altitude & 0xfff) << 4) | (misc & 0xf),
+      ((navIntegrityCat & 0xf) << 4) | (navAccuracyCat & 0xf),
+      ((hVelocity & 0xfff) << 20) | ((vVelocity & 0xfff) << 8) | (trackHeading & 0xff),
+      emitterCat & 0xff,
+      callSign.encode('ASCII'),
+      (code & 0xf) << 4)
+
+    return self._finishFrame(buf)
+
+  def msgOwnershipGeometricAltitude(self, altitude=0, merit=50, warning=False):
+    """message ID #11"""
+    # Convert altitude to 5ft increments
+    altitude = int(altitude / 5)
+    if altitude < 0:
+      altitude = (0x10000 + altitude) & 0xffff  # 2s complement
+
+    if merit is None:
+      merit = 0x7fff
+    elif merit > 32766:
+      merit = 0x7ffe
+
+    # MSB is warning bit, 14-0 bits are the merit value
+    merit = merit & 0x7fff
+    if warning:
+      merit = merit | 0x8000
+
+    buf = self._geometricAltitudeBuf
+    _STRUCT_GEOMETRIC_ALTITUDE.pack_into(buf, 1, 0x0b, altitude, merit)
+    return self._finishFrame(buf)
+
+  def msgGpsTime(self, count=0, quality=2, hour=0, minute=0):
+    """message ID #101 for Skyradar"""
+    buf = self._gpsTimeBuf
+    _STRUCT_GPS_TIME.pack_into(buf, 1,
+      0x65,
+      0x2a, # firmware version
+      0, # debug data
+      (0x30 + quality) & 0xff, # GPS quality: '0'=no fix, '1'=regular, '2'=DGPS (WAAS)
+      (count & 0xffffff) | ((hour & 0xff) << 24),
+      minute & 0xff,
+      0,
+      0, # debug data
+      4) # hardware version
+    return self._finishFrame(buf)
+
+  def msgUatUplink(self, time_of_reception, uplink_payload):
+    # Variable length, so no preallocated buffer. Zulu time is left at 0 like Encoder
+    buf = bytearray(b'\x7e\x07\x00\x00\x00')
+    buf.extend(uplink_payload)
+    buf.extend(b'\x00\x00\x7e')
+    return self._finishFrame(buf)
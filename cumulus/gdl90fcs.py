@@ -13,6 +13,8 @@ OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
 SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 '''
 
+from binascii import crc_hqx
+
 CRC16Table = (
     0x0000, 0x1021, 0x2042, 0x3063, 0x4084, 0x50a5, 0x60c6, 0x70e7,
     0x8108, 0x9129, 0xa14a, 0xb16b, 0xc18c, 0xd1ad, 0xe1ce, 0xf1ef,
@@ -82,6 +84,14 @@ def crcCompute(data):
     return crcArray
 
 
+def crcComputeFast(data):
+    """same CRC as crcCompute, but returned as an integer (LSB is sent first) and computed in C
+    crcCompute shifts each byte straight into the register, which works out to the CRC-CCITT (XModem)
+    of all but the last two bytes xor'd with those two bytes, so binascii.crc_hqx can do the work
+    """
+    return crc_hqx(data[:-2], 0) ^ int.from_bytes(data[-2:], 'big')
+
+
 def crcCheck(data, crcInput):
     """check the CRC value of the data block again a given input value
     @data : data block (usually a bytearray)
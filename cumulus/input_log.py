@@ -0,0 +1,237 @@
+#### file: input_log.py
+
+import mmap
+import struct
+import threading
+import time
+
+from .event_log import LOG
+
+# Everything the receivers feed cumulus, recorded as it arrives so a session can be played back without SDRs or a GPS
+# The log is the magic, then records of <monotonic timestamp f64> <source u8> <length u32> <raw bytes>, little endian.
+# It is written through a memory map grown in steps and cut to size on close, a log left behind by a crash
+# ends in zeros, which read as the end of the log
+LOG_MAGIC = b'CUMULUS-INPUT-1\n'
+RECORD_HEADER = struct.Struct('<dBI')
+
+# Sources, 0 is never written
+SOURCE_SBS1 = 1
+SOURCE_BEAST = 2
+SOURCE_DUMP978 = 3
+SOURCE_NMEA = 4
+SOURCE_UBX = 5
+SOURCE_NAMES = {
+  SOURCE_SBS1: 'sbs1',
+  SOURCE_BEAST: 'beast',
+  SOURCE_DUMP978: 'dump978',
+  SOURCE_NMEA: 'nmea',
+  SOURCE_UBX: 'ubx',
+}
+
+# The memory map grows by this much at a time
+DEFAULT_GROW_BYTES = 16 << 20
+
+# A stream which has played its whole log returns nothing, this often
+END_WAIT_S = 1
+
+class InputLogError(Exception):
+  """Error opening an input log"""
+
+class InputRecorder:
+  """Appends raw receiver input to a log, safe to share between the provider threads"""
+  def __init__(self, path, grow_bytes=DEFAULT_GROW_BYTES):
+    self.path = path
+    self.grow_bytes = grow_bytes
+    self.file = open(path, 'w+b')
+    self.map = None
+    self.size = 0
+    self.position = 0
+    self.lock = threading.Lock()
+
+    # Counters
+    self.records_total = 0
+    self.bytes_total = 0
+
+    self._grow(len(LOG_MAGIC))
+    self.map[0:len(LOG_MAGIC)] = LOG_MAGIC
+    self.position = len(LOG_MAGIC)
+
+  def _grow(self, needed):
+    if (self.map != None):
+      self.map.close()
+
+    self.size += max(self.grow_bytes, needed)
+    self.file.truncate(self.size)
+    self.map = mmap.mmap(self.file.fileno(), self.size)
+
+  def record(self, source, data, timestamp=None):
+    """Append data (any bytes-like) from source, stamped with time.monotonic() unless given"""
+    if (timestamp == None):
+      timestamp = time.monotonic()
+
+    length = len(data)
+
+    with self.lock:
+      if (self.map == None):
+        return
+
+      start = self.position + RECORD_HEADER.size
+      end = start + length
+      if (end > self.size):
+        self._grow(end - self.size)
+
+      RECORD_HEADER.pack_into(self.map, self.position, timestamp, source, length)
+      self.map[start:end] = data
+      self.position = end
+
+      self.records_total += 1
+      self.bytes_total += length
+
+  def close(self):
+    """Flush and cut the log to what was recorded, later records are ignored"""
+    with self.lock:
+      if (self.map == None):
+        return
+
+      self.map.flush()
+      self.map.close()
+      self.map = None
+      self.file.truncate(self.position)
+      self.file.close()
+
+class InputLog:
+  """A recorded log, memory mapped read only"""
+  def __init__(self, path):
+    self.path = path
+
+    with open(path, 'rb') as log_file:
+      self.map = mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if (self.map[0:len(LOG_MAGIC)] != LOG_MAGIC):
+      raise InputLogError(f'{path} is not a cumulus input log')
+
+    # One pass for what is in it
+    self.sources = set()
+    self.records_total = 0
+    self.start_time = None
+    self.end_time = None
+
+    for (timestamp, source, data) in self.records():
+      self.sources.add(source)
+      self.records_total += 1
+      if (self.start_time == None):
+        self.start_time = timestamp
+      self.end_time = timestamp
+
+  def records(self, sources=None):
+    """(timestamp, source, memoryview of the data) for every record, or only those from sources"""
+    view = memoryview(self.map)
+    position = len(LOG_MAGIC)
+    end = len(self.map)
+
+    while (position + RECORD_HEADER.size <= end):
+      (timestamp, source, length) = RECORD_HEADER.unpack_from(self.map, position)
+      start = position + RECORD_HEADER.size
+
+      # Zeros or a partial record, where a crashed recorder stopped
+      if (source == 0 or start + length > end):
+        break
+
+      position = start + length
+      if (sources == None or source in sources):
+        yield (timestamp, source, view[start:position])
+
+  def duration(self):
+    return (self.end_time - self.start_time) if (self.start_time != None) else 0.0
+
+class ReplayClock:
+  """Maps log time onto now, speed times faster than it was recorded, 0 for as fast as possible
+  Every stream of one replay shares a clock so the sources stay in step"""
+  def __init__(self, start_time, speed=1.0):
+    self.start_time = start_time
+    self.speed = speed
+    self.started = time.monotonic()
+
+  def delay(self, timestamp):
+    """Seconds until a record stamped timestamp is due, 0 or less if it already is"""
+    if (self.speed <= 0 or self.start_time == None):
+      return 0.0
+
+    return self.started + ((timestamp - self.start_time) / self.speed) - time.monotonic()
+
+  def wait(self, timestamp):
+    delay = self.delay(timestamp)
+    if (delay > 0):
+      time.sleep(delay)
+
+class ReplayStream:
+  """The records of some sources of a log, handed out when due, through the same calls the providers make on
+  their socket (recv_into) or serial port and pipe (readline, read). At the end of the log they return nothing"""
+  def __init__(self, log, sources, clock):
+    self.records = log.records(sources)
+    self.clock = clock
+    self.pending = b''
+    self.ended = False
+    self.is_open = True
+
+  def _next(self):
+    record = next(self.records, None)
+    if (record == None):
+      if (not self.ended):
+        LOG.info('input_log', 'Replay: End of log')
+        self.ended = True
+
+      time.sleep(END_WAIT_S)
+      return b''
+
+    (timestamp, source, data) = record
+    self.clock.wait(timestamp)
+    return bytes(data)
+
+  def recv_into(self, view):
+    if (len(self.pending) == 0):
+      self.pending = self._next()
+
+    nbytes = min(len(view), len(self.pending))
+    view[0:nbytes] = self.pending[0:nbytes]
+    self.pending = self.pending[nbytes:]
+    return nbytes
+
+  @property
+  def in_waiting(self):
+    return len(self.pending)
+
+  def read(self, size=1):
+    """Up to size bytes, fewer than asked for if that is all the next record has"""
+    if (len(self.pending) == 0):
+      self.pending = self._next()
+
+    (data, self.pending) = (self.pending[0:size], self.pending[size:])
+    return data
+
+  def readline(self):
+    while True:
+      stop = self.pending.find(b'\n')
+      if (stop >= 0):
+        line = self.pending[0:stop + 1]
+        self.pending = self.pending[stop + 1:]
+        return line
+
+      data = self._next()
+      if (len(data) == 0):
+        (line, self.pending) = (self.pending, b'')
+        return line
+
+      self.pending += data
+
+  def close(self):
+    pass
+
+class InputReplay:
+  """A log and the clock its streams share"""
+  def __init__(self, path, speed=1.0):
+    self.log = InputLog(path)
+    self.clock = ReplayClock(self.log.start_time, speed)
+
+  def stream(self, *sources):
+    return ReplayStream(self.log, sources, self.clock)
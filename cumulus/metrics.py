@@ -0,0 +1,130 @@
+#### file: metrics.py
+
+import http.server
+import math
+import threading
+
+# Prometheus text exposition format, version 0.0.4
+# https://prometheus.io/docs/instrumenting/exposition_formats/
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+METRICS_PATH = '/metrics'
+
+DEFAULT_ADDRESS = '127.0.0.1'
+
+def _format_value(value):
+  if (isinstance(value, bool)):
+    return '1' if value else '0'
+  elif (isinstance(value, int)):
+    return str(value)
+  elif (math.isnan(value)):
+    return 'NaN'
+  elif (math.isinf(value)):
+    return '+Inf' if value > 0 else '-Inf'
+
+  return repr(float(value))
+
+def _format_labels(labels):
+  if (len(labels) == 0):
+    return ''
+
+  escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+  return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels.keys(), escaped)) + '}'
+
+class MetricsRegistry:
+  """Metrics read only when scraped
+  Components keep plain counters that only their own thread writes, the registry holds functions which read them,
+  so being measured costs the hot paths nothing and a scrape never waits on the frame loop"""
+  def __init__(self):
+    # name: (type, help, [(labels, function)]), in registration order
+    self.metrics = {}
+    self.lock = threading.Lock()
+
+  def add(self, name, metric_type, help_text, function, labels=None):
+    """Register function as the value of name with labels, replacing what was there for the same labels
+    function returns a number, or None while there is nothing to report. For a summary it returns
+    ({quantile: value}, sum, count), for a histogram ([(upper edge, cumulative count)], sum, count), +Inf last"""
+    labels = dict(labels or {})
+
+    with self.lock:
+      (existing_type, existing_help, samples) = self.metrics.setdefault(name, (metric_type, help_text, []))
+      samples[:] = [(sample_labels, sample_function) for sample_labels, sample_function in samples if sample_labels != labels]
+      samples.append((labels, function))
+
+  def counter(self, name, help_text, function, labels=None):
+    self.add(name, 'counter', help_text, function, labels)
+
+  def gauge(self, name, help_text, function, labels=None):
+    self.add(name, 'gauge', help_text, function, labels)
+
+  def summary(self, name, help_text, function, labels=None):
+    self.add(name, 'summary', help_text, function, labels)
+
+  def histogram(self, name, help_text, function, labels=None):
+    self.add(name, 'histogram', help_text, function, labels)
+
+  def render(self):
+    """Every metric in text exposition format"""
+    with self.lock:
+      metrics = [(name, metric_type, help_text, list(samples)) for name, (metric_type, help_text, samples) in self.metrics.items()]
+
+    lines = []
+    for name, metric_type, help_text, samples in metrics:
+      lines.append(f'# HELP {name} {help_text}')
+      lines.append(f'# TYPE {name} {metric_type}')
+
+      for labels, function in samples:
+        # A broken reader costs its own sample, not the scrape
+        try:
+          value = function()
+        except Exception:
+          continue
+
+        if (value == None):
+          continue
+
+        if (metric_type == 'summary'):
+          (quantiles, total, count) = value
+          for quantile, quantile_value in quantiles.items():
+            lines.append(f'{name}{_format_labels({**labels, "quantile": quantile})} {_format_value(quantile_value)}')
+          lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(total)}')
+          lines.append(f'{name}_count{_format_labels(labels)} {_format_value(count)}')
+        elif (metric_type == 'histogram'):
+          (buckets, total, count) = value
+          for edge, bucket_count in buckets:
+            lines.append(f'{name}_bucket{_format_labels({**labels, "le": _format_value(edge)})} {_format_value(bucket_count)}')
+          lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(total)}')
+          lines.append(f'{name}_count{_format_labels(labels)} {_format_value(count)}')
+        else:
+          lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+
+    return '\n'.join(lines) + '\n'
+
+# The process wide registry, everything registers here and the server serves it
+REGISTRY = MetricsRegistry()
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+  def do_GET(self):
+    if (self.path.split('?')[0] not in (METRICS_PATH, '/')):
+      self.send_error(404)
+      return
+
+    body = self.server.registry.render().encode('utf-8')
+    self.send_response(200)
+    self.send_header('Content-Type', CONTENT_TYPE)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+class MetricsServer(threading.Thread):
+  """Serves a registry over HTTP, one scrape at a time on its own thread"""
+  def __init__(self, port, address=DEFAULT_ADDRESS, registry=REGISTRY):
+    super().__init__(daemon=True)
+
+    self.server = http.server.HTTPServer((address, port), _MetricsHandler)
+    self.server.registry = registry
+
+  def run(self):
+    self.server.serve_forever()
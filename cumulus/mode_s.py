@@ -0,0 +1,280 @@
+#### file: mode_s.py
+
+import math
+
+# Mode S / 1090ES ADS-B decoding
+# https://mode-s.org/decode/ (The 1090MHz Riddle)
+# Only DF17/18 extended squitters are decoded: identification, airborne position,
+# airborne velocity and operational status
+
+MODE_S_LONG_MSG_BYTES = 14
+MODE_S_SHORT_MSG_BYTES = 7
+
+# Value of the receiver field of every update from 1090
+RECEIVER_1090 = 1090
+
+# CRC-24 generator polynomial used by Mode S parity
+CRC24_POLY = 0xfff409
+
+def _create_crc24_table():
+  table = []
+  for i in range(256):
+    crc = i << 16
+    for b in range(8):
+      crc <<= 1
+      if (crc & 0x1000000):
+        crc ^= CRC24_POLY
+    table.append(crc & 0xffffff)
+
+  return tuple(table)
+
+CRC24_TABLE = _create_crc24_table()
+
+def crc24(data):
+  """Mode S parity over data, which should not include the parity bytes"""
+  crc = 0
+  for c in data:
+    crc = ((crc << 8) & 0xffffff) ^ CRC24_TABLE[(crc >> 16) ^ c]
+
+  return crc
+
+def crc24_residual(msg):
+  """Parity of a full message including its parity bytes, 0 for a valid DF17/18"""
+  return crc24(msg[:-3]) ^ int.from_bytes(msg[-3:], 'big')
+
+# Identification character set
+AIS_CHARSET = '#ABCDEFGHIJKLMNOPQRSTUVWXYZ##### ###############0123456789######'
+
+# Navigation Integrity Category implied by the airborne position type code
+# Ambiguous codes (11, 16) take the lower of the two possible values
+NIC_FROM_TYPE_CODE = {9: 11, 10: 10, 11: 8, 12: 7, 13: 6, 14: 5, 15: 4, 16: 2, 17: 1, 18: 0, 20: 11, 21: 10, 22: 0}
+
+# DF18 control field values which carry the DF17 ME format with a 24 bit ICAO address
+DF18_ADSB_CONTROL_FIELDS = (0, 1, 2, 6)
+
+# CPR
+CPR_NZ = 15
+CPR_SCALE = float(1 << 17)
+CPR_DLAT_EVEN = 360.0 / (4 * CPR_NZ)
+CPR_DLAT_ODD = 360.0 / (4 * CPR_NZ - 1)
+
+# Even and odd frames must be at most this far apart for a global decode
+CPR_GLOBAL_MAX_AGE_S = 10
+
+# A previously decoded position is a good enough reference for a local decode for this long
+CPR_LOCAL_MAX_AGE_S = 30
+
+# Per aircraft decoder state is dropped after this long without a message
+DECODER_STATE_TIMEOUT_S = 60
+
+METERS_TO_FT = 3.28084
+
+def cpr_nl(lat):
+  """Number of longitude zones at a given latitude"""
+  lat = abs(lat)
+  if (lat == 0):
+    return 59
+  elif (lat == 87):
+    return 2
+  elif (lat > 87):
+    return 1
+
+  a = 1 - math.cos(math.pi / (2 * CPR_NZ))
+  b = math.cos(math.radians(lat)) ** 2
+  return int(math.floor(2 * math.pi / math.acos(1 - a / b)))
+
+def cpr_global_decode(even, odd, odd_is_newest):
+  """Decode an airborne position from an even/odd pair of raw (lat_cpr, lon_cpr), None if they straddle a zone boundary"""
+  lat_cpr_even = even[0] / CPR_SCALE
+  lon_cpr_even = even[1] / CPR_SCALE
+  lat_cpr_odd = odd[0] / CPR_SCALE
+  lon_cpr_odd = odd[1] / CPR_SCALE
+
+  j = math.floor(59 * lat_cpr_even - 60 * lat_cpr_odd + 0.5)
+
+  lat_even = CPR_DLAT_EVEN * ((j % 60) + lat_cpr_even)
+  lat_odd = CPR_DLAT_ODD * ((j % 59) + lat_cpr_odd)
+
+  if (lat_even >= 270):
+    lat_even -= 360
+  if (lat_odd >= 270):
+    lat_odd -= 360
+
+  nl = cpr_nl(lat_even)
+  if (nl != cpr_nl(lat_odd)):
+    return None
+
+  m = math.floor(lon_cpr_even * (nl - 1) - lon_cpr_odd * nl + 0.5)
+
+  if (odd_is_newest):
+    lat = lat_odd
+    ni = max(nl - 1, 1)
+    lon = (360.0 / ni) * ((m % ni) + lon_cpr_odd)
+  else:
+    lat = lat_even
+    ni = max(nl, 1)
+    lon = (360.0 / ni) * ((m % ni) + lon_cpr_even)
+
+  if (lon >= 180):
+    lon -= 360
+
+  return (lat, lon)
+
+def cpr_local_decode(lat_cpr, lon_cpr, odd, reference):
+  """Decode an airborne position from a single frame, relative to a reference position within 180 NM"""
+  lat_cpr = lat_cpr / CPR_SCALE
+  lon_cpr = lon_cpr / CPR_SCALE
+  (lat_ref, lon_ref) = reference
+
+  dlat = CPR_DLAT_ODD if odd else CPR_DLAT_EVEN
+  j = math.floor(lat_ref / dlat) + math.floor((lat_ref % dlat) / dlat - lat_cpr + 0.5)
+  lat = dlat * (j + lat_cpr)
+
+  ni = max(cpr_nl(lat) - (1 if odd else 0), 1)
+  dlon = 360.0 / ni
+  m = math.floor(lon_ref / dlon) + math.floor((lon_ref % dlon) / dlon - lon_cpr + 0.5)
+  lon = dlon * (m + lon_cpr)
+
+  return (lat, lon)
+
+def _me_bits(me, start, stop):
+  """Extract ME bits [start, stop), numbered from the MSB as in the spec"""
+  return (me >> (56 - stop)) & ((1 << (stop - start)) - 1)
+
+class ModeSDecoder:
+  """Decodes DF17/18 extended squitters into target updates, keeping the per aircraft CPR state that needs"""
+  def __init__(self):
+    # mode_s_code: {'even': (lat_cpr, lon_cpr, t), 'odd': (...), 'position': (lat, lon, t), 'last_seen': t}
+    self.aircraft = {}
+    self.last_prune = 0
+
+  def decode(self, msg, timestamp):
+    """Decode a 14 byte Mode S message, returns a target update dict or None"""
+    if (len(msg) != MODE_S_LONG_MSG_BYTES):
+      return None
+
+    df = msg[0] >> 3
+    if (df == 18):
+      if ((msg[0] & 0x7) not in DF18_ADSB_CONTROL_FIELDS):
+        return None
+    elif (df != 17):
+      return None
+
+    if (crc24_residual(msg) != 0):
+      return None
+
+    mode_s_code = (msg[1] << 16) | (msg[2] << 8) | msg[3]
+    me = int.from_bytes(msg[4:11], 'big')
+    type_code = me >> 51
+
+    update = {'mode_s_code': mode_s_code, 'last_seen': timestamp}
+
+    if (1 <= type_code <= 4):
+      self._decode_identification(me, type_code, update)
+    elif (9 <= type_code <= 18 or 20 <= type_code <= 22):
+      self._decode_airborne_position(mode_s_code, me, type_code, timestamp, update)
+    elif (type_code == 19):
+      self._decode_airborne_velocity(me, update)
+    elif (type_code == 31):
+      self._decode_operational_status(me, update)
+    else:
+      return None
+
+    # Nothing useful in this message beyond the address
+    if (len(update) == 2):
+      return None
+
+    update['receiver'] = RECEIVER_1090
+    return update
+
+  def prune(self, timestamp):
+    """Drop CPR state for aircraft we have not heard from in a while"""
+    if (timestamp - self.last_prune < DECODER_STATE_TIMEOUT_S):
+      return
+
+    self.last_prune = timestamp
+    for mode_s_code in [k for k, v in self.aircraft.items() if timestamp - v['last_seen'] > DECODER_STATE_TIMEOUT_S]:
+      del self.aircraft[mode_s_code]
+
+  def _decode_identification(self, me, type_code, update):
+    callsign = ''.join(AIS_CHARSET[_me_bits(me, 8 + (6 * x), 14 + (6 * x))] for x in range(0, 8))
+    update['callsign'] = callsign.replace('#', '').strip()
+
+    # ADS-B categories A/B/C map onto GDL90 emitter categories 0-7, 8-15 and 16-23
+    category = _me_bits(me, 5, 8)
+    update['emitter_category'] = ((4 - type_code) * 8) + category if (type_code > 1 and category != 0) else 0
+
+  def _decode_airborne_position(self, mode_s_code, me, type_code, timestamp, update):
+    # Barometric altitude, only the 25 ft (Q bit set) encoding
+    if (type_code <= 18):
+      altitude_code = _me_bits(me, 8, 20)
+      if (altitude_code & 0x10):
+        n = ((altitude_code & 0xfe0) >> 1) | (altitude_code & 0xf)
+        update['altitude'] = (n * 25) - 1000
+
+    update['nic'] = NIC_FROM_TYPE_CODE[type_code]
+
+    odd = _me_bits(me, 21, 22)
+    lat_cpr = _me_bits(me, 22, 39)
+    lon_cpr = _me_bits(me, 39, 56)
+
+    state = self.aircraft.get(mode_s_code)
+    if (state == None):
+      state = {'even': None, 'odd': None, 'position': None, 'last_seen': timestamp}
+      self.aircraft[mode_s_code] = state
+
+    state['last_seen'] = timestamp
+    state['odd' if odd else 'even'] = (lat_cpr, lon_cpr, timestamp)
+
+    position = None
+
+    # Prefer a local decode against our own last position, fall back to a global even/odd decode
+    if (state['position'] != None and timestamp - state['position'][2] < CPR_LOCAL_MAX_AGE_S):
+      position = cpr_local_decode(lat_cpr, lon_cpr, odd, state['position'][0:2])
+    elif (state['even'] != None and state['odd'] != None
+      and abs(state['even'][2] - state['odd'][2]) < CPR_GLOBAL_MAX_AGE_S):
+      position = cpr_global_decode(state['even'], state['odd'], odd)
+
+    if (position == None):
+      return
+
+    state['position'] = (position[0], position[1], timestamp)
+    update['lat'] = position[0]
+    update['lon'] = position[1]
+    update['position_time'] = timestamp
+
+  def _decode_airborne_velocity(self, me, update):
+    subtype = _me_bits(me, 5, 8)
+
+    if (subtype == 1 or subtype == 2):
+      v_ew = _me_bits(me, 14, 24)
+      v_ns = _me_bits(me, 25, 35)
+
+      if (v_ew != 0 and v_ns != 0):
+        scale = 4 if (subtype == 2) else 1
+        v_ew = (v_ew - 1) * scale * (-1 if _me_bits(me, 13, 14) else 1)
+        v_ns = (v_ns - 1) * scale * (-1 if _me_bits(me, 24, 25) else 1)
+
+        update['horizontal_speed'] = int(round(math.hypot(v_ew, v_ns)))
+        update['track'] = int(round(math.degrees(math.atan2(v_ew, v_ns)))) % 360
+    elif (subtype == 3 or subtype == 4):
+      # Airspeed and heading, the best we get without a ground vector
+      if (_me_bits(me, 13, 14)):
+        update['track'] = int(round(_me_bits(me, 14, 24) * (360.0 / 1024))) % 360
+
+      airspeed = _me_bits(me, 25, 35)
+      if (airspeed != 0):
+        update['horizontal_speed'] = (airspeed - 1) * (4 if (subtype == 4) else 1)
+    else:
+      return
+
+    vertical_rate = _me_bits(me, 37, 46)
+    if (vertical_rate != 0):
+      update['vertical_rate'] = (vertical_rate - 1) * 64 * (-1 if _me_bits(me, 36, 37) else 1)
+
+  def _decode_operational_status(self, me, update):
+    # Airborne status only, NACp is present from version 1 on
+    if (_me_bits(me, 5, 8) != 0 or _me_bits(me, 40, 43) == 0):
+      return
+
+    update['nacp'] = _me_bits(me, 44, 48)
@@ -0,0 +1,161 @@
+#### file: mode_s_demod.py
+
+import numpy as np
+
+from . import mode_s
+
+# Mode S receiver working straight on rtl_sdr output at 2 Msps, the classic dump1090 demodulator in NumPy blocks
+# Pulse position modulation at 1 Mbps, so every bit is two samples: high then low is a 1, low then high a 0.
+# Only DF17/18 extended squitters are kept, they are all the traffic table needs
+
+SAMPLE_RATE = 2000000
+SAMPLES_PER_BIT = 2
+
+# 8 us preamble, pulses at 0, 1, 3.5 and 4.5 us
+PREAMBLE_SAMPLES = 16
+MESSAGE_BITS = mode_s.MODE_S_LONG_MSG_BYTES * 8
+MESSAGE_SAMPLES = PREAMBLE_SAMPLES + (MESSAGE_BITS * SAMPLES_PER_BIT)
+
+# Bytes read from rtl_sdr per block, about half a second
+DEFAULT_BLOCK_BYTES = 1 << 21
+
+# Extended squitter downlink formats
+EXTENDED_SQUITTER_DFS = (17, 18)
+
+# Bits after the DF field, the only ones worth fixing: a fixed DF bit would turn noise into a squitter
+CORRECTABLE_FIRST_BIT = 5
+
+def _create_magnitude_table():
+  """Magnitude of every (I, Q) u8 pair, indexed by the pair read as a little endian uint16"""
+  i = (np.arange(1 << 16) & 0xff).astype(np.float32) - np.float32(127.4)
+  q = (np.arange(1 << 16) >> 8).astype(np.float32) - np.float32(127.4)
+  return np.sqrt((i * i) + (q * q)).astype(np.uint16)
+
+MAGNITUDE_TABLE = _create_magnitude_table()
+
+def _create_single_bit_syndromes():
+  """CRC residual of a long message with only bit n set: residual, bit n, for the correctable bits
+  Parity is linear, so a received message whose residual is in here has exactly that bit wrong"""
+  syndromes = {}
+  for bit in range(CORRECTABLE_FIRST_BIT, MESSAGE_BITS):
+    msg = bytearray(mode_s.MODE_S_LONG_MSG_BYTES)
+    msg[bit // 8] = 0x80 >> (bit % 8)
+    syndromes[mode_s.crc24_residual(msg)] = bit
+
+  return syndromes
+
+SINGLE_BIT_SYNDROMES = _create_single_bit_syndromes()
+
+def preamble_candidates(m):
+  """Samples where a Mode S preamble starts with the following quiet period, as in dump1090's detector"""
+  n = len(m) - MESSAGE_SAMPLES
+  if (n <= 0):
+    return np.zeros(0, dtype=np.intp)
+
+  s = [m[x:x + n].astype(np.int32) for x in range(0, PREAMBLE_SAMPLES)]
+
+  # Pulses at 0, 2, 7 and 9, valleys between them
+  shape = ((s[0] > s[1]) & (s[1] < s[2]) & (s[2] > s[3]) & (s[3] < s[0]) & (s[4] < s[0]) & (s[5] < s[0]) & (s[6] < s[0])
+    & (s[7] > s[8]) & (s[8] < s[9]) & (s[9] > s[6]))
+
+  # Nothing as strong as the pulses between the last pulse and the data
+  high = (s[0] + s[2] + s[7] + s[9]) // 6
+  shape &= (s[4] < high) & (s[5] < high) & (s[11] < high) & (s[12] < high) & (s[13] < high) & (s[14] < high)
+
+  return np.flatnonzero(shape)
+
+class ModeSDemodulator:
+  """Turns a stream of 2 Msps rtl_sdr u8 I/Q into CRC checked DF17/18 messages
+  Messages straddling two blocks are found in the next one, the tail of each block is kept until then"""
+  def __init__(self, correct_errors=True):
+    self.correct_errors = correct_errors
+    self.pending = np.zeros(0, dtype=np.uint8)
+
+    # Samples into the pending buffer still covered by the last good message, and samples before pending
+    self.skip_until = 0
+    self.sample_offset = 0
+
+    # Counters
+    self.samples_total = 0
+    self.preambles_total = 0
+    self.messages_total = 0
+    self.corrected_total = 0
+    self.crc_failures_total = 0
+
+  def process(self, iq):
+    """Demodulate a block of interleaved u8 I/Q bytes
+    Returns [(sample number since the start of the stream, 14 byte message)] completed by it"""
+    buffer = np.concatenate((self.pending, np.frombuffer(iq, dtype=np.uint8)))
+    sample_count = len(buffer) // 2
+    self.samples_total += len(iq) // 2
+
+    limit = sample_count - MESSAGE_SAMPLES
+    if (limit <= 0):
+      self.pending = buffer
+      return []
+
+    m = MAGNITUDE_TABLE[buffer[0:sample_count * 2].view('<u2')]
+    candidates = preamble_candidates(m)
+    candidates = candidates[candidates < limit]
+    self.preambles_total += len(candidates)
+
+    # Slice every candidate at once, a bit is 1 when its first half is the stronger
+    data = m[candidates[:, None] + PREAMBLE_SAMPLES + np.arange(MESSAGE_BITS * SAMPLES_PER_BIT)[None, :]]
+    messages = np.packbits(data[:, 0::2] > data[:, 1::2], axis=1)
+
+    # Extended squitters only, DF18 with a control field carrying an ICAO address
+    df = messages[:, 0] >> 3
+    keep = (df == 17) | ((df == 18) & np.isin(messages[:, 0] & 0x7, mode_s.DF18_ADSB_CONTROL_FIELDS))
+
+    results = []
+    skip_until = self.skip_until
+
+    for start, msg in zip(candidates[keep].tolist(), messages[keep]):
+      if (start < skip_until):
+        continue
+
+      msg = bytearray(msg.tobytes())
+      if (not self._check(msg)):
+        continue
+
+      results.append((self.sample_offset + start, bytes(msg)))
+      skip_until = start + MESSAGE_SAMPLES
+
+    self.pending = buffer[limit * 2:]
+    self.skip_until = max(0, skip_until - limit)
+    self.sample_offset += limit
+    return results
+
+  def _check(self, msg):
+    """CRC-24 check, fixing a single bad bit in place if that makes it good"""
+    residual = mode_s.crc24_residual(msg)
+    if (residual == 0):
+      self.messages_total += 1
+      return True
+
+    bit = SINGLE_BIT_SYNDROMES.get(residual) if (self.correct_errors) else None
+    if (bit == None):
+      self.crc_failures_total += 1
+      return False
+
+    msg[bit // 8] ^= 0x80 >> (bit % 8)
+    self.messages_total += 1
+    self.corrected_total += 1
+    return True
+
+def demodulate_file(path, block_bytes=DEFAULT_BLOCK_BYTES):
+  """[(sample number, message)] in a recorded rtl_sdr u8 I/Q file, for checking the receiver offline"""
+  demodulator = ModeSDemodulator()
+  messages = []
+
+  with open(path, 'rb') as iq_file:
+    while True:
+      block = iq_file.read(block_bytes)
+      if (len(block) == 0):
+        break
+
+      messages.extend(demodulator.process(block))
+
+  # Flush whatever is left with a block of silence
+  messages.extend(demodulator.process(bytes([127]) * (MESSAGE_SAMPLES * 2)))
+  return messages
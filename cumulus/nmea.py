@@ -0,0 +1,220 @@
+#### file: nmea.py
+
+# NMEA 0183 sentences a GPS sends: GGA, RMC, VTG, GSA and GNS from any talker (GP, GL, GA, GB, GN)
+# Coordinates are kept as integers of 1e-7 degrees, as far as the sentence has digits
+
+import datetime
+
+# Sentences are at most 82 characters, but some receivers go over with extra precision
+MAX_SENTENCE_LENGTH = 128
+
+DOLLAR = ord('$')
+STAR = ord('*')
+
+# GGA fix quality, and what the GNS mode characters map to
+QUALITY_NONE = 0
+QUALITY_GPS = 1
+QUALITY_DGPS = 2
+GNS_MODE_QUALITY = {ord('N'): 0, ord('A'): 1, ord('D'): 2, ord('P'): 3, ord('R'): 4, ord('F'): 5, ord('E'): 6, ord('M'): 7, ord('S'): 8}
+
+# GSA fix type
+FIX_NONE = 1
+FIX_2D = 2
+FIX_3D = 3
+
+COORDINATE_SCALE = 10000000
+
+# By the number of digits after the point: what splits the digits of [d]ddmm.mmmm, the point left out, into degrees
+# and minutes in units of 10^-digits, and a degree in those units
+DEGREE_UNITS = [100 * (10 ** digits) for digits in range(0, 16)]
+MINUTE_UNITS = [60 * (10 ** digits) for digits in range(0, 16)]
+
+HEMISPHERE_SIGNS = {b'N': 1, b'E': 1, b'S': -1, b'W': -1}
+
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+# The checksum folds the body, as one integer, in half until a byte is left. A few integer operations rather than one
+# Python step per byte, for bodies up to 1024 bits, which covers MAX_SENTENCE_LENGTH
+CHECKSUM_FOLDS = [(bits, (1 << bits) - 1) for bits in (512, 256, 128, 64, 32, 16, 8)]
+
+# Two digit years in RMC dates from here on are 19xx, GPS time starts in 1980
+CENTURY_PIVOT = 80
+
+class NmeaError(ValueError):
+  pass
+
+class ChecksumError(NmeaError):
+  pass
+
+class UnsupportedSentence(NmeaError):
+  pass
+
+def checksum(body):
+  """XOR of the bytes between $ and *"""
+  if (len(body) > MAX_SENTENCE_LENGTH):
+    value = 0
+    for byte in body:
+      value ^= byte
+    return value
+
+  value = int.from_bytes(body, 'little')
+  for (bits, mask) in CHECKSUM_FOLDS:
+    value = (value >> bits) ^ (value & mask)
+
+  return value
+
+def split_sentence(line):
+  """(talker, sentence type, [fields]) of one line (bytes), after checking its checksum"""
+  line = line.strip()
+  length = len(line)
+  if (length < 7 or line[0] != DOLLAR):
+    raise NmeaError('not a sentence')
+  if (length > MAX_SENTENCE_LENGTH):
+    raise NmeaError('too long')
+
+  star = length - 3
+  if (line[star] != STAR):
+    raise ChecksumError('no checksum')
+
+  body = line[1:star]
+  try:
+    expected = int(line[star + 1:], 16)
+  except ValueError:
+    raise ChecksumError('bad checksum field')
+
+  if (checksum(body) != expected):
+    raise ChecksumError('checksum mismatch')
+
+  fields = body.split(b',')
+  address = fields[0]
+  if (len(address) != 5):
+    raise NmeaError('bad address')
+
+  return (address[0:2], address[2:5], fields[1:])
+
+def parse_coordinate(value, hemisphere):
+  """[d]ddmm.mmmm and N/S/E/W to 1e-7 degrees, None if empty"""
+  if (len(value) == 0):
+    return None
+
+  sign = HEMISPHERE_SIGNS.get(hemisphere)
+  if (sign == None):
+    raise NmeaError('bad hemisphere')
+
+  point = value.find(b'.')
+  if (point < 0):
+    (point, digits) = (len(value), 0)
+  else:
+    digits = len(value) - point - 1
+    value = value[0:point] + value[point + 1:]
+  if (point < 3 or digits >= len(MINUTE_UNITS) or not value.isdigit()):
+    raise NmeaError('bad coordinate')
+
+  # Degrees, and minutes in units of 10^-digits, out of the one integer
+  (degrees, minutes) = divmod(int(value), DEGREE_UNITS[digits])
+  unit = MINUTE_UNITS[digits]
+  if (minutes >= unit):
+    raise NmeaError('bad coordinate')
+
+  return sign * ((degrees * COORDINATE_SCALE) + ((minutes * COORDINATE_SCALE) // unit))
+
+def parse_utc(date, utc):
+  """ddmmyy and hhmmss[.ss] to UTC epoch seconds, None if either is empty"""
+  if (len(date) != 6 or len(utc) < 6):
+    return None
+
+  (day, month_year) = divmod(int(date), 10000)
+  (month, year) = divmod(month_year, 100)
+  year += 1900 if (year >= CENTURY_PIVOT) else 2000
+  (hour, minute) = divmod(int(utc[0:4]), 100)
+  second = float(utc[4:])
+  if (not (0 <= hour < 24 and minute < 60 and 0 <= second < 61)):
+    raise NmeaError('bad date or time')
+
+  try:
+    days = datetime.date(year, month, day).toordinal() - EPOCH_ORDINAL
+  except ValueError:
+    raise NmeaError('bad date or time')
+
+  return (days * 86400) + (hour * 3600) + (minute * 60) + second
+
+def _float(value):
+  return float(value) if (len(value) > 0) else None
+
+def _int(value):
+  return int(value) if (len(value) > 0) else None
+
+def _field(fields, index):
+  return fields[index] if (index < len(fields)) else b''
+
+def parse_gga(fields):
+  """{time, lat, lon, quality, satellites, hdop, alt} of a GGA, lat and lon in 1e-7 degrees, alt in meters MSL"""
+  if (len(fields) < 9):
+    raise NmeaError('short GGA')
+
+  return {'time': fields[0], 'lat': parse_coordinate(fields[1], fields[2]), 'lon': parse_coordinate(fields[3], fields[4]),
+    'quality': _int(fields[5]) or QUALITY_NONE, 'satellites': _int(fields[6]), 'hdop': _float(fields[7]), 'alt': _float(fields[8])}
+
+def parse_gns(fields):
+  """Same as parse_gga, the quality is the best of the per constellation mode characters"""
+  if (len(fields) < 9):
+    raise NmeaError('short GNS')
+
+  quality = max((GNS_MODE_QUALITY.get(mode, 0) for mode in fields[5]), default = QUALITY_NONE)
+  return {'time': fields[0], 'lat': parse_coordinate(fields[1], fields[2]), 'lon': parse_coordinate(fields[3], fields[4]),
+    'quality': quality, 'satellites': _int(fields[6]), 'hdop': _float(fields[7]), 'alt': _float(fields[8])}
+
+def parse_rmc(fields):
+  """{time, valid, lat, lon, speed, course, date, utc} of an RMC, speed in knots, utc the date and time in epoch seconds"""
+  if (len(fields) < 9):
+    raise NmeaError('short RMC')
+
+  return {'time': fields[0], 'valid': (fields[1] == b'A'), 'lat': parse_coordinate(fields[2], fields[3]),
+    'lon': parse_coordinate(fields[4], fields[5]), 'speed': _float(fields[6]), 'course': _float(fields[7]), 'date': fields[8],
+    'utc': parse_utc(fields[8], fields[0])}
+
+def parse_vtg(fields):
+  """{course, speed} of a VTG, speed in knots. Old receivers leave out the T/M/N/K unit fields"""
+  if (len(fields) >= 8 and fields[1] == b'T'):
+    (course, speed) = (fields[0], fields[4])
+  elif (len(fields) >= 4):
+    (course, speed) = (fields[0], fields[2])
+  else:
+    raise NmeaError('short VTG')
+
+  return {'course': _float(course), 'speed': _float(speed), 'valid': (_field(fields, 8) != b'N')}
+
+def parse_gsa(fields):
+  """{fix, satellites, pdop, hdop, vdop} of a GSA, fix is FIX_NONE, FIX_2D or FIX_3D"""
+  if (len(fields) < 17):
+    raise NmeaError('short GSA')
+
+  return {'fix': _int(fields[1]) or FIX_NONE, 'satellites': 12 - fields[2:14].count(b''),
+    'pdop': _float(fields[14]), 'hdop': _float(fields[15]), 'vdop': _float(fields[16])}
+
+PARSERS = {
+  b'GGA': parse_gga,
+  b'GNS': parse_gns,
+  b'RMC': parse_rmc,
+  b'VTG': parse_vtg,
+  b'GSA': parse_gsa,
+}
+
+def parse(line):
+  """(sentence type, fields dict) of one line, raises NmeaError (ChecksumError, UnsupportedSentence) if it can't"""
+  (talker, sentence_type, fields) = split_sentence(line)
+
+  parser = PARSERS.get(sentence_type)
+  if (parser == None):
+    raise UnsupportedSentence(sentence_type.decode('ascii', errors = 'replace'))
+
+  try:
+    return (sentence_type, parser(fields))
+  except NmeaError:
+    raise
+  except ValueError as e:
+    raise NmeaError(str(e))
+
+def format_sentence(body):
+  """$body*hh\\r\\n, body being str without the $"""
+  return f'${body}*{checksum(body.encode("ascii")):02X}\r\n'.encode('ascii')
@@ -1,85 +1,203 @@
-
 import socket
 import threading
 import time
 import serial
 import struct
-import pynmea2
 from collections import namedtuple
 
+from . import input_log
+from . import nmea
+
 RECONNECT_WAIT_TIME = 1
 SERIAL_TIMEOUT = 10
 
 GPS_TIMEOUT = 5
 
-GPS_SITUATION_TUPLE = namedtuple('GosSituation', ['lat', 'lon', 'alt', 'course', 'h_speed'])
+# alt in meters MSL, h_speed in knots. What only some receivers give is None without them: v_speed in m/s up,
+# geo_alt in meters above the ellipsoid, nacp the navigation accuracy category, vertical_merit in meters
+GPS_SITUATION_TUPLE = namedtuple('GosSituation', ['lat', 'lon', 'alt', 'course', 'h_speed', 'v_speed', 'geo_alt', 'nacp', 'vertical_merit'],
+  defaults = (None, None, None, None))
+
+# Everything known about the fix, replaced as a whole whenever a sentence changes it so readers never see half of one
+# position_time and velocity_time are when the last GGA/GNS and RMC/VTG came in, quality is the GGA fix quality,
+# fix the GSA fix type, lat/lon in 1e-7 degrees, alt in meters, h_speed in knots
+# UBX also gives v_speed (m/s up), geo_alt (meters above the ellipsoid), h_acc and v_acc (meters)
+# fix_time is the UTC time of the last fix from RMC or NAV-PVT, fix_received the time.monotonic() it came in at
+GpsSnapshot = namedtuple('GpsSnapshot', ['position_time', 'velocity_time', 'quality', 'fix', 'lat', 'lon', 'alt',
+  'course', 'h_speed', 'satellites', 'hdop', 'vdop', 'v_speed', 'geo_alt', 'h_acc', 'v_acc', 'fix_time', 'fix_received'],
+  defaults = (None, None, None, None, None, None))
+EMPTY_SNAPSHOT = GpsSnapshot(0, 0, nmea.QUALITY_NONE, nmea.FIX_NONE, 0, 0, 0, 0, 0, 0, None, None)
+
+# NACp by the largest 95% horizontal position error (meters) it allows, DO-260B 2.2.3.2.7.1.3.8
+NACP_LIMITS_M = ((3, 11), (10, 10), (30, 9), (92.6, 8), (185.2, 7), (555.6, 6), (926, 5), (1852, 4), (3704, 3), (7408, 2), (18520, 1))
+
+# Receiver accuracy estimates are taken as one sigma, this makes them a 95% bound
+ACCURACY_95_FACTOR = 2
+
+def navigation_accuracy_category(h_acc):
+  """NACp of a horizontal accuracy estimate in meters"""
+  error = h_acc * ACCURACY_95_FACTOR
+  for limit, nacp in NACP_LIMITS_M:
+    if (error < limit):
+      return nacp
+
+  return 0
 
 class NmeaGpsProvider(threading.Thread):
-  def __init__(self, port, baud):
+  """NMEA from a serial GPS, or with replay from an input_log.ReplayStream in place of the port
+  With a recorder, every line read is logged"""
+  def __init__(self, port, baud, recorder=None, replay=None):
     super().__init__()
 
-    try:
-      self.serial_port = serial.Serial(port, baud, timeout=SERIAL_TIMEOUT)
-    except:
-      pass
+    self.serial_port = None
+    if (replay != None):
+      self.serial_port = replay
+    else:
+      try:
+        self.serial_port = serial.Serial(port, baud, timeout=SERIAL_TIMEOUT)
+      except (serial.SerialException, OSError, ValueError):
+        pass
 
     self.port = port
     self.baud = baud
-    self.situation = {
-      'gga': {'last_update': 0, 'fix': 0, 'lat': 0, 'lon': 0, 'alt': 0, 'h_dop': 0},
-      'rmc': {'last_update': 0, 'h_speed': 0, 'course': 0}
-    }
-    
-  def _process_gga(self, gga):
-    self.situation['gga']['last_update'] = time.time()
-    self.situation['gga']['fix'] = gga.gps_qual
-    self.situation['gga']['lat'] = gga.latitude
-    self.situation['gga']['lon'] = gga.longitude
-    self.situation['gga']['alt'] = gga.altitude
-    #self.situation['gga']['h_dop'] = float(gga.horizontal_dil)
-  
-  def _process_rmc(self, rmc):
-    self.situation['rmc']['last_update'] = time.time()
-    self.situation['rmc']['h_speed'] = rmc.spd_over_grnd
-    self.situation['rmc']['course'] = rmc.true_course
-    
+    self.recorder = recorder
+    self.replay = replay
+    self.snapshot = EMPTY_SNAPSHOT
+
+    # Counters
+    self.reconnects_total = 0
+    self.sentences_total = 0
+    self.checksum_errors_total = 0
+    self.parse_errors_total = 0
+    self.unsupported_total = 0
+
+  def _process_position(self, position, now):
+    # Empty fields keep what was there
+    changes = {name: position[name] for name in ('alt', 'satellites', 'hdop') if position[name] != None}
+    if (position['lat'] != None and position['lon'] != None):
+      changes['lat'] = position['lat']
+      changes['lon'] = position['lon']
+
+    self.snapshot = self.snapshot._replace(position_time = now, quality = position['quality'], **changes)
+
+  def _process_velocity(self, velocity, now):
+    if (not velocity['valid']):
+      return
+
+    # RMC has the date, VTG doesn't
+    if (velocity.get('utc') != None):
+      self.snapshot = self.snapshot._replace(fix_time = velocity['utc'], fix_received = time.monotonic())
+
+    if (velocity['speed'] == None):
+      return
+
+    # No course at a standstill, keep the last one
+    if (velocity['course'] != None):
+      self.snapshot = self.snapshot._replace(velocity_time = now, h_speed = velocity['speed'], course = velocity['course'])
+    else:
+      self.snapshot = self.snapshot._replace(velocity_time = now, h_speed = velocity['speed'])
+
+  def _process_gsa(self, gsa, now):
+    self.snapshot = self.snapshot._replace(fix = gsa['fix'], vdop = gsa['vdop'])
+
+  def has_fix(self, snapshot):
+    return snapshot.quality >= 2
+
+  def fix_age(self, now=None):
+    """Seconds since the last GGA with a fix, None if there has not been one"""
+    snapshot = self.snapshot
+    if (snapshot.position_time == 0 or not self.has_fix(snapshot)):
+      return None
+
+    return (time.time() if now == None else now) - snapshot.position_time
+
+  def utc_time(self, now=None):
+    """UTC by the GPS at time.monotonic() now, None without a recent time from it. Late by however long the
+    receiver takes to send a fix"""
+    snapshot = self.snapshot
+    if (now == None):
+      now = time.monotonic()
+
+    if (snapshot.fix_time == None or now - snapshot.fix_received > GPS_TIMEOUT):
+      return None
+
+    return snapshot.fix_time + (now - snapshot.fix_received)
+
   def get_situation(self):
+    snapshot = self.snapshot
     current_time = time.time()
-    if (current_time - self.situation['gga']['last_update'] > GPS_TIMEOUT
-      or current_time - self.situation['rmc']['last_update'] > GPS_TIMEOUT):
+    if (current_time - snapshot.position_time > GPS_TIMEOUT
+      or current_time - snapshot.velocity_time > GPS_TIMEOUT):
       return None
       
-    if (self.situation['gga']['fix'] < 2):
+    if (not self.has_fix(snapshot)):
       return None
   
-    situation = GPS_SITUATION_TUPLE(self.situation['gga']['lat'],
-      self.situation['gga']['lon'],
-      self.situation['gga']['alt'],
-      self.situation['rmc']['course'],
-      self.situation['rmc']['h_speed'])
+    situation = GPS_SITUATION_TUPLE(snapshot.lat / nmea.COORDINATE_SCALE,
+      snapshot.lon / nmea.COORDINATE_SCALE,
+      snapshot.alt,
+      snapshot.course,
+      snapshot.h_speed,
+      snapshot.v_speed,
+      snapshot.geo_alt,
+      (navigation_accuracy_category(snapshot.h_acc) if snapshot.h_acc != None else None),
+      (int(round(snapshot.v_acc * ACCURACY_95_FACTOR)) if snapshot.v_acc != None else None))
       
     return situation
 
+  def _reopen(self):
+    self.reconnects_total += 1
+    try:
+      self.serial_port = serial.Serial(self.port, self.baud, timeout=SERIAL_TIMEOUT)
+    except (serial.SerialException, OSError, ValueError):
+      pass
+
   def run(self):
     while True:
-      # Read a new byte
       try:
-        new_line = self.serial_port.readline().decode('utf-8')
-      except:
-        try:
-          self.serial_port = serial.Serial(self.port, self.baud, timeout=SERIAL_TIMEOUT)
-        except:
-          pass
+        raw_line = self.serial_port.readline()
+      except (serial.SerialException, OSError, AttributeError, TypeError):
+        # A replay has no port to reopen
+        if (self.replay == None):
+          self._reopen()
         time.sleep(RECONNECT_WAIT_TIME)
         continue
-        
-      if (new_line[0] != '$'):
+
+      # The read timed out, or the replay is over
+      if (len(raw_line) == 0):
         continue
 
-      new_msg = pynmea2.parse(new_line)
-      
-      if (isinstance(new_msg, pynmea2.GGA)):
-        self._process_gga(new_msg)
-      elif (isinstance(new_msg, pynmea2.RMC)):
-        self._process_rmc(new_msg)
-      
\ No newline at end of file
+      if (self.recorder != None):
+        self.recorder.record(input_log.SOURCE_NMEA, raw_line)
+
+      self.process_line(raw_line)
+
+  def process_line(self, new_line):
+    """Parse one NMEA sentence (bytes, or str) and fold it into the snapshot"""
+    if (isinstance(new_line, str)):
+      new_line = new_line.encode('ascii', errors = 'replace')
+
+    if (not new_line.startswith(b'$')):
+      return
+
+    now = time.time()
+    try:
+      (sentence_type, fields) = nmea.parse(new_line)
+    except nmea.ChecksumError:
+      self.checksum_errors_total += 1
+      return
+    except nmea.UnsupportedSentence:
+      self.unsupported_total += 1
+      return
+    except nmea.NmeaError:
+      self.parse_errors_total += 1
+      return
+
+    self.sentences_total += 1
+
+    if (sentence_type == b'GGA' or sentence_type == b'GNS'):
+      self._process_position(fields, now)
+    elif (sentence_type == b'RMC' or sentence_type == b'VTG'):
+      self._process_velocity(fields, now)
+    elif (sentence_type == b'GSA'):
+      self._process_gsa(fields, now)
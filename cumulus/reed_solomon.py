@@ -0,0 +1,163 @@
+#### file: reed_solomon.py
+
+# Reed-Solomon over GF(2^8), the shortened codes UAT uses (DO-282B 2.2.3.3)
+# Byte 0 of a codeword is the highest order coefficient, as in Phil Karn's libfec which dump978 uses,
+# so codewords and parity match dump978 byte for byte
+
+import numpy as np
+
+GF_SIZE = 255
+
+# UAT: x^8 + x^7 + x^2 + x + 1, first consecutive root alpha^120
+UAT_GF_POLY = 0x187
+UAT_FCR = 120
+
+def _create_gf_tables(poly):
+  exp = [0] * (GF_SIZE * 2)
+  log = [0] * (GF_SIZE + 1)
+
+  x = 1
+  for i in range(0, GF_SIZE):
+    exp[i] = x
+    log[x] = i
+    x <<= 1
+    if (x & 0x100):
+      x ^= poly
+
+  # Doubled so products of two logs never need a modulo
+  for i in range(GF_SIZE, GF_SIZE * 2):
+    exp[i] = exp[i - GF_SIZE]
+
+  return (tuple(exp), tuple(log))
+
+GF_EXP, GF_LOG = _create_gf_tables(UAT_GF_POLY)
+GF_EXP_ARRAY = np.array(GF_EXP, dtype=np.uint8)
+GF_LOG_ARRAY = np.array(GF_LOG, dtype=np.int32)
+
+def gf_mul(a, b):
+  if (a == 0 or b == 0):
+    return 0
+
+  return GF_EXP[GF_LOG[a] + GF_LOG[b]]
+
+def gf_div(a, b):
+  if (a == 0):
+    return 0
+
+  return GF_EXP[(GF_LOG[a] - GF_LOG[b]) % GF_SIZE]
+
+def _poly_eval(poly, x):
+  """Evaluate a polynomial given lowest order coefficient first"""
+  result = 0
+  for coefficient in reversed(poly):
+    result = gf_mul(result, x) ^ coefficient
+
+  return result
+
+class ReedSolomon:
+  """RS(n, n - nroots) over GF(2^8), shortened to n = data_bytes + nroots"""
+  def __init__(self, data_bytes, nroots, fcr=UAT_FCR):
+    self.data_bytes = data_bytes
+    self.nroots = nroots
+    self.n = data_bytes + nroots
+    self.fcr = fcr
+
+    # Generator polynomial, highest order coefficient first, product of (x - alpha^(fcr + i))
+    generator = [1]
+    for i in range(0, nroots):
+      root = GF_EXP[(fcr + i) % GF_SIZE]
+      generator = [a ^ gf_mul(b, root) for a, b in zip(generator + [0], [0] + generator)]
+    self.generator = generator
+
+    # log of alpha^((fcr + i) * (n - 1 - j)), syndrome i's weight for byte j
+    self.syndrome_logs = ((fcr + np.arange(nroots)[:, None]) * (self.n - 1 - np.arange(self.n)[None, :])) % GF_SIZE
+
+  def encode(self, data):
+    """Parity bytes for data"""
+    parity = [0] * self.nroots
+    generator = self.generator
+
+    for byte in data:
+      feedback = byte ^ parity[0]
+      parity = parity[1:] + [0]
+      if (feedback != 0):
+        for i in range(0, self.nroots):
+          parity[i] ^= gf_mul(feedback, generator[i + 1])
+
+    return bytes(parity)
+
+  def syndromes(self, codeword):
+    """Codeword evaluated at each root, every one in a single table lookup pass"""
+    codeword = np.frombuffer(bytes(codeword), dtype=np.uint8)
+    nonzero = np.flatnonzero(codeword)
+    terms = GF_EXP_ARRAY[(GF_LOG_ARRAY[codeword[nonzero]][None, :] + self.syndrome_logs[:, nonzero]) % GF_SIZE]
+
+    return np.bitwise_xor.reduce(terms, axis=1).tolist() if (len(nonzero) > 0) else [0] * self.nroots
+
+  def decode(self, codeword):
+    """Correct a codeword in place (a bytearray of n bytes)
+    Returns the number of corrected bytes, or -1 if there are more errors than the code can correct"""
+    syndromes = self.syndromes(codeword)
+    if (not any(syndromes)):
+      return 0
+
+    # Berlekamp-Massey for the error locator, lowest order coefficient first
+    locator = [1]
+    previous = [1]
+    errors = 0
+    shift = 1
+    previous_discrepancy = 1
+
+    for n in range(0, self.nroots):
+      discrepancy = syndromes[n]
+      for i in range(1, errors + 1):
+        discrepancy ^= gf_mul(locator[i], syndromes[n - i])
+
+      if (discrepancy == 0):
+        shift += 1
+        continue
+
+      scale = gf_div(discrepancy, previous_discrepancy)
+      adjusted = locator + [0] * max(0, len(previous) + shift - len(locator))
+      for i, coefficient in enumerate(previous):
+        adjusted[i + shift] ^= gf_mul(scale, coefficient)
+
+      if (2 * errors <= n):
+        (previous, errors, previous_discrepancy, shift) = (locator, n + 1 - errors, discrepancy, 1)
+      else:
+        shift += 1
+
+      locator = adjusted
+
+    if (2 * errors > self.nroots):
+      return -1
+
+    # Chien search over the positions the shortened code has, byte j is the coefficient of x^(n - 1 - j)
+    positions = []
+    for j in range(0, self.n):
+      if (_poly_eval(locator, GF_EXP[(GF_SIZE - (self.n - 1 - j)) % GF_SIZE]) == 0):
+        positions.append(j)
+
+    if (len(positions) != errors):
+      return -1
+
+    # Forney, with the error evaluator Omega = S * Lambda mod x^nroots
+    evaluator = [0] * self.nroots
+    for i, s in enumerate(syndromes):
+      for k, coefficient in enumerate(locator[0:self.nroots - i]):
+        evaluator[i + k] ^= gf_mul(s, coefficient)
+
+    derivative = [locator[i] if (i % 2 == 1) else 0 for i in range(1, len(locator))]
+
+    for j in positions:
+      power = self.n - 1 - j
+      x_inverse = GF_EXP[(GF_SIZE - power) % GF_SIZE]
+      denominator = _poly_eval(derivative, x_inverse)
+      if (denominator == 0):
+        return -1
+
+      # e = X^(1 - fcr) * Omega(X^-1) / Lambda'(X^-1)
+      magnitude = gf_mul(GF_EXP[(power * (1 - self.fcr)) % GF_SIZE], gf_div(_poly_eval(evaluator, x_inverse), denominator))
+      codeword[j] ^= magnitude
+
+    return len(positions)
@@ -0,0 +1,153 @@
+#### file: report_scheduler.py
+
+import heapq
+import math
+import numpy as np
+
+NM_TO_SM = 1.15078
+
+class ReportTier:
+  def __init__(self, max_distance, max_relative_altitude, interval):
+    # Statute miles and feet, inf for no limit
+    self.max_distance = max_distance
+    self.max_relative_altitude = max_relative_altitude
+    self.interval = interval
+
+    # Counters
+    self.reports_total = 0
+    self.skipped_total = 0
+
+  def __str__(self):
+    distance = '*' if math.isinf(self.max_distance) else f'{self.max_distance / NM_TO_SM:g}nm'
+    altitude = '*' if math.isinf(self.max_relative_altitude) else f'{self.max_relative_altitude:g}ft'
+    return f'{distance}/{altitude}@{self.interval:g}s'
+
+def parse_report_tiers(spec):
+  """Parse '2:0.25, 10/5000:1, *:5' into ReportTiers
+  Each entry is <range nm>[/<relative altitude ft>]:<report interval s>, '*' means no limit.
+  The first matching tier wins, targets matching none (or with no known distance) use the last one"""
+  tiers = []
+
+  for entry in spec.split(','):
+    entry = entry.strip()
+    if (len(entry) == 0):
+      continue
+
+    (limits, interval) = entry.split(':')
+    (distance, altitude) = (limits.split('/') + ['*'])[0:2]
+
+    tiers.append(ReportTier(math.inf if distance.strip() == '*' else float(distance) * NM_TO_SM,
+      math.inf if altitude.strip() == '*' else float(altitude),
+      float(interval)))
+
+  if (len(tiers) == 0):
+    raise ValueError(f'No report tiers in "{spec}"')
+
+  return tiers
+
+class ReportScheduler:
+  """Decides when each target is reported next, from its distance and relative altitude
+  Deadlines live in a heap, so a frame only looks at the targets that are due. Entries are invalidated
+  lazily: a heap entry only counts if it still matches the target's current deadline
+  Each deadline is a tier interval after the last one, not after the report, so reports keep to the tier's rate
+  however late in its frame each one went out. With a frame_period, a target due within half a frame is reported in
+  this frame rather than the next, so frame jitter doesn't cost a whole frame"""
+  def __init__(self, tiers, frame_period=0):
+    self.tiers = tiers
+    self.tolerance = frame_period / 2
+    self.tier_distance = np.array([tier.max_distance for tier in tiers])
+    self.tier_altitude = np.array([tier.max_relative_altitude for tier in tiers])
+    self.tier_interval = np.array([tier.interval for tier in tiers])
+
+    # (deadline, mode_s_code)
+    self.heap = []
+
+    # mode_s_code: deadline
+    self.deadlines = {}
+
+  def __len__(self):
+    return len(self.deadlines)
+
+  def add(self, mode_s_codes, now):
+    """New targets are due straight away"""
+    for mode_s_code in mode_s_codes:
+      self.deadlines[mode_s_code] = now
+      heapq.heappush(self.heap, (now, mode_s_code))
+
+  def remove(self, mode_s_codes):
+    for mode_s_code in mode_s_codes:
+      self.deadlines.pop(mode_s_code, None)
+
+  def next_deadline(self):
+    self._drop_stale()
+    return self.heap[0][0] if (len(self.heap) > 0) else None
+
+  def _drop_stale(self):
+    heap = self.heap
+    while (len(heap) > 0 and self.deadlines.get(heap[0][1]) != heap[0][0]):
+      heapq.heappop(heap)
+
+  def pop_due(self, now):
+    """mode_s_codes of every target whose deadline has passed, or is within the tolerance"""
+    due = []
+    heap = self.heap
+    now += self.tolerance
+
+    while (len(heap) > 0 and heap[0][0] <= now):
+      (deadline, mode_s_code) = heapq.heappop(heap)
+      if (self.deadlines.get(mode_s_code) == deadline):
+        due.append(mode_s_code)
+
+    return due
+
+  def assign_tiers(self, distance, relative_altitude):
+    """Tier index per target, unknown distance (NaN) only matches an unlimited tier"""
+    distance = np.where(np.isnan(distance), math.inf, distance)
+    match = (distance[:, None] <= self.tier_distance[None, :]) & (relative_altitude[:, None] <= self.tier_altitude[None, :])
+
+    # First matching tier, the last one if none match
+    return np.where(match.any(axis=1), match.argmax(axis=1), len(self.tiers) - 1)
+
+  def take_due_reports(self, target_table, now, own_altitude=None, exclude_mode_s_code=None, relevant_rows=None, nearest_first=False, max_extrapolation_age=0):
+    """Report every due target which has new data, then schedule each due target's next report by its tier
+    With a max_extrapolation_age, due targets are also reported without new data while their position can be extrapolated
+    Returns the target dicts to encode"""
+    due_codes = [mode_s_code for mode_s_code in self.pop_due(now) if mode_s_code in target_table]
+    if (len(due_codes) == 0):
+      return []
+
+    rows = np.array([target_table.index[mode_s_code] for mode_s_code in due_codes], dtype=np.intp)
+
+    distance = target_table.columns['distance'][rows]
+    if (own_altitude == None):
+      relative_altitude = np.full(len(rows), math.inf)
+    else:
+      relative_altitude = np.abs(target_table.columns['altitude'][rows] - own_altitude).astype(np.float64)
+    tier_indexes = self.assign_tiers(distance, relative_altitude)
+
+    # Schedule the next report of every due target, whether or not it has anything new
+    # A target more than an interval behind (a stall, a tier change) starts again from now rather than catching up
+    previous = np.array([self.deadlines[mode_s_code] for mode_s_code in due_codes])
+    deadlines = np.maximum(previous + self.tier_interval[tier_indexes], now)
+    for mode_s_code, deadline in zip(due_codes, deadlines.tolist()):
+      self.deadlines[mode_s_code] = deadline
+      heapq.heappush(self.heap, (deadline, mode_s_code))
+
+    report_rows = rows if (relevant_rows is None) else np.intersect1d(rows, relevant_rows)
+    if (max_extrapolation_age > 0):
+      targets = target_table.take_rows(report_rows, exclude_mode_s_code = exclude_mode_s_code, now = now,
+        nearest_first = nearest_first, max_extrapolation_age = max_extrapolation_age)
+    else:
+      targets = target_table.take_updated(exclude_mode_s_code = exclude_mode_s_code, rows = report_rows, nearest_first = nearest_first)
+
+    # Per tier counters
+    reported = np.zeros(len(rows), dtype=bool)
+    if (len(targets) > 0):
+      reported = np.isin(rows, [target_table.index[target['mode_s_code']] for target in targets])
+
+    for tier_index, (sent, total) in enumerate(zip(np.bincount(tier_indexes[reported], minlength=len(self.tiers)).tolist(),
+      np.bincount(tier_indexes, minlength=len(self.tiers)).tolist())):
+      self.tiers[tier_index].reports_total += sent
+      self.tiers[tier_index].skipped_total += total - sent
+
+    return targets
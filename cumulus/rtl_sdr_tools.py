@@ -7,25 +7,183 @@ import subprocess
 import re
 
 RTL_EEPROM_TIMEOUT = 90
-def get_rtl_sdr_index_from_serial(serial):
-  # Get the number of rtl_sdrs connected
-  first_query = subprocess.run(['rtl_eeprom'], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=RTL_EEPROM_TIMEOUT).stderr.decode('utf-8')
-  device_count = int(re.match('Found [0-9][0-9]*', first_query)[0].split(' ')[1])
 
-  # For each index, check if the serial number matches
-  for x in range(0, device_count):
-    device_query = subprocess.run(['rtl_eeprom', f'-d{x:d}'], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=RTL_EEPROM_TIMEOUT).stderr.decode('utf-8')
+SYSFS_USB_DEVICES = '/sys/bus/usb/devices'
+
+# (vendor id, product id) of the RTL2832U dongles librtlsdr opens, from its known_devices table
+RTL_SDR_USB_IDS = frozenset((
+  (0x0bda, 0x2832), (0x0bda, 0x2838), (0x0413, 0x6680), (0x0413, 0x6f0f), (0x0458, 0x707f),
+  (0x0ccd, 0x00a9), (0x0ccd, 0x00b3), (0x0ccd, 0x00b4), (0x0ccd, 0x00b5), (0x0ccd, 0x00b7),
+  (0x0ccd, 0x00b8), (0x0ccd, 0x00b9), (0x0ccd, 0x00c0), (0x0ccd, 0x00c6), (0x0ccd, 0x00d3),
+  (0x0ccd, 0x00d7), (0x0ccd, 0x00e0), (0x1554, 0x5020), (0x15f4, 0x0131), (0x15f4, 0x0133),
+  (0x185b, 0x0620), (0x185b, 0x0650), (0x185b, 0x0680), (0x1b80, 0xd393), (0x1b80, 0xd394),
+  (0x1b80, 0xd395), (0x1b80, 0xd397), (0x1b80, 0xd398), (0x1b80, 0xd39d), (0x1b80, 0xd3a4),
+  (0x1b80, 0xd3a8), (0x1b80, 0xd3af), (0x1b80, 0xd3b0), (0x1d19, 0x1101), (0x1d19, 0x1102),
+  (0x1d19, 0x1103), (0x1d19, 0x1104), (0x1f4d, 0xa803), (0x1f4d, 0xb803), (0x1f4d, 0xc803),
+  (0x1f4d, 0xd286), (0x1f4d, 0xd803),
+))
+
+UsbDevice = collections.namedtuple('UsbDevice', ['busnum', 'devnum', 'vendor', 'product', 'serial'])
+
+def _read_sysfs(path, name):
+  try:
+    with open(os.path.join(path, name), 'r') as sysfs_file:
+      return sysfs_file.read().strip()
+  except OSError:
+    return None
 
-    # Find "Serial number:          xxxxxxxx"
-    serial_string_pattern = 'Serial number:\t\t' + '[0-9]'*8
+def list_rtl_sdr_devices(sysfs_root=SYSFS_USB_DEVICES):
+  """RTL2832U devices plugged in, from their USB descriptors in sysfs, in the order librtlsdr numbers them
+  None if there is no sysfs to read"""
+  try:
+    entries = os.listdir(sysfs_root)
+  except OSError:
+    return None
 
+  devices = []
+  for entry in entries:
+    # Interfaces (1-1.2:1.0) have no descriptors of their own
+    if (':' in entry):
+      continue
+
+    path = os.path.join(sysfs_root, entry)
     try:
-      match = re.findall(serial_string_pattern, device_query)[0]
-      device_serial = int(match.split('\t\t')[1])
-    except:
+      vendor = int(_read_sysfs(path, 'idVendor'), 16)
+      product = int(_read_sysfs(path, 'idProduct'), 16)
+      busnum = int(_read_sysfs(path, 'busnum'))
+      devnum = int(_read_sysfs(path, 'devnum'))
+    except (TypeError, ValueError):
       continue
 
-    if (serial == device_serial):
-      return x
+    if ((vendor, product) in RTL_SDR_USB_IDS):
+      devices.append(UsbDevice(busnum, devnum, vendor, product, _read_sysfs(path, 'serial')))
+
+  # libusb lists devices by bus and address, librtlsdr's index counts the dongles in that list
+  devices.sort(key=lambda device: (device.busnum, device.devnum))
+  return devices
+
+def _parse_serial(serial):
+  try:
+    return int(serial)
+  except (TypeError, ValueError):
+    return None
+
+def query_rtl_eeprom_device_count():
+  """Number of rtl_sdrs connected according to rtl_eeprom"""
+  first_query = subprocess.run(['rtl_eeprom'], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=RTL_EEPROM_TIMEOUT).stderr.decode('utf-8')
+  return int(re.match('Found [0-9][0-9]*', first_query)[0].split(' ')[1])
+
+def query_rtl_eeprom_serial(index):
+  """Serial number of the rtl_sdr at index according to rtl_eeprom, None if it can't be read (busy or not there)"""
+  device_query = subprocess.run(['rtl_eeprom', f'-d{index:d}'], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=RTL_EEPROM_TIMEOUT).stderr.decode('utf-8')
+
+  # Find "Serial number:          xxxxxxxx"
+  serial_string_pattern = 'Serial number:\t\t' + '[0-9]'*8
+
+  try:
+    match = re.findall(serial_string_pattern, device_query)[0]
+    return int(match.split('\t\t')[1])
+  except:
+    return None
+
+class SdrDiscovery:
+  """Serial number to device index map of the plugged in rtl_sdrs
+  The map comes from the USB descriptors in sysfs and is kept until the set of devices there changes (a replugged
+  device comes back with a new address), so a lookup costs a directory listing instead of an rtl_eeprom run per device.
+  rtl_eeprom is still run to check the index when there is more than one dongle to order, and for the whole map
+  if that check fails, serials are missing from sysfs, or there is no sysfs"""
+  def __init__(self, sysfs_root=SYSFS_USB_DEVICES, query_count=query_rtl_eeprom_device_count, query_serial=query_rtl_eeprom_serial):
+    self.sysfs_root = sysfs_root
+    self.query_count = query_count
+    self.query_serial = query_serial
+    self.lock = threading.Lock()
+
+    # Devices the map was made from, serial: index, and the serials whose index rtl_eeprom agreed with
+    self.devices = None
+    self.serial_to_index = {}
+    self.verified = set()
+
+    # Counters
+    self.lookups_total = 0
+    self.refreshes_total = 0
+    self.eeprom_scans_total = 0
+
+  def invalidate(self):
+    with self.lock:
+      self.devices = None
+      self.serial_to_index = {}
+      self.verified = set()
+
+  def _scan_eeprom(self):
+    """serial: index from rtl_eeprom, one run per device"""
+    self.eeprom_scans_total += 1
+    serial_to_index = {}
+    for x in range(0, self.query_count()):
+      device_serial = self.query_serial(x)
+      if (device_serial != None):
+        serial_to_index.setdefault(device_serial, x)
+
+    return serial_to_index
+
+  def _refresh(self, devices):
+    self.refreshes_total += 1
+    self.devices = devices
+    self.serial_to_index = {}
+    self.verified = set()
+
+    serials = [_parse_serial(device.serial) for device in devices]
+    if (None in serials or len(set(serials)) != len(serials)):
+      self._use_eeprom_scan()
+      return
+
+    self.serial_to_index = {serial: x for x, serial in enumerate(serials)}
+
+    # Only one way to order a single dongle
+    if (len(devices) == 1):
+      self.verified.update(serials)
+
+  def _use_eeprom_scan(self):
+    self.serial_to_index = self._scan_eeprom()
+    self.verified = set(self.serial_to_index.keys())
+
+  def get_index(self, serial):
+    """Index of the rtl_sdr with serial number serial, None if it isn't plugged in"""
+    with self.lock:
+      self.lookups_total += 1
+      devices = list_rtl_sdr_devices(self.sysfs_root)
+
+      # No sysfs, nothing to cache against
+      if (devices == None):
+        return self._scan_eeprom().get(serial)
+
+      if (devices != self.devices):
+        self._refresh(devices)
+
+      # The first time a serial is looked up, check the order against the device itself
+      index = self.serial_to_index.get(serial)
+      if (index != None and serial not in self.verified):
+        if (self.query_serial(index) == serial):
+          self.verified.add(serial)
+        else:
+          self._use_eeprom_scan()
+          index = self.serial_to_index.get(serial)
+
+      return index
+
+# The process wide discovery, shared by everything looking for its SDR
+DISCOVERY = SdrDiscovery()
+
+def get_rtl_sdr_index_from_serial(serial):
+  return DISCOVERY.get_index(serial)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='List the rtl_sdrs plugged in, from sysfs')
+  parser.add_argument('--sysfs-root', help='USB devices directory', default=SYSFS_USB_DEVICES)
+  args = parser.parse_args()
 
-  return None
\ No newline at end of file
+  devices = list_rtl_sdr_devices(args.sysfs_root)
+  if (devices == None):
+    print(f'Could not read {args.sysfs_root}')
+  else:
+    for x, device in enumerate(devices):
+      print(f'{x:d}: bus {device.busnum:03d} device {device.devnum:03d} {device.vendor:04x}:{device.product:04x} serial {device.serial}')
\ No newline at end of file
@@ -0,0 +1,358 @@
+#### file: supervisor.py
+
+import collections
+import os
+import signal
+import subprocess
+import threading
+import time
+
+from . import rtl_sdr_tools
+from . import metrics
+from .event_log import LOG
+
+# Restart delays, doubling from the first to the most after every failure in a row
+BACKOFF_INITIAL_S = 0.5
+BACKOFF_MAX_S = 30
+BACKOFF_FACTOR = 2
+
+# A pipeline which ran this long before it failed starts its backoff over
+STABLE_RUN_S = 60
+
+# SDR lookups are a sysfs read, so a missing SDR is looked for again soon
+DEVICE_WAIT_S = 1
+
+# No output for this long and the pipeline is restarted. I/Q from rtl_sdr never stops while the SDR works, but dump1090
+# and dump978 only print what they decode, which is nothing for as long as nothing is in range, so for them it is off
+# (0) unless configured
+DEFAULT_LIVENESS_TIMEOUT_S = 0
+IQ_LIVENESS_TIMEOUT_S = 5
+LIVENESS_CHECK_PERIOD_S = 1
+
+# Time a process gets to exit after SIGTERM before it is killed
+STOP_TIMEOUT_S = 2
+
+# Restart latencies kept for percentiles
+RECENT_RESTARTS = 64
+RESTART_LATENCY_QUANTILES = (0.5, 0.9)
+
+def _signal_group(process, signum):
+  """Signal process and anything it started, which could otherwise hold its output pipe open"""
+  try:
+    os.killpg(process.pid, signum)
+  except (ProcessLookupError, PermissionError):
+    pass
+
+class Backoff:
+  """Exponential restart delay"""
+  def __init__(self, initial=BACKOFF_INITIAL_S, maximum=BACKOFF_MAX_S, factor=BACKOFF_FACTOR):
+    self.initial = initial
+    self.maximum = maximum
+    self.factor = factor
+    self.reset()
+
+  def reset(self):
+    self.delay = self.initial
+
+  def next(self):
+    """Seconds to wait before the next attempt"""
+    delay = self.delay
+    self.delay = min(self.delay * self.factor, self.maximum)
+    return delay
+
+class SupervisedPipeline:
+  """External receiver processes on the SDR with serial number device_sn, each one's stdout piped into the next
+  commands(device_index) gives their argument lists. consume(stream) reads the last one's stdout until it ends, without
+  it the output is discarded. activity() gives a running count of output (bytes, messages), the pipeline is restarted
+  once it stops going up for liveness_timeout. Restarts back off exponentially until a run lasts STABLE_RUN_S"""
+  def __init__(self, name, device_sn, commands, consume=None, activity=None, liveness_timeout=None, backoff=None):
+    self.name = name
+    self.device_sn = device_sn
+    self.commands = commands
+    self.consume = consume
+    self.activity = activity
+    self.liveness_timeout = liveness_timeout
+    self.backoff = backoff
+
+    self.processes = []
+    self.lock = threading.Lock()
+    self.stopping = threading.Event()
+
+    # Liveness, and when the output stopped for the restart latency
+    self.last_activity = None
+    self.last_activity_time = None
+    self.started_at = None
+    self.failed_at = None
+
+    # Counters
+    self.starts_total = 0
+    self.restarts_total = 0
+    self.liveness_kills_total = 0
+    self.restart_latency_sum = 0.0
+    self.restart_latency_count = 0
+    self.restart_latencies = collections.deque(maxlen=RECENT_RESTARTS)
+    self.first_output_latency = None
+
+  def run(self):
+    """Start, wait for and restart the pipeline until stop(), on the caller's thread"""
+    if (self.backoff == None):
+      self.backoff = Backoff()
+    self.started_at = time.monotonic()
+
+    while (not self.stopping.is_set()):
+      device_index = self._wait_for_device()
+      if (device_index == None):
+        return
+
+      try:
+        processes = self._start(device_index)
+      except OSError as e:
+        LOG.error(self.name, '%s: Could not start: %s', self.name, e)
+        self._failed(time.monotonic())
+        continue
+
+      LOG.info(self.name, '%s: Using device %d', self.name, device_index)
+      run_start = time.monotonic()
+
+      try:
+        if (self.consume != None):
+          self.consume(processes[-1].stdout)
+        else:
+          processes[-1].wait()
+      except (OSError, ValueError):
+        # Stopped under the reader
+        pass
+
+      self._kill()
+      if (self.stopping.is_set()):
+        return
+
+      # A short run may have come and gone between liveness checks
+      now = time.monotonic()
+      with self.lock:
+        self._sample_activity(now)
+
+      LOG.warning(self.name, '%s exited after %.1fs', self.name, now - run_start)
+      if (now - run_start >= STABLE_RUN_S):
+        self.backoff.reset()
+      self._failed(now)
+
+  def _wait_for_device(self):
+    while (not self.stopping.is_set()):
+      try:
+        device_index = rtl_sdr_tools.get_rtl_sdr_index_from_serial(self.device_sn)
+      except (OSError, subprocess.SubprocessError):
+        device_index = None
+
+      if (device_index != None):
+        return device_index
+
+      self.stopping.wait(DEVICE_WAIT_S)
+
+    return None
+
+  def _start(self, device_index):
+    """Start every process in the pipeline, returns them"""
+    commands = self.commands(device_index)
+    processes = []
+    stdin = None
+
+    try:
+      for x, command in enumerate(commands):
+        last = (x == len(commands) - 1)
+        process = subprocess.Popen(command,
+          stdin=stdin,
+          stdout=(subprocess.PIPE if (not last or self.consume != None) else subprocess.DEVNULL),
+          stderr=subprocess.DEVNULL,
+          shell=False,
+          start_new_session=True)
+
+        # The next process owns the read end now, so a dead reader takes the writer down with SIGPIPE
+        if (stdin != None):
+          stdin.close()
+        stdin = process.stdout
+        processes.append(process)
+    except OSError:
+      for process in processes:
+        _signal_group(process, signal.SIGKILL)
+        process.wait()
+      raise
+
+    with self.lock:
+      self.processes = processes
+      self.last_activity = (self.activity() if self.activity != None else None)
+      self.last_activity_time = time.monotonic()
+      self.starts_total += 1
+
+    # Without a way to see output, running again is as good as it gets
+    if (self.activity == None):
+      self._output_seen(time.monotonic())
+
+    return processes
+
+  def _failed(self, now):
+    self.restarts_total += 1
+    if (self.failed_at == None):
+      self.failed_at = now
+
+    self.stopping.wait(self.backoff.next())
+
+  def _output_seen(self, now):
+    if (self.first_output_latency == None):
+      self.first_output_latency = now - self.started_at
+
+    if (self.failed_at != None):
+      latency = now - self.failed_at
+      self.failed_at = None
+      self.restart_latency_sum += latency
+      self.restart_latency_count += 1
+      self.restart_latencies.append(latency)
+
+  def _sample_activity(self, now):
+    """True if there was output since the last sample"""
+    if (self.activity == None):
+      return False
+
+    activity = self.activity()
+    if (activity == self.last_activity):
+      return False
+
+    self.last_activity = activity
+    self.last_activity_time = now
+    self._output_seen(now)
+    return True
+
+  def check_liveness(self, now):
+    """Kill the pipeline if its output stopped, the run loop then restarts it"""
+    if (self.activity == None):
+      return
+
+    with self.lock:
+      if (len(self.processes) == 0 or self._sample_activity(now)):
+        return
+
+      stalled = (self.liveness_timeout > 0 and now - self.last_activity_time > self.liveness_timeout)
+
+    if (stalled):
+      LOG.warning(self.name, '%s: No output for %.0fs, restarting', self.name, now - self.last_activity_time)
+      self.liveness_kills_total += 1
+      self._kill()
+
+  def _kill(self, timeout=0):
+    with self.lock:
+      (processes, self.processes) = (self.processes, [])
+
+    for process in processes:
+      _signal_group(process, signal.SIGTERM if (timeout > 0) else signal.SIGKILL)
+
+    for process in processes:
+      try:
+        process.wait(timeout if timeout > 0 else None)
+      except subprocess.TimeoutExpired:
+        _signal_group(process, signal.SIGKILL)
+        process.wait()
+
+  def is_running(self):
+    return len(self.processes) > 0
+
+  def restart_latency_quantiles(self):
+    recent = sorted(self.restart_latencies)
+    if (len(recent) == 0):
+      return {}
+
+    return {quantile: recent[min(int(quantile * len(recent)), len(recent) - 1)] for quantile in RESTART_LATENCY_QUANTILES}
+
+  def stop(self, timeout=STOP_TIMEOUT_S):
+    """Stop the processes with SIGTERM, or SIGKILL after timeout, and don't start them again"""
+    self.stopping.set()
+    self._kill(timeout)
+
+class Supervisor:
+  """Every external receiver pipeline. Each one discovers its SDR and starts on its own thread, so a slow or missing
+  SDR holds up nothing else, and one more thread checks that their output keeps coming"""
+  def __init__(self, registry=metrics.REGISTRY, liveness_timeout=DEFAULT_LIVENESS_TIMEOUT_S, backoff_max=BACKOFF_MAX_S):
+    self.registry = registry
+    self.liveness_timeout = liveness_timeout
+    self.backoff_max = backoff_max
+
+    self.pipelines = []
+    self.threads = []
+    self.activities = {}
+    self.lock = threading.Lock()
+    self.stopping = threading.Event()
+    self.monitor = None
+
+  def add(self, pipeline, start=True):
+    """Supervise pipeline, and run it on a thread of its own unless start is False, when its owner calls run()"""
+    if (pipeline.liveness_timeout == None):
+      pipeline.liveness_timeout = self.liveness_timeout
+    if (pipeline.backoff == None):
+      pipeline.backoff = Backoff(maximum = self.backoff_max)
+
+    with self.lock:
+      self.pipelines.append(pipeline)
+      if (pipeline.activity == None):
+        pipeline.activity = self.activities.get(pipeline.name)
+
+      if (self.monitor == None):
+        self.monitor = threading.Thread(target=self._monitor, daemon=True)
+        self.monitor.start()
+
+      if (start):
+        thread = threading.Thread(target=pipeline.run, daemon=True)
+        self.threads.append(thread)
+        thread.start()
+
+    self._register_metrics(pipeline)
+
+  def watch(self, name, activity):
+    """activity() counts the output of the pipeline called name, for pipelines whose output something else reads"""
+    with self.lock:
+      self.activities[name] = activity
+      for pipeline in self.pipelines:
+        if (pipeline.name == name):
+          pipeline.activity = activity
+
+  def _monitor(self):
+    while (not self.stopping.wait(LIVENESS_CHECK_PERIOD_S)):
+      for pipeline in list(self.pipelines):
+        try:
+          pipeline.check_liveness(time.monotonic())
+        except Exception as e:
+          LOG.error('supervisor', 'Supervisor: %s liveness check failed: %s', pipeline.name, e)
+
+  def _register_metrics(self, pipeline):
+    if (self.registry == None):
+      return
+
+    labels = {'process': pipeline.name}
+    self.registry.counter('cumulus_sdr_restarts_total', 'Times an SDR subprocess exited and was started again',
+      lambda: pipeline.restarts_total, labels)
+    self.registry.counter('cumulus_sdr_liveness_restarts_total', 'Times an SDR subprocess was restarted for its output stopping',
+      lambda: pipeline.liveness_kills_total, labels)
+    self.registry.gauge('cumulus_sdr_running', 'Whether the SDR subprocesses are running', lambda: int(pipeline.is_running()), labels)
+    self.registry.gauge('cumulus_sdr_first_output_seconds', 'Time from start to the first output of the SDR subprocesses',
+      lambda: pipeline.first_output_latency, labels)
+    self.registry.summary('cumulus_sdr_restart_seconds', 'Time from an SDR subprocess failing to output again, percentiles over the recent restarts',
+      lambda: (pipeline.restart_latency_quantiles(), pipeline.restart_latency_sum, pipeline.restart_latency_count), labels)
+
+  def stop(self, timeout=STOP_TIMEOUT_S):
+    """Stop every pipeline, in parallel, and wait for their threads"""
+    self.stopping.set()
+    with self.lock:
+      pipelines = list(self.pipelines)
+      threads = list(self.threads)
+
+    stoppers = [threading.Thread(target=pipeline.stop, args=(timeout,)) for pipeline in pipelines]
+    for stopper in stoppers:
+      stopper.start()
+    for thread in stoppers + threads:
+      thread.join(timeout + 1)
+
+# The process wide supervisor, configured by configure()
+SUPERVISOR = Supervisor()
+
+def configure(config, supervisor=SUPERVISOR):
+  """[supervisor] liveness_timeout and backoff_max"""
+  supervisor.liveness_timeout = config.getfloat('supervisor', 'liveness_timeout', fallback = DEFAULT_LIVENESS_TIMEOUT_S)
+  supervisor.backoff_max = config.getfloat('supervisor', 'backoff_max', fallback = BACKOFF_MAX_S)
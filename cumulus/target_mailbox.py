@@ -0,0 +1,55 @@
+#### file: target_mailbox.py
+
+import threading
+
+# Most distinct targets that can be pending between two swaps, updates for new targets beyond this are dropped
+MAX_PENDING_TARGETS = 4096
+
+class TargetMailbox:
+  """Latest state per target, handed from the providers to the frame loop
+  Providers merge field updates into one pending slot per mode_s_code, so an update superseded before the
+  frame loop gets to it costs nothing, and fields from different message types are combined rather than lost.
+  Updates with a position carry position_time as well as last_seen, so a merged slot still says when its position was
+  received. The frame loop takes the whole pending map in one swap"""
+  def __init__(self, max_pending_targets=MAX_PENDING_TARGETS):
+    self.max_pending_targets = max_pending_targets
+    self.pending = {}
+    self.lock = threading.Lock()
+
+    # Counters
+    self.updates_total = 0
+    self.merged_total = 0
+    self.dropped_total = 0
+
+  def merge(self, updates):
+    """Fold a batch of target update dicts (each with a mode_s_code) into the pending slots"""
+    with self.lock:
+      pending = self.pending
+      self.updates_total += len(updates)
+
+      for update in updates:
+        mode_s_code = update['mode_s_code']
+        slot = pending.get(mode_s_code)
+
+        if (slot != None):
+          slot.update(update)
+          self.merged_total += 1
+        elif (len(pending) < self.max_pending_targets):
+          pending[mode_s_code] = dict(update)
+        else:
+          self.dropped_total += 1
+
+  def put(self, target_update_data):
+    """queue.Queue style put of a {mode_s_code: update} dict"""
+    self.merge(list(target_update_data.values()))
+
+  def swap(self):
+    """Take everything pending, returns {mode_s_code: merged update}"""
+    with self.lock:
+      pending = self.pending
+      self.pending = {}
+
+    return pending
+
+  def __len__(self):
+    return len(self.pending)
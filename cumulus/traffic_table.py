@@ -0,0 +1,418 @@
+#### file: traffic_table.py
+
+import math
+import numpy as np
+
+EARTH_RADIUS_SM = 3958.8
+SM_PER_DEG_LAT = (math.pi * EARTH_RADIUS_SM) / 180.0
+
+# Spatial grid, cells are GRID_CELL_DEG square in lat/lon (about 17 sm north-south)
+GRID_CELL_DEG = 0.25
+GRID_LON_CELLS = int(math.ceil(360.0 / GRID_CELL_DEG))
+NO_CELL = -1
+
+INITIAL_CAPACITY = 256
+
+# Dead reckoning
+KTS_TO_NM_PER_S = 1.0 / 3600.0
+NM_PER_DEG_LAT = 60.0
+
+# Row flags
+FLAG_ACTIVE = 0x01
+FLAG_UPDATED = 0x02
+
+# Numeric columns and their storage types. Unknown float values are NaN
+NUMERIC_COLUMNS = {
+  'mode_s_code': np.uint32,
+  'lat': np.float64,
+  'lon': np.float64,
+  'altitude': np.int32,
+  'horizontal_speed': np.int32,
+  'vertical_rate': np.int32,
+  'track': np.int32,
+  'last_seen': np.float64,
+  'emitter_category': np.uint8,
+  'nic': np.uint8,
+  'nacp': np.uint8,
+  'distance': np.float64,
+  'bearing': np.float64,
+  'last_report': np.float64,
+  'position_time': np.float64,
+  'receiver': np.uint16,
+}
+
+class TrafficTable:
+  """Columnar store of traffic targets: an ICAO to row map plus one preallocated array per field"""
+  def __init__(self, defaults, capacity=INITIAL_CAPACITY):
+    # Row defaults for new targets, None maps to NaN
+    self.defaults = {name: (np.nan if defaults.get(name) == None else defaults[name]) for name in NUMERIC_COLUMNS if name in defaults}
+    self.default_callsign = defaults.get('callsign', '')
+
+    self.capacity = capacity
+    self.columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in NUMERIC_COLUMNS.items()}
+    self.columns['distance'][:] = np.nan
+    self.columns['bearing'][:] = np.nan
+    self.callsign = [self.default_callsign] * capacity
+    self.flags = np.zeros(capacity, dtype=np.uint8)
+
+    # Grid cell of each row, and cell: set of rows. Only targets with a position are in the grid
+    self.cells = np.full(capacity, NO_CELL, dtype=np.int64)
+    self.grid = {}
+
+    # mode_s_code: row
+    self.index = {}
+    self.free_rows = []
+
+    # Rows at and above this have never been used
+    self.high_water = 0
+
+  def __len__(self):
+    return len(self.index)
+
+  def __contains__(self, mode_s_code):
+    return mode_s_code in self.index
+
+  def _grow(self):
+    new_capacity = self.capacity * 2
+
+    for name, column in self.columns.items():
+      grown = np.zeros(new_capacity, dtype=column.dtype)
+      grown[0:self.capacity] = column
+      self.columns[name] = grown
+
+    flags = np.zeros(new_capacity, dtype=np.uint8)
+    flags[0:self.capacity] = self.flags
+    self.flags = flags
+
+    cells = np.full(new_capacity, NO_CELL, dtype=np.int64)
+    cells[0:self.capacity] = self.cells
+    self.cells = cells
+
+    self.callsign.extend([self.default_callsign] * (new_capacity - self.capacity))
+    self.capacity = new_capacity
+
+  def _allocate(self, mode_s_code):
+    if (len(self.free_rows) > 0):
+      row = self.free_rows.pop()
+    else:
+      if (self.high_water == self.capacity):
+        self._grow()
+      row = self.high_water
+      self.high_water += 1
+
+    for name, value in self.defaults.items():
+      self.columns[name][row] = value
+    self.columns['mode_s_code'][row] = mode_s_code
+    self.columns['distance'][row] = np.nan
+    self.columns['bearing'][row] = np.nan
+    self.columns['last_report'][row] = 0
+    self.columns['position_time'][row] = 0
+    self.columns['receiver'][row] = 0
+    self.callsign[row] = self.default_callsign
+    self.flags[row] = FLAG_ACTIVE
+
+    self.index[mode_s_code] = row
+    return row
+
+  def upsert(self, updates):
+    """Merge a batch of target update dicts (each with a mode_s_code) into the table
+    Returns (added mode_s_codes, updated mode_s_codes)"""
+    added = []
+    updated = []
+
+    # Gather every column's new values first, later updates to the same row win
+    pending = {name: {} for name in NUMERIC_COLUMNS}
+
+    for update in updates:
+      mode_s_code = update['mode_s_code']
+      row = self.index.get(mode_s_code)
+
+      if (row == None):
+        row = self._allocate(mode_s_code)
+        added.append(mode_s_code)
+      else:
+        updated.append(mode_s_code)
+
+      for name, value in update.items():
+        column = pending.get(name)
+        if (column != None):
+          column[row] = value
+        elif (name == 'callsign'):
+          self.callsign[row] = value
+
+      pending['mode_s_code'][row] = mode_s_code
+
+    # One scatter per column
+    for name, values in pending.items():
+      if (len(values) > 0):
+        self.columns[name][list(values.keys())] = list(values.values())
+
+    rows = list(pending['mode_s_code'].keys())
+    if (len(rows) > 0):
+      self.flags[rows] |= FLAG_UPDATED
+
+    # Keep the grid in step with whatever moved
+    moved = set(pending['lat'].keys())
+    moved.update(pending['lon'].keys())
+    if (len(moved) > 0):
+      self._update_cells(np.fromiter(moved, dtype=np.intp, count=len(moved)))
+
+    return (added, updated)
+
+  def _compute_cells(self, lat, lon):
+    lat_index = np.floor((lat + 90.0) / GRID_CELL_DEG)
+    lon_index = np.floor((lon + 180.0) / GRID_CELL_DEG) % GRID_LON_CELLS
+    cells = lat_index * GRID_LON_CELLS + lon_index
+    return np.where(np.isnan(cells), NO_CELL, cells).astype(np.int64)
+
+  def _update_cells(self, rows):
+    new_cells = self._compute_cells(self.columns['lat'][rows], self.columns['lon'][rows])
+    changed = new_cells != self.cells[rows]
+
+    for row, old_cell, new_cell in zip(rows[changed].tolist(), self.cells[rows][changed].tolist(), new_cells[changed].tolist()):
+      self._grid_remove(row, old_cell)
+      if (new_cell != NO_CELL):
+        self.grid.setdefault(new_cell, set()).add(row)
+
+    self.cells[rows] = new_cells
+
+  def _grid_remove(self, row, cell):
+    if (cell == NO_CELL):
+      return
+
+    members = self.grid[cell]
+    members.discard(row)
+    if (len(members) == 0):
+      del self.grid[cell]
+
+  def query_range(self, lat, lon, range_sm):
+    """Rows of every target in the grid cells overlapping range_sm around (lat, lon), a superset of those in range"""
+    dlat = range_sm / SM_PER_DEG_LAT
+    dlon = min(dlat / max(math.cos(math.radians(lat)), 1e-6), 180.0)
+
+    lat_first = int(math.floor((max(lat - dlat, -90.0) + 90.0) / GRID_CELL_DEG))
+    lat_last = int(math.floor((min(lat + dlat, 90.0) + 90.0) / GRID_CELL_DEG))
+    lon_first = int(math.floor((lon - dlon + 180.0) / GRID_CELL_DEG))
+    lon_last = int(math.floor((lon + dlon + 180.0) / GRID_CELL_DEG))
+
+    if (lon_last - lon_first + 1 >= GRID_LON_CELLS):
+      lon_indexes = range(0, GRID_LON_CELLS)
+    else:
+      lon_indexes = [x % GRID_LON_CELLS for x in range(lon_first, lon_last + 1)]
+
+    rows = []
+    grid = self.grid
+    for lat_index in range(lat_first, lat_last + 1):
+      base = lat_index * GRID_LON_CELLS
+      for lon_index in lon_indexes:
+        members = grid.get(base + lon_index)
+        if (members != None):
+          rows.extend(members)
+
+    return np.array(rows, dtype=np.intp)
+
+  def filter_rows(self, rows, max_distance=None, altitude=None, altitude_band=None):
+    """Subset of rows within max_distance (needs update_geometry) and within altitude_band feet of altitude"""
+    keep = np.ones(len(rows), dtype=bool)
+
+    if (max_distance != None):
+      keep &= self.columns['distance'][rows] <= max_distance
+
+    if (altitude_band != None):
+      keep &= np.abs(self.columns['altitude'][rows] - altitude) <= altitude_band
+
+    return rows[keep]
+
+  def _active_mask(self):
+    return (self.flags[0:self.high_water] & FLAG_ACTIVE) != 0
+
+  def active_rows(self):
+    return np.flatnonzero(self._active_mask())
+
+  def receiver_counts(self):
+    """{receiver: number of targets last heard on it}, receivers as the 'receiver' field of the updates"""
+    (receivers, counts) = np.unique(self.columns['receiver'][self.active_rows()], return_counts=True)
+    return dict(zip(receivers.tolist(), counts.tolist()))
+
+  def prune(self, now, timeout):
+    """Remove every target not seen for more than timeout seconds, returns their mode_s_codes"""
+    stale = self._active_mask() & ((now - self.columns['last_seen'][0:self.high_water]) > timeout)
+    rows = np.flatnonzero(stale)
+
+    if (len(rows) == 0):
+      return []
+
+    mode_s_codes = self.columns['mode_s_code'][rows].tolist()
+    self.flags[rows] = 0
+
+    for mode_s_code in mode_s_codes:
+      del self.index[mode_s_code]
+    self.free_rows.extend(rows.tolist())
+
+    for row, cell in zip(rows.tolist(), self.cells[rows].tolist()):
+      self._grid_remove(row, cell)
+    self.cells[rows] = NO_CELL
+
+    return mode_s_codes
+
+  def update_geometry(self, lat, lon, rows=None):
+    """Compute distance (statute miles) and bearing (degrees true) from (lat, lon) in one pass
+    Either for every target or only for rows, everything else gets NaN, as do targets without a position"""
+    if (rows is None):
+      rows = slice(0, self.high_water)
+    else:
+      self.clear_geometry()
+
+    target_lat = np.radians(self.columns['lat'][rows])
+    target_lon = np.radians(self.columns['lon'][rows])
+    own_lat = np.radians(lat)
+    own_lon = np.radians(lon)
+
+    delta_lat = target_lat - own_lat
+    delta_lon = target_lon - own_lon
+    cos_target_lat = np.cos(target_lat)
+    cos_own_lat = np.cos(own_lat)
+
+    ea = np.sin(delta_lat / 2.0) ** 2 + cos_own_lat * cos_target_lat * np.sin(delta_lon / 2.0) ** 2
+    ec = 2.0 * np.arctan2(np.sqrt(ea), np.sqrt(1.0 - ea))
+    self.columns['distance'][rows] = EARTH_RADIUS_SM * ec
+
+    y = np.sin(delta_lon) * cos_target_lat
+    x = cos_own_lat * np.sin(target_lat) - np.sin(own_lat) * cos_target_lat * np.cos(delta_lon)
+    self.columns['bearing'][rows] = np.degrees(np.arctan2(y, x)) % 360.0
+
+  def clear_geometry(self):
+    self.columns['distance'][0:self.high_water] = np.nan
+    self.columns['bearing'][0:self.high_water] = np.nan
+
+  def _due_mask(self, now, min_interval):
+    n = self.high_water
+    due = self._active_mask() & ((self.flags[0:n] & FLAG_UPDATED) != 0)
+
+    if (min_interval > 0):
+      due &= (now - self.columns['last_report'][0:n]) >= min_interval
+
+    return due
+
+  def take_updated(self, exclude_mode_s_code=None, now=None, min_interval=0, rows=None, nearest_first=False, max_extrapolation_age=0):
+    """Clear the update flag of every updated target, returns those with a position as a list of dicts
+    With a min_interval, targets reported less than min_interval seconds before now are left for later
+    With rows, only those targets are considered, the rest keep their update flag
+    With a max_extrapolation_age, positions are dead reckoned to now (see extrapolate)"""
+    n = self.high_water
+    updated = self._due_mask(now, min_interval)
+
+    if (rows is not None):
+      selected = np.zeros(n, dtype=bool)
+      selected[rows] = True
+      updated &= selected
+
+    return self._take(updated, exclude_mode_s_code, now, nearest_first, max_extrapolation_age)
+
+  def take_rows(self, rows, exclude_mode_s_code=None, now=None, nearest_first=False, max_extrapolation_age=0):
+    """Report rows whether or not they were updated, clearing their update flag
+    Rows without new data are only reported while their position can still be extrapolated, so this
+    is how a scheduler keeps nearby traffic moving between receptions"""
+    n = self.high_water
+    selected = np.zeros(n, dtype=bool)
+    selected[rows] = True
+    selected &= self._active_mask()
+
+    if (max_extrapolation_age > 0 and now != None):
+      position_time = self.columns['position_time'][0:n]
+      fresh = (position_time > 0) & ((now - position_time) <= max_extrapolation_age)
+      selected &= ((self.flags[0:n] & FLAG_UPDATED) != 0) | fresh
+    else:
+      selected &= (self.flags[0:n] & FLAG_UPDATED) != 0
+
+    return self._take(selected, exclude_mode_s_code, now, nearest_first, max_extrapolation_age)
+
+  def _take(self, taken, exclude_mode_s_code, now, nearest_first, max_extrapolation_age):
+    n = self.high_water
+    self.flags[0:n][taken] &= ~np.uint8(FLAG_UPDATED)
+
+    # Do not include targets which lack lat/lon
+    taken &= ~(np.isnan(self.columns['lat'][0:n]) | np.isnan(self.columns['lon'][0:n]))
+
+    # Do not include ownship
+    if (exclude_mode_s_code != None):
+      taken &= self.columns['mode_s_code'][0:n] != exclude_mode_s_code
+
+    rows = np.flatnonzero(taken)
+    if (now != None):
+      self.columns['last_report'][rows] = now
+
+    if (nearest_first):
+      rows = rows[np.argsort(self.columns['distance'][rows], kind='stable')]
+
+    if (max_extrapolation_age > 0 and now != None):
+      return self.get_rows(rows, extrapolation = self.extrapolate(rows, now, max_extrapolation_age))
+
+    return self.get_rows(rows)
+
+  def extrapolate(self, rows, now, max_age):
+    """Dead reckon rows from their last position along track, at their ground speed and vertical rate
+    Projection stops max_age seconds after the position was received, now may be one time per row
+    Returns (lat, lon, altitude, extrapolated) arrays"""
+    lat = self.columns['lat'][rows]
+    lon = self.columns['lon'][rows]
+    altitude = self.columns['altitude'][rows]
+    speed = self.columns['horizontal_speed'][rows]
+    vertical_rate = self.columns['vertical_rate'][rows]
+    position_time = self.columns['position_time'][rows]
+
+    age = np.where(position_time > 0, np.clip(now - position_time, 0, max_age), 0)
+    extrapolated = (age > 0) & ((speed != 0) | (vertical_rate != 0))
+
+    distance_deg = speed * (age * KTS_TO_NM_PER_S / NM_PER_DEG_LAT)
+    track = np.radians(self.columns['track'][rows])
+    new_lat = lat + distance_deg * np.cos(track)
+    new_lon = lon + distance_deg * np.sin(track) / np.maximum(np.cos(np.radians(lat)), 1e-6)
+    new_lon = ((new_lon + 180.0) % 360.0) - 180.0
+
+    # Feet per minute
+    new_altitude = altitude + np.rint(vertical_rate * (age / 60.0)).astype(np.int64)
+
+    return (np.where(extrapolated, new_lat, lat), np.where(extrapolated, new_lon, lon), np.where(extrapolated, new_altitude, altitude), extrapolated)
+
+  def next_report_time(self, min_interval, rows=None):
+    """Earliest time an updated but rate limited target becomes due, None if nothing is waiting
+    With rows, only those targets are waited for, as take_updated leaves the update flag on the rest"""
+    n = self.high_water
+    waiting = self._active_mask() & ((self.flags[0:n] & FLAG_UPDATED) != 0)
+
+    if (rows is not None):
+      selected = np.zeros(n, dtype=bool)
+      selected[rows] = True
+      waiting &= selected
+
+    if (not waiting.any()):
+      return None
+
+    return float(self.columns['last_report'][0:n][waiting].min()) + min_interval
+
+  def get_rows(self, rows, extrapolation=None):
+    """Materialize rows as target dicts, bulk converted per column
+    With extrapolation (from extrapolate), lat/lon/altitude are the projected ones and each target has an extrapolated flag"""
+    values = {name: column[rows].tolist() for name, column in self.columns.items()}
+    callsigns = [self.callsign[row] for row in rows.tolist()]
+
+    if (extrapolation != None):
+      (values['lat'], values['lon'], values['altitude'], values['extrapolated']) = (column.tolist() for column in extrapolation)
+
+    names = list(values.keys())
+
+    targets = []
+    for x, fields in enumerate(zip(*values.values())):
+      target = dict(zip(names, fields))
+      target['callsign'] = callsigns[x]
+      targets.append(target)
+
+    return targets
+
+  def get(self, mode_s_code):
+    row = self.index.get(mode_s_code)
+    if (row == None):
+      return None
+
+    return self.get_rows(np.array([row]))[0]
@@ -0,0 +1,158 @@
+#### file: uat.py
+
+import math
+
+# UAT (978 MHz) ADS-B downlink decoding, DO-282B section 2.2.4.5
+# dump978 has already done the FEC, frames arrive here as 18 byte basic or 34 byte long payloads.
+# Only the header, state vector and mode status elements are decoded
+
+UAT_BASIC_FRAME_BYTES = 18
+UAT_LONG_FRAME_BYTES = 34
+
+# Value of the receiver field of every update from 978
+RECEIVER_978 = 978
+
+# Address qualifiers
+ADDRESS_ADSB_ICAO = 0
+ADDRESS_ADSB_SELF_ASSIGNED = 1
+ADDRESS_TISB_ICAO = 2
+ADDRESS_TISB_TRACK_FILE = 3
+ADDRESS_SURFACE_VEHICLE = 4
+ADDRESS_FIXED_BEACON = 5
+ADDRESS_ADSR_ICAO = 6
+
+# Air/ground state
+AIRGROUND_SUBSONIC = 0
+AIRGROUND_SUPERSONIC = 1
+AIRGROUND_GROUND = 2
+
+# Payload types carrying the mode status element
+MODE_STATUS_PAYLOAD_TYPES = (1, 3)
+
+# Mode status callsign characters, three per 16 bit word
+BASE40_CHARSET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ  ..'
+
+LAT_LON_SCALE = 360.0 / (1 << 24)
+
+# Bit fields as (first bit, length), numbered from the most significant bit of byte 0
+UAT_FIELDS = {
+  'payload_type': (0, 5),
+  'address_qualifier': (5, 3),
+  'address': (8, 24),
+  'lat': (32, 23),
+  'lon': (55, 24),
+  'altitude_type': (79, 1),
+  'altitude': (80, 12),
+  'nic': (92, 4),
+  'airground': (96, 2),
+  'north_velocity': (99, 11),
+  'east_velocity': (110, 11),
+  'vertical_velocity': (121, 11),
+  'ms_word1': (136, 16),
+  'ms_word2': (152, 16),
+  'ms_word3': (168, 16),
+  'emergency': (184, 3),
+  'uat_version': (187, 3),
+  'nacp': (200, 4),
+  'callsign_id': (214, 1),
+}
+
+def _create_extractors(frame_bytes):
+  """(shift, mask) of every field that fits in a frame_bytes frame read as one big integer"""
+  frame_bits = frame_bytes * 8
+  return {name: (frame_bits - start - length, (1 << length) - 1) for name, (start, length) in UAT_FIELDS.items() if start + length <= frame_bits}
+
+UAT_EXTRACTORS = {
+  UAT_BASIC_FRAME_BYTES: _create_extractors(UAT_BASIC_FRAME_BYTES),
+  UAT_LONG_FRAME_BYTES: _create_extractors(UAT_LONG_FRAME_BYTES),
+}
+
+def _signed_velocity(raw):
+  """11 bit sign/magnitude velocity, None if not available"""
+  magnitude = raw & 0x3ff
+  if (magnitude == 0):
+    return None
+
+  return -(magnitude - 1) if (raw & 0x400) else (magnitude - 1)
+
+def decode_uat_downlink(frame, timestamp):
+  """Decode one UAT downlink payload, returns a target update dict in the same form as the 1090 path, or None"""
+  extractors = UAT_EXTRACTORS.get(len(frame))
+  if (extractors == None):
+    return None
+
+  bits = int.from_bytes(frame, 'big')
+  fields = {name: (bits >> shift) & mask for name, (shift, mask) in extractors.items()}
+
+  # Payload types above 10 have no state vector
+  payload_type = fields['payload_type']
+  if (payload_type > 10 or (payload_type > 0 and len(frame) != UAT_LONG_FRAME_BYTES)):
+    return None
+
+  # Fixed beacons are not traffic
+  if (fields['address_qualifier'] > ADDRESS_ADSR_ICAO or fields['address_qualifier'] == ADDRESS_FIXED_BEACON):
+    return None
+
+  update = {'mode_s_code': fields['address'], 'last_seen': timestamp, 'receiver': RECEIVER_978}
+
+  # Position, all zeros with NIC 0 means no position
+  nic = fields['nic']
+  update['nic'] = nic
+  if (nic != 0 or fields['lat'] != 0 or fields['lon'] != 0):
+    lat = fields['lat'] * LAT_LON_SCALE
+    lon = fields['lon'] * LAT_LON_SCALE
+    update['lat'] = (lat - 180.0) if (lat > 90.0) else lat
+    update['lon'] = (lon - 360.0) if (lon > 180.0) else lon
+    update['position_time'] = timestamp
+
+  # Barometric or geometric, either way 25 ft steps offset by -1000 ft
+  if (fields['altitude'] != 0):
+    update['altitude'] = ((fields['altitude'] - 1) * 25) - 1000
+
+  airground = fields['airground']
+  if (airground == AIRGROUND_SUBSONIC or airground == AIRGROUND_SUPERSONIC):
+    north = _signed_velocity(fields['north_velocity'])
+    east = _signed_velocity(fields['east_velocity'])
+
+    if (north != None and east != None):
+      scale = 4 if (airground == AIRGROUND_SUPERSONIC) else 1
+      update['horizontal_speed'] = int(round(math.hypot(north, east) * scale))
+      update['track'] = int(round(math.degrees(math.atan2(east, north)))) % 360
+
+    raw_vertical = fields['vertical_velocity']
+    if ((raw_vertical & 0x1ff) != 0):
+      vertical_rate = ((raw_vertical & 0x1ff) - 1) * 64
+      update['vertical_rate'] = -vertical_rate if (raw_vertical & 0x200) else vertical_rate
+  elif (airground == AIRGROUND_GROUND):
+    # Ground speed, and track in 360/512 degree steps when the track type says it is one
+    ground_speed = fields['north_velocity'] & 0x3ff
+    if (ground_speed != 0):
+      update['horizontal_speed'] = ground_speed - 1
+
+    raw_track = fields['east_velocity']
+    if (((raw_track >> 9) & 0x3) != 0):
+      update['track'] = int(round((raw_track & 0x1ff) * (360.0 / 512))) % 360
+
+  if (payload_type in MODE_STATUS_PAYLOAD_TYPES):
+    _decode_mode_status(fields, update)
+
+  return update
+
+def _decode_mode_status(fields, update):
+  words = (fields['ms_word1'], fields['ms_word2'], fields['ms_word3'])
+
+  # The first word's top base 40 digit is the emitter category, UAT and GDL90 share the encoding
+  update['emitter_category'] = (words[0] // 1600) % 40
+
+  characters = []
+  for x, word in enumerate(words):
+    digits = ((word // 1600) % 40, (word // 40) % 40, word % 40)
+    characters.extend(BASE40_CHARSET[digit] for digit in (digits[1:] if x == 0 else digits))
+
+  # Callsign ID clear means the field holds a squawk or flight plan ID, not a callsign
+  if (fields['callsign_id']):
+    callsign = ''.join(characters).strip()
+    if (len(callsign) > 0):
+      update['callsign'] = callsign
+
+  update['nacp'] = fields['nacp']
@@ -0,0 +1,183 @@
+#### file: uat_demod.py
+
+import numpy as np
+
+from . import reed_solomon
+from . import dump978_provider
+
+# UAT receiver working straight on rtl_sdr output, what dump978 does but in NumPy blocks
+# rtl_sdr at 2.083334 Msps gives exactly two u8 I/Q samples per 1.041667 Mbps bit. The signal is
+# CPFSK, so the sign of the phase change across a bit is the bit
+
+SAMPLE_RATE = 2083334
+SAMPLES_PER_BIT = 2
+
+# Sync words, the uplink one is the downlink one inverted
+SYNC_BITS = 36
+SYNC_SAMPLES = SYNC_BITS * SAMPLES_PER_BIT
+DOWNLINK_SYNC_WORD = 0xeacdda4e2
+UPLINK_SYNC_WORD = 0x153225b1d
+MAX_SYNC_ERRORS = 4
+
+# Frame sizes after the sync word, with Reed-Solomon parity
+DOWNLINK_SHORT_DATA_BYTES = 18
+DOWNLINK_SHORT_BYTES = 30
+DOWNLINK_LONG_DATA_BYTES = 34
+DOWNLINK_LONG_BYTES = 48
+UPLINK_BLOCKS = 6
+UPLINK_BLOCK_DATA_BYTES = 72
+UPLINK_BLOCK_BYTES = 92
+UPLINK_BYTES = UPLINK_BLOCKS * UPLINK_BLOCK_BYTES
+
+DOWNLINK_SPAN_SAMPLES = SYNC_SAMPLES + (DOWNLINK_LONG_BYTES * 8 * SAMPLES_PER_BIT)
+UPLINK_SPAN_SAMPLES = SYNC_SAMPLES + (UPLINK_BYTES * 8 * SAMPLES_PER_BIT)
+
+# Bytes read from rtl_sdr per block, about half a second
+DEFAULT_BLOCK_BYTES = 1 << 21
+
+# rtl_sdr's u8 zero level
+IQ_OFFSET = 127.4
+
+# Bit count of every 12 bit value, for the sync word distance
+POPCOUNT_12 = np.array([bin(x).count('1') for x in range(0, 1 << 12)], dtype=np.uint8)
+
+def sync_distances(bits):
+  """Hamming distance from the downlink sync word of the 36 bits starting at every sample, one bit per two samples
+  Windows are built by doubling, 2, 4, 8, 16 then 32 bits wide, rather than 36 shifts"""
+  w1 = bits.astype(np.uint64)
+  w2 = (w1[:-2] << np.uint64(1)) | w1[2:]
+  w4 = (w2[:-4] << np.uint64(2)) | w2[4:]
+  w8 = (w4[:-8] << np.uint64(4)) | w4[8:]
+  w16 = (w8[:-16] << np.uint64(8)) | w8[16:]
+  w32 = (w16[:-32] << np.uint64(16)) | w16[32:]
+  count = len(w32) - 64
+  if (count <= 0):
+    return np.zeros(0, dtype=np.uint8)
+
+  difference = ((w32[:count] << np.uint64(4)) | w4[64:64 + count]) ^ np.uint64(DOWNLINK_SYNC_WORD)
+  mask = np.uint64(0xfff)
+  return (POPCOUNT_12[difference & mask] + POPCOUNT_12[(difference >> np.uint64(12)) & mask] + POPCOUNT_12[difference >> np.uint64(24)])
+
+class UatDemodulator:
+  """Turns a stream of rtl_sdr u8 I/Q into UatFrames, same frames as parse_dump978_line gives
+  Frames straddling two blocks are found in the next one, the tail of each block is kept until then"""
+  def __init__(self):
+    self.rs_downlink_short = reed_solomon.ReedSolomon(DOWNLINK_SHORT_DATA_BYTES, DOWNLINK_SHORT_BYTES - DOWNLINK_SHORT_DATA_BYTES)
+    self.rs_downlink_long = reed_solomon.ReedSolomon(DOWNLINK_LONG_DATA_BYTES, DOWNLINK_LONG_BYTES - DOWNLINK_LONG_DATA_BYTES)
+    self.rs_uplink = reed_solomon.ReedSolomon(UPLINK_BLOCK_DATA_BYTES, UPLINK_BLOCK_BYTES - UPLINK_BLOCK_DATA_BYTES)
+
+    self.pending = np.zeros(0, dtype=np.uint8)
+
+    # Samples into the pending buffer which are still covered by the last decoded frame
+    self.skip_until = 0
+
+    # Counters
+    self.samples_total = 0
+    self.sync_candidates_total = 0
+    self.downlink_total = 0
+    self.uplink_total = 0
+    self.rs_failures_total = 0
+    self.rs_corrected_total = 0
+
+  def process(self, iq):
+    """Demodulate a block of interleaved u8 I/Q bytes, returns the UatFrames completed by it"""
+    buffer = np.concatenate((self.pending, np.frombuffer(iq, dtype=np.uint8)))
+    sample_count = len(buffer) // 2
+    self.samples_total += len(iq) // 2
+
+    # Everything up to limit gets a full look now, the rest waits for more samples
+    limit = sample_count - UPLINK_SPAN_SAMPLES
+    if (limit <= 0):
+      self.pending = buffer
+      return []
+
+    samples = buffer[0:sample_count * 2].astype(np.float32) - np.float32(IQ_OFFSET)
+    z = samples[0::2] + (1j * samples[1::2])
+
+    # FM demod, phase change over the two sample steps of a bit starting at each sample
+    dphi = np.angle(z[1:] * np.conj(z[:-1]))
+    dphi = dphi[:-1] + dphi[1:]
+    distances = sync_distances(dphi > 0)
+
+    candidates = np.flatnonzero((distances[0:limit] <= MAX_SYNC_ERRORS) | (distances[0:limit] >= SYNC_BITS - MAX_SYNC_ERRORS))
+    self.sync_candidates_total += len(candidates)
+
+    frames = []
+    skip_until = self.skip_until
+
+    for start in candidates.tolist():
+      if (start < skip_until):
+        continue
+
+      uplink = distances[start] >= SYNC_BITS - MAX_SYNC_ERRORS
+      frame = self._decode_frame(dphi, start, uplink)
+      if (frame != None):
+        frames.append(frame)
+        skip_until = start + (UPLINK_SPAN_SAMPLES if uplink else DOWNLINK_SPAN_SAMPLES)
+
+    self.pending = buffer[limit * 2:]
+    self.skip_until = max(0, skip_until - limit)
+    return frames
+
+  def _slice_bits(self, dphi, start, byte_count, uplink):
+    """Data bytes after the sync word at start, the decision level taken from the sync word itself
+    which removes any frequency offset"""
+    sync = dphi[start:start + SYNC_SAMPLES:SAMPLES_PER_BIT]
+    word = UPLINK_SYNC_WORD if uplink else DOWNLINK_SYNC_WORD
+    ones = ((word >> np.arange(SYNC_BITS - 1, -1, -1)) & 1).astype(bool)
+    center = (sync[ones].mean() + sync[~ones].mean()) / 2
+
+    data_start = start + SYNC_SAMPLES
+    data = dphi[data_start:data_start + (byte_count * 8 * SAMPLES_PER_BIT):SAMPLES_PER_BIT]
+    return np.packbits(data > center)
+
+  def _decode_frame(self, dphi, start, uplink):
+    if (uplink):
+      raw = self._slice_bits(dphi, start, UPLINK_BYTES, True)
+
+      # Interleaved, byte i of block b is raw[i * UPLINK_BLOCKS + b]
+      payload = bytearray()
+      for block in raw.reshape(UPLINK_BLOCK_BYTES, UPLINK_BLOCKS).T:
+        codeword = bytearray(block.tobytes())
+        corrected = self.rs_uplink.decode(codeword)
+        if (corrected < 0):
+          self.rs_failures_total += 1
+          return None
+
+        self.rs_corrected_total += corrected
+        payload.extend(codeword[0:UPLINK_BLOCK_DATA_BYTES])
+
+      self.uplink_total += 1
+      return dump978_provider.UatFrame(dump978_provider.UatFrameType.UPLINK, payload)
+
+    raw = self._slice_bits(dphi, start, DOWNLINK_LONG_BYTES, False).tobytes()
+
+    # Long first, a valid long frame never has payload type 0
+    for (rs, codeword_bytes, data_bytes, long_frame) in ((self.rs_downlink_long, DOWNLINK_LONG_BYTES, DOWNLINK_LONG_DATA_BYTES, True),
+      (self.rs_downlink_short, DOWNLINK_SHORT_BYTES, DOWNLINK_SHORT_DATA_BYTES, False)):
+      codeword = bytearray(raw[0:codeword_bytes])
+      corrected = rs.decode(codeword)
+      if (corrected >= 0 and ((codeword[0] >> 3) != 0) == long_frame):
+        self.rs_corrected_total += corrected
+        self.downlink_total += 1
+        return dump978_provider.UatFrame(dump978_provider.UatFrameType.DOWNLINK, codeword[0:data_bytes])
+
+    self.rs_failures_total += 1
+    return None
+
+def demodulate_file(path, block_bytes=DEFAULT_BLOCK_BYTES):
+  """UatFrames in a recorded rtl_sdr u8 I/Q file, for checking the receiver offline"""
+  demodulator = UatDemodulator()
+  frames = []
+
+  with open(path, 'rb') as iq_file:
+    while True:
+      block = iq_file.read(block_bytes)
+      if (len(block) == 0):
+        break
+
+      frames.extend(demodulator.process(block))
+
+  # Flush whatever is left with a block of silence
+  frames.extend(demodulator.process(bytes([128]) * (UPLINK_SPAN_SAMPLES * 2)))
+  return frames
@@ -0,0 +1,199 @@
+#### file: ubx.py
+
+# u-blox UBX binary protocol: framing, the configuration messages to get NAV-PVT out of a receiver, and NAV-PVT itself
+# u-blox 8 / M8 Receiver Description (UBX-13003221) and the M9/M10 interface descriptions for the CFG-VALSET keys
+
+import calendar
+import collections
+import itertools
+import struct
+import sys
+
+SYNC = b'\xb5\x62'
+HEADER = struct.Struct('<BBH')
+HEADER_BYTES = 6
+CHECKSUM_BYTES = 2
+
+# Longest frame looked for, anything claiming more is a false sync
+MAX_PAYLOAD_BYTES = 1024
+
+CLASS_NAV = 0x01
+CLASS_ACK = 0x05
+CLASS_CFG = 0x06
+
+NAV_PVT = 0x07
+ACK_NAK = 0x00
+ACK_ACK = 0x01
+CFG_PRT = 0x00
+CFG_MSG = 0x01
+CFG_RATE = 0x08
+CFG_VALSET = 0x8a
+
+# CFG-VALSET keys, the size of the value is in bits 28-30 of the key
+KEY_RATE_MEAS = 0x30210001
+KEY_MSGOUT_NAV_PVT_UART1 = 0x20910007
+KEY_MSGOUT_NAV_PVT_USB = 0x20910009
+KEY_UART1_BAUDRATE = 0x40520001
+VALUE_FORMATS = {1: '<B', 2: '<B', 3: '<H', 4: '<I', 5: '<Q'}
+LAYER_RAM = 0x01
+
+# CFG-PRT for UART1: 8 data bits, no parity, 1 stop bit, UBX, NMEA and RTCM in, UBX and NMEA out
+PORT_UART1 = 1
+PRT_MODE_8N1 = 0x08d0
+PRT_PROTO_IN = 0x07
+PRT_PROTO_OUT = 0x03
+CFG_PRT_FORMAT = struct.Struct('<BBHIIHHHH')
+
+# NAV-PVT, 92 bytes. Bytes 78-83 are flags3 and reserved on M9 and later, reserved on M8, neither is used
+NAV_PVT_FORMAT = struct.Struct('<IHBBBBBBIiBBBBiiiiIIiiiiiIIH6xihH')
+
+NAV_PVT_VALID_DATE = 0x01
+NAV_PVT_VALID_TIME = 0x02
+NAV_PVT_FULLY_RESOLVED = 0x04
+NAV_PVT_GNSS_FIX_OK = 0x01
+NAV_PVT_DIFF_SOLN = 0x02
+
+FIX_NONE = 0
+FIX_DEAD_RECKONING = 1
+FIX_2D = 2
+FIX_3D = 3
+FIX_GNSS_DEAD_RECKONING = 4
+FIX_TIME_ONLY = 5
+
+# Position, velocity and time in SI units: degrees, meters, m/s (NED), seconds
+# time is the UTC epoch time of the fix, None unless the receiver has resolved it
+NavPvt = collections.namedtuple('NavPvt', ['itow', 'time', 'fix_type', 'fix_ok', 'differential', 'satellites',
+  'lat', 'lon', 'height', 'height_msl', 'h_acc', 'v_acc', 'vel_n', 'vel_e', 'vel_d', 'ground_speed', 'heading',
+  's_acc', 'heading_acc', 'pdop'])
+
+def checksum(data):
+  """8-bit Fletcher over class, id, length and payload, as (ck_a, ck_b)"""
+  return (sum(data) & 0xff, sum(itertools.accumulate(data)) & 0xff)
+
+def frame(msg_class, msg_id, payload=b''):
+  body = HEADER.pack(msg_class, msg_id, len(payload)) + bytes(payload)
+  return SYNC + body + bytes(checksum(body))
+
+def cfg_valset(items, layers=LAYER_RAM):
+  """CFG-VALSET of [(key, value)], M9 and later"""
+  payload = bytearray(struct.pack('<BBxx', 0, layers))
+  for key, value in items:
+    payload += struct.pack('<I', key) + struct.pack(VALUE_FORMATS[(key >> 28) & 0x7], value)
+
+  return frame(CLASS_CFG, CFG_VALSET, payload)
+
+def cfg_rate(measurement_ms):
+  """CFG-RATE, one navigation solution per measurement, aligned to GPS time"""
+  return frame(CLASS_CFG, CFG_RATE, struct.pack('<HHH', measurement_ms, 1, 1))
+
+def cfg_msg(msg_class, msg_id, rate):
+  """CFG-MSG, rate per navigation solution on the port the message comes in on"""
+  return frame(CLASS_CFG, CFG_MSG, struct.pack('<BBB', msg_class, msg_id, rate))
+
+def cfg_prt_uart1(baud):
+  return frame(CLASS_CFG, CFG_PRT, CFG_PRT_FORMAT.pack(PORT_UART1, 0, 0, PRT_MODE_8N1, baud, PRT_PROTO_IN, PRT_PROTO_OUT, 0, 0))
+
+def configuration(rate_hz, baud=None):
+  """Frames which set up rate_hz NAV-PVT, in the old (CFG-RATE, CFG-MSG) and the new (CFG-VALSET) way since which one
+  a receiver takes depends on its generation, the other is NAKed. With baud, the UART is switched to it last"""
+  measurement_ms = int(round(1000 / rate_hz))
+  frames = [cfg_rate(measurement_ms), cfg_msg(CLASS_NAV, NAV_PVT, 1),
+    cfg_valset([(KEY_RATE_MEAS, measurement_ms), (KEY_MSGOUT_NAV_PVT_UART1, 1), (KEY_MSGOUT_NAV_PVT_USB, 1)])]
+
+  if (baud != None):
+    frames.extend([cfg_prt_uart1(baud), cfg_valset([(KEY_UART1_BAUDRATE, baud)])])
+
+  return frames
+
+def parse_nav_pvt(payload):
+  """NavPvt of a NAV-PVT payload"""
+  (itow, year, month, day, hour, minute, second, valid, t_acc, nano, fix_type, flags, flags2, satellites,
+    lon, lat, height, height_msl, h_acc, v_acc, vel_n, vel_e, vel_d, ground_speed, heading, s_acc, heading_acc, pdop,
+    heading_vehicle, mag_dec, mag_acc) = NAV_PVT_FORMAT.unpack_from(payload)
+
+  fix_time = None
+  if ((valid & (NAV_PVT_VALID_DATE | NAV_PVT_VALID_TIME | NAV_PVT_FULLY_RESOLVED)) == (NAV_PVT_VALID_DATE | NAV_PVT_VALID_TIME | NAV_PVT_FULLY_RESOLVED)):
+    fix_time = calendar.timegm((year, month, day, hour, minute, second, 0, 0, 0)) + (nano * 1e-9)
+
+  return NavPvt(itow, fix_time, fix_type, bool(flags & NAV_PVT_GNSS_FIX_OK), bool(flags & NAV_PVT_DIFF_SOLN), satellites,
+    lat * 1e-7, lon * 1e-7, height * 1e-3, height_msl * 1e-3, h_acc * 1e-3, v_acc * 1e-3,
+    vel_n * 1e-3, vel_e * 1e-3, vel_d * 1e-3, ground_speed * 1e-3, heading * 1e-5, s_acc * 1e-3, heading_acc * 1e-5, pdop * 0.01)
+
+class UbxReader:
+  """Frames out of a byte stream in whatever pieces it comes. Anything between frames (NMEA, noise) is skipped"""
+  def __init__(self):
+    self.buffer = bytearray()
+
+    # Counters
+    self.frames_total = 0
+    self.checksum_errors_total = 0
+    self.skipped_bytes_total = 0
+
+  def feed(self, data):
+    """[(class, id, payload)] of the frames completed by data"""
+    buffer = self.buffer
+    buffer += data
+    frames = []
+    i = 0
+
+    while True:
+      start = buffer.find(SYNC, i)
+      if (start < 0):
+        # Keep a last byte which could be the start of a sync
+        keep = 1 if (len(buffer) > 0 and buffer[-1] == SYNC[0]) else 0
+        self.skipped_bytes_total += len(buffer) - i - keep
+        i = len(buffer) - keep
+        break
+
+      self.skipped_bytes_total += start - i
+      if (len(buffer) - start < HEADER_BYTES):
+        i = start
+        break
+
+      (msg_class, msg_id, length) = HEADER.unpack_from(buffer, start + 2)
+      if (length > MAX_PAYLOAD_BYTES):
+        self.skipped_bytes_total += 1
+        i = start + 1
+        continue
+
+      end = start + HEADER_BYTES + length + CHECKSUM_BYTES
+      if (len(buffer) < end):
+        i = start
+        break
+
+      body = buffer[start + 2:end - CHECKSUM_BYTES]
+      if (checksum(body) != (buffer[end - 2], buffer[end - 1])):
+        # Could have been a sync pattern inside something else, look again right after it
+        self.checksum_errors_total += 1
+        i = start + 1
+        continue
+
+      frames.append((msg_class, msg_id, bytes(body[4:])))
+      self.frames_total += 1
+      i = end
+
+    del buffer[0:i]
+    return frames
+
+if __name__ == '__main__':
+  # Summary of a recorded UBX stream, u-center .ubx logs included
+  reader = UbxReader()
+  counts = collections.Counter()
+  last = None
+
+  with open(sys.argv[1], 'rb') as ubx_file:
+    while True:
+      data = ubx_file.read(65536)
+      if (len(data) == 0):
+        break
+
+      for msg_class, msg_id, payload in reader.feed(data):
+        counts[(msg_class, msg_id)] += 1
+        if (msg_class == CLASS_NAV and msg_id == NAV_PVT and len(payload) >= NAV_PVT_FORMAT.size):
+          last = parse_nav_pvt(payload)
+
+  print(f'{reader.frames_total:d} frames, {reader.checksum_errors_total:d} checksum errors, {reader.skipped_bytes_total:d} bytes skipped')
+  for (msg_class, msg_id), count in sorted(counts.items()):
+    print(f'  {msg_class:02x} {msg_id:02x}: {count:d}')
+  if (last != None):
+    print(f'Last NAV-PVT: {last}')
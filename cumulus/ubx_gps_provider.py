@@ -0,0 +1,136 @@
+#### file: ubx_gps_provider.py
+
+import time
+import serial
+
+from . import input_log
+from . import nmea
+from . import nmea_gps_provider
+from . import ubx
+from .event_log import LOG
+
+DEFAULT_RATE_HZ = 5
+
+# Time for the receiver to send what it has queued at the old baud before the port follows it to the new one
+BAUD_SWITCH_WAIT_S = 0.1
+
+METERS_PER_SECOND_TO_KTS = 1.94384
+
+# NAV-PVT fix types as GSA fix types, dead reckoning alone is no fix
+FIX_TYPES = {
+  ubx.FIX_2D: nmea.FIX_2D,
+  ubx.FIX_3D: nmea.FIX_3D,
+  ubx.FIX_GNSS_DEAD_RECKONING: nmea.FIX_3D,
+}
+
+class UbxGpsProvider(nmea_gps_provider.NmeaGpsProvider):
+  """NAV-PVT from a u-blox receiver, which is set up over the serial port to send it at rate_hz, on a port switched to
+  ubx_baud if given. Fills the same snapshot as NMEA, and the vertical speed, ellipsoid height, accuracy and time NMEA
+  doesn't have. With a recorder, the raw bytes are logged, and a replay gives them back"""
+  def __init__(self, port, baud, rate_hz=DEFAULT_RATE_HZ, ubx_baud=None, recorder=None, replay=None):
+    super().__init__(port, baud, recorder = recorder, replay = replay)
+
+    self.rate_hz = rate_hz
+    self.ubx_baud = ubx_baud
+    self.reader = ubx.UbxReader()
+
+    # Counters
+    self.acks_total = 0
+    self.naks_total = 0
+
+    if (replay == None and self.serial_port != None and self.serial_port.is_open):
+      self.configure_receiver()
+
+  def configure_receiver(self):
+    """Ask for NAV-PVT and switch the baud. Everything is sent again at the new baud, for a receiver already switched
+    by an earlier run, which never heard the first lot"""
+    try:
+      switch_baud = (self.ubx_baud != None and self.ubx_baud != self.serial_port.baudrate)
+      self.serial_port.write(b''.join(ubx.configuration(self.rate_hz, self.ubx_baud if switch_baud else None)))
+
+      if (switch_baud):
+        self.serial_port.flush()
+        time.sleep(BAUD_SWITCH_WAIT_S)
+        self.serial_port.baudrate = self.ubx_baud
+        self.serial_port.write(b''.join(ubx.configuration(self.rate_hz)))
+    except (serial.SerialException, OSError, ValueError) as e:
+      LOG.warning('gps', 'GPS: Could not configure the receiver: %s', e)
+
+  def _reopen(self):
+    super()._reopen()
+    if (self.serial_port != None and self.serial_port.is_open):
+      self.configure_receiver()
+
+  def has_fix(self, snapshot):
+    return snapshot.fix == nmea.FIX_3D
+
+  def run(self):
+    while True:
+      try:
+        data = self.serial_port.read(max(self.serial_port.in_waiting, 1))
+      except (serial.SerialException, OSError, AttributeError, TypeError):
+        # A replay has no port to reopen
+        if (self.replay == None):
+          self._reopen()
+        time.sleep(nmea_gps_provider.RECONNECT_WAIT_TIME)
+        continue
+
+      # The read timed out, or the replay is over
+      if (len(data) == 0):
+        continue
+
+      if (self.recorder != None):
+        self.recorder.record(input_log.SOURCE_UBX, data)
+
+      self.process_bytes(data)
+
+  def process_bytes(self, data):
+    """Fold whatever frames data completes into the snapshot"""
+    now = time.time()
+
+    for msg_class, msg_id, payload in self.reader.feed(data):
+      if (msg_class == ubx.CLASS_NAV and msg_id == ubx.NAV_PVT):
+        if (len(payload) < ubx.NAV_PVT_FORMAT.size):
+          self.parse_errors_total += 1
+          continue
+
+        self.sentences_total += 1
+        self._process_nav_pvt(ubx.parse_nav_pvt(payload), now)
+      elif (msg_class == ubx.CLASS_ACK):
+        # Every receiver NAKs one of the two ways configuration is sent
+        self.sentences_total += 1
+        if (msg_id == ubx.ACK_ACK):
+          self.acks_total += 1
+        else:
+          self.naks_total += 1
+          LOG.debug('gps', 'GPS: Configuration %02x %02x not taken', payload[0] if len(payload) > 0 else 0, payload[1] if len(payload) > 1 else 0)
+      else:
+        self.unsupported_total += 1
+
+    self.checksum_errors_total = self.reader.checksum_errors_total
+
+  def _process_nav_pvt(self, pvt, now):
+    if (pvt.time != None):
+      self.snapshot = self.snapshot._replace(fix_time = pvt.time, fix_received = time.monotonic())
+
+    fix = (FIX_TYPES.get(pvt.fix_type, nmea.FIX_NONE) if pvt.fix_ok else nmea.FIX_NONE)
+    if (fix == nmea.FIX_NONE):
+      # Keep the last position, as with NMEA's empty fields
+      self.snapshot = self.snapshot._replace(position_time = now, quality = nmea.QUALITY_NONE, fix = fix,
+        satellites = pvt.satellites)
+      return
+
+    self.snapshot = self.snapshot._replace(position_time = now,
+      velocity_time = now,
+      quality = (nmea.QUALITY_DGPS if pvt.differential else nmea.QUALITY_GPS),
+      fix = fix,
+      lat = int(round(pvt.lat * nmea.COORDINATE_SCALE)),
+      lon = int(round(pvt.lon * nmea.COORDINATE_SCALE)),
+      alt = pvt.height_msl,
+      course = pvt.heading,
+      h_speed = pvt.ground_speed * METERS_PER_SECOND_TO_KTS,
+      satellites = pvt.satellites,
+      v_speed = -pvt.vel_d,
+      geo_alt = pvt.height,
+      h_acc = pvt.h_acc,
+      v_acc = pvt.v_acc)
@@ -0,0 +1,190 @@
+#### file: uplink_relay.py
+
+import collections
+import threading
+import time
+
+# UAT uplink frame layout (DO-282B 2.2.3.2): an 8 byte ground station header, then 424 bytes of
+# application data made of info frames, FIS-B APDUs when the info frame type is 0
+UPLINK_HEADER_BYTES = 8
+UPLINK_PAYLOAD_BYTES = 432
+INFO_FRAME_TYPE_FISB = 0
+
+# Priorities, lower goes first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# FIS-B product IDs: text (METAR, TAF, PIREP, winds aloft), NOTAMs and advisories ahead of the bulky graphics
+DEFAULT_PRODUCT_PRIORITIES = {
+  8: PRIORITY_HIGH,     # NOTAM
+  11: PRIORITY_HIGH,    # AIRMET
+  12: PRIORITY_HIGH,    # SIGMET
+  13: PRIORITY_HIGH,    # SUA status
+  14: PRIORITY_HIGH,    # G-AIRMET
+  15: PRIORITY_HIGH,    # Center weather advisory
+  16: PRIORITY_HIGH,    # NOTAM TFR
+  413: PRIORITY_HIGH,   # Generic textual data, METAR/TAF/PIREP/winds
+  63: PRIORITY_LOW,     # Regional NEXRAD
+  64: PRIORITY_LOW,     # CONUS NEXRAD
+  70: PRIORITY_LOW,     # Icing
+  71: PRIORITY_LOW,
+  84: PRIORITY_LOW,     # Cloud tops
+  90: PRIORITY_LOW,     # Turbulence
+  91: PRIORITY_LOW,
+  103: PRIORITY_LOW,    # Lightning
+}
+
+# Defaults, the old fixed 5 uplinks per 250 ms frame is 20 per second
+DEFAULT_RATE = 20.0
+DEFAULT_BURST = 10
+DEFAULT_MAX_QUEUED = 256
+DEFAULT_DEDUP_SIZE = 1024
+
+# A frame seen again within this window is a rebroadcast by another tower, after it a legitimate repeat
+DEDUP_WINDOW_S = 60
+
+# Frames queued longer than this are stale, dropped rather than relayed late
+MAX_QUEUE_AGE_S = 20
+
+def fisb_product_ids(frame):
+  """FIS-B product IDs of the info frames in an uplink payload"""
+  product_ids = []
+  position = UPLINK_HEADER_BYTES
+  end = min(len(frame), UPLINK_PAYLOAD_BYTES)
+
+  # Application data valid flag
+  if (len(frame) <= 6 or (frame[6] & 0x20) == 0):
+    return product_ids
+
+  while (position + 2 <= end):
+    length = (frame[position] << 1) | (frame[position + 1] >> 7)
+    frame_type = frame[position + 1] & 0x0f
+
+    if ((length == 0 and frame_type == 0) or position + 2 + length > end):
+      break
+
+    if (frame_type == INFO_FRAME_TYPE_FISB and length >= 4):
+      product_ids.append(((frame[position + 2] & 0x1f) << 6) | (frame[position + 3] >> 2))
+
+    position += 2 + length
+
+  return product_ids
+
+class UplinkRelay:
+  """Bounded FIS-B uplink queue between dump978 and the frame loop
+  Rebroadcasts of the same application data by other ground stations are suppressed through an LRU of
+  payload hashes, frames wait in per priority queues, and a token bucket decides how many go out"""
+  def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, max_queued=DEFAULT_MAX_QUEUED, dedup_size=DEFAULT_DEDUP_SIZE,
+    product_priorities=DEFAULT_PRODUCT_PRIORITIES):
+    self.rate = rate
+    self.burst = burst
+    self.max_queued = max_queued
+    self.dedup_size = dedup_size
+    self.product_priorities = product_priorities
+
+    # payload hash: first seen, least recently seen first
+    self.seen = collections.OrderedDict()
+
+    # One FIFO of (queued time, frame) per priority
+    self.queues = [collections.deque() for x in range(0, PRIORITY_LOW + 1)]
+    self.queued = 0
+
+    self.tokens = burst
+    self.last_refill = None
+    self.lock = threading.Lock()
+
+    # Counters
+    self.received_total = 0
+    self.dedup_hits_total = 0
+    self.dropped_total = 0
+    self.expired_total = 0
+    self.relayed_total = 0
+    self.queue_age_max = 0.0
+    self.queue_age_sum = 0.0
+
+  def priority(self, frame):
+    """Best priority of the products in frame, normal if it has none we know"""
+    return min((self.product_priorities.get(product_id, PRIORITY_NORMAL) for product_id in fisb_product_ids(frame)), default=PRIORITY_NORMAL)
+
+  def _is_duplicate(self, frame, now):
+    # The header differs per ground station, only the application data identifies a rebroadcast
+    key = hash(bytes(frame[UPLINK_HEADER_BYTES:]))
+    first_seen = self.seen.get(key)
+
+    if (first_seen != None and now - first_seen < DEDUP_WINDOW_S):
+      self.seen.move_to_end(key)
+      return True
+
+    self.seen[key] = now
+    self.seen.move_to_end(key)
+    if (len(self.seen) > self.dedup_size):
+      self.seen.popitem(last=False)
+
+    return False
+
+  def put(self, frame, now=None):
+    """queue.Queue style put of an uplink payload from dump978"""
+    if (now == None):
+      now = time.time()
+
+    priority = self.priority(frame)
+
+    with self.lock:
+      self.received_total += 1
+
+      if (self._is_duplicate(frame, now)):
+        self.dedup_hits_total += 1
+        return
+
+      # Full, make room by dropping the oldest frame of the least important non empty queue, unless that is less important than this one
+      if (self.queued >= self.max_queued):
+        victim = max(x for x, queue in enumerate(self.queues) if len(queue) > 0)
+        self.dropped_total += 1
+        if (victim < priority):
+          return
+
+        self.queues[victim].popleft()
+        self.queued -= 1
+
+      self.queues[priority].append((now, frame))
+      self.queued += 1
+
+  def take(self, now):
+    """Uplink payloads to send now, highest priority and then oldest first, as many as the token bucket allows"""
+    frames = []
+
+    with self.lock:
+      if (self.last_refill != None):
+        self.tokens = min(self.burst, self.tokens + ((now - self.last_refill) * self.rate))
+      self.last_refill = now
+
+      for queue in self.queues:
+        # Stale frames are dropped without costing a token
+        while (len(queue) > 0 and now - queue[0][0] > MAX_QUEUE_AGE_S):
+          queue.popleft()
+          self.queued -= 1
+          self.expired_total += 1
+
+        while (len(queue) > 0 and self.tokens >= 1):
+          (queued_time, frame) = queue.popleft()
+          self.queued -= 1
+          self.tokens -= 1
+
+          age = now - queued_time
+          self.queue_age_max = max(self.queue_age_max, age)
+          self.queue_age_sum += age
+          self.relayed_total += 1
+          frames.append(frame)
+
+    return frames
+
+  def oldest_age(self, now):
+    """Seconds the oldest queued frame has been waiting, 0 if the queue is empty"""
+    with self.lock:
+      oldest = [queue[0][0] for queue in self.queues if len(queue) > 0]
+
+    return (now - min(oldest)) if (len(oldest) > 0) else 0.0
+
+  def __len__(self):
+    return self.queued
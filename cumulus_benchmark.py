@@ -0,0 +1,1258 @@
+#!/usr/bin/env python3
+
+import time
+import socket
+import threading
+import argparse
+import random
+import collections
+import math
+import json
+import sys
+import timeit
+import platform
+import datetime
+import os
+import asyncio
+import configparser
+
+import numpy as np
+
+import cumulus.dump1090_provider
+import cumulus.mode_s
+import cumulus.traffic_table
+import cumulus.target_mailbox
+import cumulus.report_scheduler
+import cumulus.cumulus
+import cumulus.cumulus_async
+import cumulus.adsb_target
+import cumulus.gdl90_output
+import cumulus.gdl90encoder
+import cumulus.gdl90fcs
+import cumulus.uat
+import cumulus.dump978_provider
+import cumulus.uat_demod
+import cumulus.reed_solomon
+import cumulus.mode_s_demod
+import cumulus.event_log
+import cumulus.nmea
+import cumulus.nmea_gps_provider
+import cumulus.ubx
+import cumulus.ubx_gps_provider
+import cumulus.frame_scheduler
+import cumulus.frame_stats
+
+SBS1_BENCH_MESSAGES = 200000
+SBS1_BENCH_TARGETS = 500
+
+BEAST_BENCH_MESSAGES = 100000
+
+TABLE_BENCH_SIZES = (50, 500, 5000)
+TABLE_BENCH_UPDATES_PER_FRAME = 100
+TABLE_BENCH_FRAMES = 200
+
+EXTRAPOLATION_BENCH_AIRCRAFT = 200
+EXTRAPOLATION_BENCH_DURATION_S = 120
+EXTRAPOLATION_BENCH_STEP_S = 0.1
+EXTRAPOLATION_BENCH_MEAN_RECEPTION_S = 1.0
+EXTRAPOLATION_BENCH_MAX_AGE_S = 4
+EXTRAPOLATION_BENCH_FRAMES = 200
+
+# The asyncio engine's traffic report task left running with nothing changing, one target inside the range and one
+# outside, for this long. More passes than the report rate allows for, times the slack, is a busy loop
+ASYNC_REPORTS_BENCH_S = 2.0
+ASYNC_REPORTS_BENCH_RANGE_NM = 10
+ASYNC_REPORTS_BENCH_SLACK = 2
+
+# Report tiers over this many simulated 250 ms frames, each frame up to JITTER_S late, one target per tier this many
+# nautical miles out. A tier is off if its report count is more than one away from what its interval gives
+REPORT_TIERS_BENCH_SPEC = '2:0.25, 10:1, *:5'
+REPORT_TIERS_BENCH_FRAMES = 400
+REPORT_TIERS_BENCH_JITTER_S = 0.0005
+REPORT_TIERS_BENCH_DISTANCES_NM = (1, 5, 50)
+
+UAT_BENCH_FRAMES = 100000
+UAT_BENCH_TARGETS = 300
+
+UAT_DEMOD_BENCH_SECONDS = 4
+UAT_DEMOD_BENCH_FRAMES_PER_S = 60
+UAT_DEMOD_BENCH_NOISE = 0.3
+UAT_DEMOD_BENCH_FREQUENCY_OFFSET = 0.05
+
+MODE_S_DEMOD_BENCH_MESSAGES = 5000
+MODE_S_DEMOD_BENCH_NOISE = 3.0
+MODE_S_DEMOD_BENCH_BIT_ERROR_FRACTION = 0.2
+
+# Aircraft in view for the hot path benchmarks, every figure is per 250 ms frame of this many
+HOT_PATH_FLEET_SIZES = (10, 100, 1000, 10000)
+
+# Each figure is the best of this many runs, each run at least this long
+HOT_PATH_REPEATS = 5
+HOT_PATH_MIN_RUN_S = 0.05
+
+# Default change against a baseline reported as a regression, fraction
+DEFAULT_REGRESSION_THRESHOLD = 0.1
+
+# Target updates per 250 ms frame, 1000 is 4000 messages per second
+LOGGING_BENCH_UPDATES_PER_FRAME = (100, 1000)
+
+# A 10 Hz receiver's worth of sentences, with this fraction corrupted and this fraction of unsupported GSV
+NMEA_BENCH_SECONDS = 300
+NMEA_BENCH_RATE_HZ = 10
+NMEA_BENCH_CORRUPT_FRACTION = 0.01
+NMEA_BENCH_GSV_FRACTION = 0.1
+NMEA_BENCH_TIMEOUT_S = 60
+
+# Frame loops at a shorter period than the real one to keep the run short, every OVERRUN_EVERY'th frame taking
+# OVERRUN_FACTOR periods
+FRAME_BENCH_PERIOD_S = 0.02
+FRAME_BENCH_FRAMES = 250
+FRAME_BENCH_WORK_S = 0.002
+FRAME_BENCH_OVERRUN_EVERY = 25
+FRAME_BENCH_OVERRUN_FACTOR = 1.5
+
+# Same flight as the NMEA benchmark, as NAV-PVT with NMEA in between, fed to the provider in pieces this big
+UBX_BENCH_CHUNK_BYTES = 64
+
+ENCODER_BENCH_CASES = 5000
+ENCODER_BENCH_FRAMES = 50000
+
+# Identification, even/odd airborne position and airborne velocity squitters
+BEAST_BENCH_SQUITTERS = [bytes.fromhex(x) for x in (
+  '8D4840D6202CC371C32CE0576098',
+  '8D40621D58C382D690C8AC2863A7',
+  '8D40621D58C386435CC412692AD6',
+  '8D485020994409940838175B284F',
+)]
+
+def generate_sbs1_lines(count, target_count):
+  """Generate a mix of the SBS1 MSG types dump1090 emits on port 30003"""
+  rng = random.Random(1)
+  codes = [rng.randrange(0x100000, 0xffffff) for x in range(0, target_count)]
+  lines = []
+
+  for x in range(0, count):
+    code = codes[x % target_count]
+    msg_type = (1, 3, 3, 4, 4, 5)[x % 6]
+    fields = ['MSG', str(msg_type), '1', '1', f'{code:06X}', '1', '2024/01/01', '00:00:00.000', '2024/01/01', '00:00:00.000'] + [''] * 12
+
+    if (msg_type == 1):
+      fields[10] = f'N{code % 99999:d}'
+    elif (msg_type == 3):
+      fields[11] = str(rng.randrange(0, 40000))
+      fields[14] = f'{rng.uniform(30, 40):.5f}'
+      fields[15] = f'{rng.uniform(-120, -110):.5f}'
+    elif (msg_type == 4):
+      fields[12] = str(rng.randrange(0, 500))
+      fields[13] = str(rng.randrange(0, 360))
+      fields[16] = str(rng.randrange(-2000, 2000))
+    else:
+      fields[11] = str(rng.randrange(0, 40000))
+
+    fields[21] = '0'
+    lines.append(','.join(fields))
+
+  return lines
+
+def _serve_sbs1(server_socket, payload):
+  connection, address = server_socket.accept()
+  connection.sendall(payload)
+  connection.close()
+  server_socket.close()
+
+def bench_sbs1_reader():
+  """Dump1090Provider read + parse throughput against a local fake SBS1 server"""
+  lines = generate_sbs1_lines(SBS1_BENCH_MESSAGES, SBS1_BENCH_TARGETS)
+  payload = ('\r\n'.join(lines) + '\r\n').encode('ascii')
+
+  server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  server_socket.bind(('127.0.0.1', 0))
+  server_socket.listen(1)
+  server = threading.Thread(target=_serve_sbs1, args=(server_socket, payload), daemon=True)
+  server.start()
+
+  provider = cumulus.dump1090_provider.Dump1090Provider('127.0.0.1', server_socket.getsockname()[1], cumulus.target_mailbox.TargetMailbox())
+  provider._connect()
+
+  message_count = 0
+  wall_start = time.perf_counter()
+  cpu_start = time.thread_time()
+
+  while message_count < SBS1_BENCH_MESSAGES:
+    message_count += len(provider.parse_sentences(provider.read_sentences()))
+
+  cpu = time.thread_time() - cpu_start
+  wall = time.perf_counter() - wall_start
+  provider.socket.close()
+
+  return {
+    'messages': message_count,
+    'messages_per_s': message_count / wall,
+    'cpu_us_per_message': cpu / message_count * 1e6,
+  }
+
+def bench_beast_decoder():
+  """Beast framing plus DF17 decode cost per message"""
+  frames = []
+  for x in range(0, BEAST_BENCH_MESSAGES):
+    body = bytes(7) + BEAST_BENCH_SQUITTERS[x % len(BEAST_BENCH_SQUITTERS)]
+    frames.append(b'\x1a\x33' + body.replace(b'\x1a', b'\x1a\x1a'))
+  block = b''.join(frames)
+
+  decoder = cumulus.mode_s.ModeSDecoder()
+  wall_start = time.perf_counter()
+  cpu_start = time.thread_time()
+
+  (messages, consumed) = cumulus.dump1090_provider.Dump1090BeastProvider.parse_beast(block)
+  updates = 0
+  for msg in messages:
+    if (decoder.decode(msg, 0) != None):
+      updates += 1
+
+  cpu = time.thread_time() - cpu_start
+  wall = time.perf_counter() - wall_start
+
+  return {
+    'messages': len(messages),
+    'updates': updates,
+    'messages_per_s': len(messages) / wall,
+    'cpu_us_per_message': cpu / len(messages) * 1e6,
+  }
+
+def generate_target_updates(count, timestamp, rng):
+  return [{'mode_s_code': 0x100000 + x, 'lat': rng.uniform(39, 41), 'lon': rng.uniform(-106, -104),
+    'altitude': rng.randrange(0, 40000), 'horizontal_speed': rng.randrange(0, 500), 'track': rng.randrange(0, 360),
+    'last_seen': timestamp, 'position_time': timestamp} for x in range(0, count)]
+
+def bench_traffic_table():
+  """Per frame merge, prune and distance cost of TrafficTable versus the old dict of dicts, by table size"""
+  results = {}
+  rng = random.Random(1)
+
+  for size in TABLE_BENCH_SIZES:
+    updates = generate_target_updates(size, 1000.0, rng)
+    frame_updates = [updates[rng.randrange(0, size)] for x in range(0, TABLE_BENCH_UPDATES_PER_FRAME)]
+
+    # Columnar table
+    table = cumulus.traffic_table.TrafficTable(cumulus.cumulus.DEFAULT_TARGET)
+    table.upsert(updates)
+    start = time.perf_counter()
+    for x in range(0, TABLE_BENCH_FRAMES):
+      table.upsert(frame_updates)
+      table.prune(1001.0, cumulus.cumulus.MAX_TARGET_KEEP_TIMEOUT)
+      table.update_geometry(40.0, -105.0)
+    results[f'table_us_per_frame_{size:d}'] = (time.perf_counter() - start) / TABLE_BENCH_FRAMES * 1e6
+
+    # Reference: the dict of dicts loop Cumulus.run used to do
+    targets = {u['mode_s_code']: {**cumulus.cumulus.DEFAULT_TARGET, **u} for u in updates}
+    start = time.perf_counter()
+    for x in range(0, TABLE_BENCH_FRAMES):
+      for u in frame_updates:
+        targets[u['mode_s_code']] = {**targets[u['mode_s_code']], **u, 'updated': True}
+      purge_list = [k for k, t in targets.items() if 1001.0 - t['last_seen'] > cumulus.cumulus.MAX_TARGET_KEEP_TIMEOUT]
+      for k in purge_list:
+        del targets[k]
+      for k, t in targets.items():
+        t['distance'] = cumulus.cumulus.calculate_distance_between_coords((40.0, -105.0), (t['lat'], t['lon']))
+    results[f'dict_us_per_frame_{size:d}'] = (time.perf_counter() - start) / TABLE_BENCH_FRAMES * 1e6
+
+  return results
+
+def generate_flight_receptions(aircraft_count, duration, rng):
+  """Fly aircraft through straight legs, standard rate turns, climbs and descents, and 'receive' each one at random
+  intervals with the odd multi second dropout. Returns time ordered target updates, each with its true state"""
+  receptions = []
+
+  for x in range(0, aircraft_count):
+    lat = rng.uniform(39, 41)
+    lon = rng.uniform(-106, -104)
+    altitude = rng.uniform(2000, 38000)
+    speed = rng.uniform(90, 480)
+    track = rng.uniform(0, 360)
+    turn_rate = 0.0
+    vertical_rate = 0.0
+
+    t = 0.0
+    while (t < duration):
+      # New manoeuvre every so often
+      if (rng.random() < EXTRAPOLATION_BENCH_STEP_S / 20.0):
+        turn_rate = rng.choice((0.0, 0.0, 3.0, -3.0))
+        vertical_rate = rng.choice((0.0, 0.0, 1500.0, -1500.0))
+
+      track = (track + turn_rate * EXTRAPOLATION_BENCH_STEP_S) % 360.0
+      distance_deg = speed * EXTRAPOLATION_BENCH_STEP_S / 3600.0 / 60.0
+      lat += distance_deg * math.cos(math.radians(track))
+      lon += distance_deg * math.sin(math.radians(track)) / math.cos(math.radians(lat))
+      altitude += vertical_rate * EXTRAPOLATION_BENCH_STEP_S / 60.0
+      t += EXTRAPOLATION_BENCH_STEP_S
+
+      if (rng.random() < EXTRAPOLATION_BENCH_STEP_S / EXTRAPOLATION_BENCH_MEAN_RECEPTION_S):
+        receptions.append({'mode_s_code': 0x100000 + x, 'lat': lat, 'lon': lon, 'altitude': int(altitude),
+          'horizontal_speed': int(speed), 'track': int(track), 'vertical_rate': int(vertical_rate), 'last_seen': t, 'position_time': t})
+
+  receptions.sort(key=lambda reception: reception['last_seen'])
+  return receptions
+
+def _position_error_m(lat, lon, true_lat, true_lon):
+  return 1852.0 * 60.0 * np.hypot(lat - true_lat, (lon - true_lon) * np.cos(np.radians(true_lat)))
+
+def bench_extrapolation():
+  """Replay receptions, predicting each from the target's previous one: held versus dead reckoned error,
+  then the per frame cost of extrapolating every target"""
+  rng = random.Random(1)
+  receptions = generate_flight_receptions(EXTRAPOLATION_BENCH_AIRCRAFT, EXTRAPOLATION_BENCH_DURATION_S, rng)
+
+  # Pair every reception with the target's previous one, then predict all of them in one batch from a table
+  # holding each previous reception as its own row
+  previous = {}
+  pairs = []
+  for reception in receptions:
+    last = previous.get(reception['mode_s_code'])
+    if (last != None):
+      pairs.append((last, reception))
+    previous[reception['mode_s_code']] = reception
+
+  replay = cumulus.traffic_table.TrafficTable(cumulus.cumulus.DEFAULT_TARGET, capacity = len(pairs))
+  replay.upsert([dict(last, mode_s_code = x) for x, (last, reception) in enumerate(pairs)])
+  replay_rows = np.array([replay.index[x] for x in range(0, len(pairs))], dtype=np.intp)
+  reception_time = np.array([reception['last_seen'] for last, reception in pairs])
+  true_lat = np.array([reception['lat'] for last, reception in pairs])
+  true_lon = np.array([reception['lon'] for last, reception in pairs])
+  true_altitude = np.array([reception['altitude'] for last, reception in pairs])
+
+  (lat, lon, altitude, extrapolated) = replay.extrapolate(replay_rows, reception_time, EXTRAPOLATION_BENCH_MAX_AGE_S)
+  held_error = _position_error_m(replay.columns['lat'][replay_rows], replay.columns['lon'][replay_rows], true_lat, true_lon)
+  extrapolated_error = _position_error_m(lat, lon, true_lat, true_lon)
+
+  results = {
+    'receptions': len(receptions),
+    'predictions': len(pairs),
+    'extrapolated_fraction': float(np.mean(extrapolated)),
+    'mean_gap_s': float(np.mean(reception_time - replay.columns['position_time'][replay_rows])),
+    'held_mean_error_m': float(np.mean(held_error)),
+    'held_p95_error_m': float(np.percentile(held_error, 95)),
+    'extrapolated_mean_error_m': float(np.mean(extrapolated_error)),
+    'extrapolated_p95_error_m': float(np.percentile(extrapolated_error, 95)),
+    'held_mean_altitude_error_ft': float(np.mean(np.abs(replay.columns['altitude'][replay_rows] - true_altitude))),
+    'extrapolated_mean_altitude_error_ft': float(np.mean(np.abs(altitude - true_altitude))),
+  }
+
+  # Cost of dead reckoning a whole table every frame
+  for size in TABLE_BENCH_SIZES:
+    frame_table = cumulus.traffic_table.TrafficTable(cumulus.cumulus.DEFAULT_TARGET)
+    frame_table.upsert(generate_target_updates(size, 1000.0, rng))
+    active = frame_table.active_rows()
+
+    start = time.perf_counter()
+    for x in range(0, EXTRAPOLATION_BENCH_FRAMES):
+      frame_table.extrapolate(active, 1001.0 + x * 0.01, EXTRAPOLATION_BENCH_MAX_AGE_S)
+    results[f'extrapolate_us_per_frame_{size:d}'] = (time.perf_counter() - start) / EXTRAPOLATION_BENCH_FRAMES * 1e6
+
+  return results
+
+def bench_async_reports():
+  """Traffic report passes of AsyncCumulus with [traffic] range_nm set, while the one target in range and the one out
+  of it stay as they are. The out of range target keeps its update flag, which must not keep waking the task"""
+  config = configparser.ConfigParser()
+  config.read_dict({'traffic': {'range_nm': str(ASYNC_REPORTS_BENCH_RANGE_NM)}})
+  engine = cumulus.cumulus_async.AsyncCumulus(config)
+
+  # What main() sets up, with the reports going to a socket of our own
+  receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  receiver.bind(('127.0.0.1', 0))
+  sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  engine.output = cumulus.gdl90_output.Gdl90Output(sender, receiver.getsockname())
+  engine.encoder = cumulus.gdl90encoder.FastEncoder()
+  engine.packet_total = 0
+  engine.ownship = cumulus.adsb_target.AdsbTarget(40.0, -105.0, 5000, 0, 0, 0, 'OWNSHIP', 0xabcdef)
+  engine.position_valid = True
+  engine.target_table = cumulus.traffic_table.TrafficTable(cumulus.cumulus.DEFAULT_TARGET)
+
+  now = time.time()
+  engine.target_table.upsert([
+    {'mode_s_code': 0x100001, 'lat': 40.05, 'lon': -105.0, 'altitude': 5000, 'last_seen': now, 'position_time': now},
+    {'mode_s_code': 0x100002, 'lat': 41.0, 'lon': -105.0, 'altitude': 5000, 'last_seen': now, 'position_time': now}])
+
+  async def run():
+    engine.traffic_changed = asyncio.Event()
+    engine.traffic_changed.set()
+    try:
+      await asyncio.wait_for(engine._traffic_report_task(), ASYNC_REPORTS_BENCH_S)
+    except asyncio.TimeoutError:
+      pass
+
+  cpu_start = time.process_time()
+  asyncio.run(run())
+  cpu = time.process_time() - cpu_start
+  sender.close()
+  receiver.close()
+
+  passes = engine.report_stats.frames_total
+  max_passes = (ASYNC_REPORTS_BENCH_S / engine.min_report_interval + 1) * ASYNC_REPORTS_BENCH_SLACK
+  if (passes > max_passes or engine.packet_total != 1):
+    raise AssertionError(f'{passes:d} report passes in {ASYNC_REPORTS_BENCH_S:.1f} s (at most {max_passes:.0f}), {engine.packet_total:d} reports (1 in range)')
+
+  return {
+    'passes': passes,
+    'reports': engine.packet_total,
+    'cpu_fraction': cpu / ASYNC_REPORTS_BENCH_S,
+  }
+
+def encode_uat_downlink(fields, frame_bytes):
+  """Pack raw UAT field values into a frame, the inverse of the decoder's extractors"""
+  bits = 0
+  for name, value in fields.items():
+    (start, length) = cumulus.uat.UAT_FIELDS[name]
+    bits |= (value & ((1 << length) - 1)) << ((frame_bytes * 8) - start - length)
+
+  return bits.to_bytes(frame_bytes, 'big')
+
+def generate_dump978_lines(count, target_count, rng):
+  """dump978 style '-<hex>;' downlink lines, basic state vectors with a long mode status frame every fifth,
+  and the update each one should decode to"""
+  lines = []
+  expected = []
+
+  for x in range(0, count):
+    address = 0xa00000 + (x % target_count)
+    lat = rng.uniform(-89, 89)
+    lon = rng.uniform(-179, 179)
+    raw_altitude = rng.randrange(1, 4000)
+    north = rng.randrange(-600, 600)
+    east = rng.randrange(-600, 600)
+    raw_vertical = rng.randrange(1, 512)
+    long_frame = (x % 5) == 0
+
+    fields = {'payload_type': 1 if long_frame else 0, 'address_qualifier': cumulus.uat.ADDRESS_ADSB_ICAO, 'address': address,
+      'lat': int(round(lat / cumulus.uat.LAT_LON_SCALE)) % (1 << 23), 'lon': int(round(lon / cumulus.uat.LAT_LON_SCALE)) % (1 << 24),
+      'altitude': raw_altitude, 'nic': 8, 'airground': cumulus.uat.AIRGROUND_SUBSONIC,
+      'north_velocity': (0x400 if north < 0 else 0) | (abs(north) + 1), 'east_velocity': (0x400 if east < 0 else 0) | (abs(east) + 1),
+      'vertical_velocity': raw_vertical}
+    update = {'mode_s_code': address, 'nic': 8, 'altitude': ((raw_altitude - 1) * 25) - 1000,
+      'horizontal_speed': int(round(math.hypot(north, east))), 'track': int(round(math.degrees(math.atan2(east, north)))) % 360,
+      'vertical_rate': (raw_vertical - 1) * 64}
+
+    if (long_frame):
+      callsign = f'N{address % 100000:05d}'.ljust(8)
+      digits = [1] + [cumulus.uat.BASE40_CHARSET.index(c) for c in callsign]
+      fields.update({f'ms_word{y + 1:d}': (digits[3 * y] * 1600) + (digits[(3 * y) + 1] * 40) + digits[(3 * y) + 2] for y in range(0, 3)})
+      fields.update({'nacp': 9, 'callsign_id': 1})
+      update.update({'emitter_category': 1, 'callsign': callsign.strip(), 'nacp': 9})
+
+    frame = encode_uat_downlink(fields, cumulus.uat.UAT_LONG_FRAME_BYTES if long_frame else cumulus.uat.UAT_BASIC_FRAME_BYTES)
+    lines.append(b'-' + frame.hex().encode('ascii') + b';rs=1;\n')
+    expected.append((update, lat, lon))
+
+  return (lines, expected)
+
+def bench_uat_decoder(dump978_log=None):
+  """dump978 downlink line parse + decode rate, on a recorded dump978 log if given, otherwise on generated
+  frames which are first checked to decode back to what was encoded"""
+  rng = random.Random(1)
+  results = {}
+
+  if (dump978_log != None):
+    with open(dump978_log, 'rb') as log_file:
+      lines = [line for line in log_file.readlines() if line.startswith(b'-')]
+    results['source'] = dump978_log
+  else:
+    (lines, expected) = generate_dump978_lines(UAT_BENCH_FRAMES, UAT_BENCH_TARGETS, rng)
+    results['source'] = 'generated'
+
+    for line, (update, lat, lon) in zip(lines, expected):
+      decoded = cumulus.uat.decode_uat_downlink(cumulus.dump978_provider.parse_dump978_line(line).frame, 0)
+      if (abs(decoded.pop('lat') - lat) > 1e-4 or abs(decoded.pop('lon') - lon) > 1e-4 or decoded != dict(update, last_seen = 0, position_time = 0, receiver = cumulus.uat.RECEIVER_978)):
+        raise AssertionError(f'{line}: {decoded} != {update}')
+
+  decoded_total = 0
+  start = time.perf_counter()
+  cpu_start = time.process_time()
+  for line in lines:
+    new_frame = cumulus.dump978_provider.parse_dump978_line(line)
+    if (new_frame != None and cumulus.uat.decode_uat_downlink(new_frame.frame, 0) != None):
+      decoded_total += 1
+  wall = time.perf_counter() - start
+  cpu = time.process_time() - cpu_start
+
+  results.update({
+    'frames': len(lines),
+    'decoded': decoded_total,
+    'frames_per_s': len(lines) / wall,
+    'cpu_us_per_frame': cpu / max(len(lines), 1) * 1e6,
+  })
+  return results
+
+def uat_frame_bits(frame_type, data):
+  """Sync word and Reed-Solomon coded, for uplinks interleaved, bits of a UAT frame as transmitted"""
+  if (frame_type == cumulus.dump978_provider.UatFrameType.UPLINK):
+    rs = cumulus.reed_solomon.ReedSolomon(cumulus.uat_demod.UPLINK_BLOCK_DATA_BYTES, cumulus.uat_demod.UPLINK_BLOCK_BYTES - cumulus.uat_demod.UPLINK_BLOCK_DATA_BYTES)
+    blocks = [data[x:x + cumulus.uat_demod.UPLINK_BLOCK_DATA_BYTES] for x in range(0, len(data), cumulus.uat_demod.UPLINK_BLOCK_DATA_BYTES)]
+    codewords = np.array([list(block + rs.encode(block)) for block in blocks], dtype=np.uint8)
+    raw = codewords.T.tobytes()
+    sync = cumulus.uat_demod.UPLINK_SYNC_WORD
+  else:
+    long_frame = len(data) == cumulus.uat_demod.DOWNLINK_LONG_DATA_BYTES
+    rs = cumulus.reed_solomon.ReedSolomon(len(data), (cumulus.uat_demod.DOWNLINK_LONG_BYTES if long_frame else cumulus.uat_demod.DOWNLINK_SHORT_BYTES) - len(data))
+    raw = data + rs.encode(data)
+    sync = cumulus.uat_demod.DOWNLINK_SYNC_WORD
+
+  sync_bits = np.array([(sync >> (cumulus.uat_demod.SYNC_BITS - 1 - x)) & 1 for x in range(0, cumulus.uat_demod.SYNC_BITS)], dtype=np.uint8)
+  return np.concatenate((sync_bits, np.unpackbits(np.frombuffer(raw, dtype=np.uint8))))
+
+def generate_uat_iq(seconds, frames_per_s, noise, frequency_offset, rng):
+  """rtl_sdr style u8 I/Q of random uplink and downlink frames with gaps, CPFSK with modulation index 0.6,
+  Gaussian noise (relative to the signal amplitude) and a frequency offset in radians per sample.
+  Returns (iq bytes, [(UatFrameType, payload)] in order)"""
+  noise_rng = np.random.default_rng(rng.randrange(0, 1 << 32))
+  total_samples = int(seconds * cumulus.uat_demod.SAMPLE_RATE)
+  steps = []
+  frames = []
+  sample = 0
+
+  while True:
+    gap = rng.randrange(100, int(2 * cumulus.uat_demod.SAMPLE_RATE / frames_per_s))
+    kind = rng.choice(('uplink', 'short', 'long', 'long'))
+    if (kind == 'uplink'):
+      frame_type = cumulus.dump978_provider.UatFrameType.UPLINK
+      data = bytes(rng.randrange(0, 256) for x in range(0, cumulus.uat_demod.UPLINK_BLOCKS * cumulus.uat_demod.UPLINK_BLOCK_DATA_BYTES))
+    elif (kind == 'short'):
+      frame_type = cumulus.dump978_provider.UatFrameType.DOWNLINK
+      data = bytes([rng.randrange(0, 8)] + [rng.randrange(0, 256) for x in range(1, cumulus.uat_demod.DOWNLINK_SHORT_DATA_BYTES)])
+    else:
+      frame_type = cumulus.dump978_provider.UatFrameType.DOWNLINK
+      data = bytes([rng.randrange(8, 256)] + [rng.randrange(0, 256) for x in range(1, cumulus.uat_demod.DOWNLINK_LONG_DATA_BYTES)])
+
+    bits = uat_frame_bits(frame_type, data)
+    if (sample + gap + (len(bits) * cumulus.uat_demod.SAMPLES_PER_BIT) > total_samples):
+      break
+
+    steps.append(np.zeros(gap))
+    steps.append(np.repeat((bits.astype(np.float64) * 2) - 1, cumulus.uat_demod.SAMPLES_PER_BIT) * (0.3 * math.pi))
+    frames.append((frame_type, data))
+    sample += gap + (len(bits) * cumulus.uat_demod.SAMPLES_PER_BIT)
+
+  steps.append(np.zeros(total_samples - sample))
+  phase = np.cumsum(np.concatenate(steps) + frequency_offset)
+  z = 50 * (np.exp(1j * phase) + (noise * (noise_rng.standard_normal(len(phase)) + (1j * noise_rng.standard_normal(len(phase))))))
+
+  iq = np.empty(2 * len(z))
+  iq[0::2] = z.real + cumulus.uat_demod.IQ_OFFSET
+  iq[1::2] = z.imag + cumulus.uat_demod.IQ_OFFSET
+  return (np.clip(np.rint(iq), 0, 255).astype(np.uint8).tobytes(), frames)
+
+def bench_uat_demodulator(iq_file=None):
+  """UatDemodulator throughput as a multiple of real time, on a recorded rtl_sdr file if given, otherwise on
+  generated I/Q which must demodulate to exactly the frames that were modulated"""
+  rng = random.Random(1)
+  results = {}
+
+  if (iq_file != None):
+    with open(iq_file, 'rb') as recording:
+      iq = recording.read()
+    expected = None
+    results['source'] = iq_file
+  else:
+    (iq, expected) = generate_uat_iq(UAT_DEMOD_BENCH_SECONDS, UAT_DEMOD_BENCH_FRAMES_PER_S, UAT_DEMOD_BENCH_NOISE, UAT_DEMOD_BENCH_FREQUENCY_OFFSET, rng)
+    results['source'] = 'generated'
+
+  demodulator = cumulus.uat_demod.UatDemodulator()
+  frames = []
+  start = time.perf_counter()
+  cpu_start = time.process_time()
+  for x in range(0, len(iq), cumulus.uat_demod.DEFAULT_BLOCK_BYTES):
+    frames.extend(demodulator.process(iq[x:x + cumulus.uat_demod.DEFAULT_BLOCK_BYTES]))
+  wall = time.perf_counter() - start
+  cpu = time.process_time() - cpu_start
+  frames.extend(demodulator.process(bytes([128]) * (cumulus.uat_demod.UPLINK_SPAN_SAMPLES * 2)))
+
+  if (expected != None):
+    received = [(frame.type, bytes(frame.frame)) for frame in frames]
+    if (received != expected):
+      missing = len([frame for frame in expected if frame not in received])
+      raise AssertionError(f'{len(received):d} frames demodulated, {len(expected):d} sent, {missing:d} missing')
+
+  seconds = (len(iq) // 2) / cumulus.uat_demod.SAMPLE_RATE
+  results.update({
+    'seconds': seconds,
+    'uplinks': demodulator.uplink_total,
+    'downlinks': demodulator.downlink_total,
+    'sync_candidates': demodulator.sync_candidates_total,
+    'rs_corrected_bytes': demodulator.rs_corrected_total,
+    'rs_failures': demodulator.rs_failures_total,
+    'realtime_factor': seconds / wall,
+    'cpu_s_per_s': cpu / seconds,
+  })
+  return results
+
+def generate_squitters(count, rng):
+  """DF17 messages with random ME fields and correct parity, led by the real squitters the beast benchmark uses"""
+  messages = list(BEAST_BENCH_SQUITTERS)
+  while (len(messages) < count):
+    body = bytes([0x8d] + [rng.randrange(0, 256) for x in range(0, 10)])
+    messages.append(body + cumulus.mode_s.crc24(body).to_bytes(3, 'big'))
+
+  return messages[0:count]
+
+def generate_mode_s_iq(messages, noise, bit_error_fraction, rng):
+  """2 Msps u8 I/Q of messages with random gaps, amplitudes and carrier phase, plus Gaussian noise.
+  bit_error_fraction of the messages go out with one bit (after the DF) flipped"""
+  noise_rng = np.random.default_rng(rng.randrange(0, 1 << 32))
+  preamble = np.zeros(cumulus.mode_s_demod.PREAMBLE_SAMPLES)
+  preamble[[0, 2, 7, 9]] = 1
+  parts = []
+
+  for msg in messages:
+    transmitted = bytearray(msg)
+    if (rng.random() < bit_error_fraction):
+      bit = rng.randrange(cumulus.mode_s_demod.CORRECTABLE_FIRST_BIT, cumulus.mode_s_demod.MESSAGE_BITS)
+      transmitted[bit // 8] ^= 0x80 >> (bit % 8)
+
+    bits = np.unpackbits(np.frombuffer(bytes(transmitted), dtype=np.uint8)).astype(np.float64)
+    chips = np.empty(len(bits) * 2)
+    chips[0::2] = bits
+    chips[1::2] = 1 - bits
+
+    parts.append(np.zeros(rng.randrange(200, 4000)))
+    parts.append(np.concatenate((preamble, chips)) * rng.uniform(20, 100))
+
+  parts.append(np.zeros(4000))
+  amplitude = np.concatenate(parts)
+  z = (amplitude * np.exp(1j * noise_rng.uniform(0, 2 * math.pi, len(amplitude)))
+    + (noise * (noise_rng.standard_normal(len(amplitude)) + (1j * noise_rng.standard_normal(len(amplitude))))))
+
+  iq = np.empty(2 * len(z))
+  iq[0::2] = z.real + 127.4
+  iq[1::2] = z.imag + 127.4
+  return np.clip(np.rint(iq), 0, 255).astype(np.uint8).tobytes()
+
+def read_dump1090_raw(path):
+  """DF17/18 messages from dump1090 --raw output, '*<hex>;' per line, optionally '@<timestamp>' instead of '*'"""
+  messages = []
+  with open(path, 'r') as raw_file:
+    for line in raw_file:
+      line = line.strip().rstrip(';')
+      if (line.startswith('@')):
+        line = line[13:]
+      elif (line.startswith('*')):
+        line = line[1:]
+      else:
+        continue
+
+      if (len(line) != cumulus.mode_s.MODE_S_LONG_MSG_BYTES * 2):
+        continue
+
+      try:
+        msg = bytes.fromhex(line)
+      except ValueError:
+        continue
+
+      if ((msg[0] >> 3) in cumulus.mode_s_demod.EXTENDED_SQUITTER_DFS and cumulus.mode_s.crc24_residual(msg) == 0):
+        messages.append(msg)
+
+  return messages
+
+def bench_mode_s_demodulator(iq_file=None, dump1090_raw=None):
+  """ModeSDemodulator decode rate and CPU per second of I/Q, on a recorded capture if given, otherwise on generated
+  I/Q. Compared against what dump1090 decoded from the same capture (its --raw output), or for generated I/Q
+  against the messages that were sent"""
+  rng = random.Random(1)
+  results = {}
+
+  if (iq_file != None):
+    with open(iq_file, 'rb') as recording:
+      iq = recording.read()
+    reference = read_dump1090_raw(dump1090_raw) if (dump1090_raw != None) else None
+    results['source'] = iq_file
+  else:
+    reference = generate_squitters(MODE_S_DEMOD_BENCH_MESSAGES, rng)
+    iq = generate_mode_s_iq(reference, MODE_S_DEMOD_BENCH_NOISE, MODE_S_DEMOD_BENCH_BIT_ERROR_FRACTION, rng)
+    results['source'] = 'generated'
+
+  demodulator = cumulus.mode_s_demod.ModeSDemodulator()
+  decoder = cumulus.mode_s.ModeSDecoder()
+  messages = []
+  updates = 0
+
+  start = time.perf_counter()
+  cpu_start = time.process_time()
+  for x in range(0, len(iq), cumulus.mode_s_demod.DEFAULT_BLOCK_BYTES):
+    for (sample, msg) in demodulator.process(iq[x:x + cumulus.mode_s_demod.DEFAULT_BLOCK_BYTES]):
+      messages.append(msg)
+      if (decoder.decode(msg, sample / cumulus.mode_s_demod.SAMPLE_RATE) != None):
+        updates += 1
+  wall = time.perf_counter() - start
+  cpu = time.process_time() - cpu_start
+
+  seconds = (len(iq) // 2) / cumulus.mode_s_demod.SAMPLE_RATE
+  results.update({
+    'seconds': seconds,
+    'preambles': demodulator.preambles_total,
+    'messages': demodulator.messages_total,
+    'corrected': demodulator.corrected_total,
+    'target_updates': updates,
+    'messages_per_iq_s': len(messages) / seconds,
+    'messages_per_cpu_s': len(messages) / cpu if (cpu > 0) else 0.0,
+    'cpu_s_per_iq_s': cpu / seconds,
+    'realtime_factor': seconds / wall,
+  })
+
+  if (reference != None):
+    ours = collections.Counter(messages)
+    theirs = collections.Counter(reference)
+    results.update({
+      'reference_messages': len(reference),
+      'matched': sum((ours & theirs).values()),
+      'only_ours': sum((ours - theirs).values()),
+      'only_reference': sum((theirs - ours).values()),
+    })
+
+  return results
+
+def generate_encoder_calls(count, rng):
+  """(method name, kwargs) for every message Cumulus.run sends, with values chosen to exercise clamping and escaping"""
+  calls = []
+
+  for x in range(0, count):
+    calls.append(('msgTrafficReport', {'latitude': rng.uniform(-95, 95), 'longitude': rng.uniform(-185, 185),
+      'altitude': rng.randrange(-2000, 110000), 'hVelocity': rng.choice((None, -1, rng.randrange(0, 5000))),
+      'vVelocity': rng.choice((None, rng.randrange(-40000, 40000))), 'trackHeading': rng.randrange(0, 360),
+      'callSign': rng.choice(('', 'N}~', 'UAL1234', 'TOOLONGCALLSIGN')), 'address': rng.randrange(0, 0x1000000),
+      'emitterCat': rng.randrange(0, 24), 'navIntegrityCat': rng.randrange(0, 16), 'navAccuracyCat': rng.randrange(0, 16)}))
+    calls.append(('msgOwnershipReport', {'latitude': rng.uniform(-90, 90), 'longitude': rng.uniform(-180, 180),
+      'altitude': rng.randrange(-1000, 60000), 'hVelocity': rng.randrange(0, 500), 'vVelocity': rng.randrange(-3000, 3000),
+      'trackHeading': rng.randrange(0, 360), 'callSign': 'N610SH'}))
+    calls.append(('msgHeartbeat', {'ts': rng.randrange(0, 86400), 'st1': rng.randrange(0, 256)}))
+    calls.append(('msgOwnershipGeometricAltitude', {'altitude': rng.randrange(-1000, 60000), 'merit': rng.choice((None, 50, 40000)), 'warning': rng.choice((True, False))}))
+    calls.append(('msgGpsTime', {'count': rng.randrange(0, 1 << 24), 'quality': rng.randrange(0, 3), 'hour': rng.randrange(0, 24), 'minute': rng.randrange(0, 60)}))
+    calls.append(('msgUatUplink', {'time_of_reception': None, 'uplink_payload': bytes(rng.randrange(0, 256) for y in range(0, 432))}))
+
+  return calls
+
+def bench_gdl90_encoder():
+  """Byte for byte conformance of FastEncoder against Encoder, then frames per second of each"""
+  rng = random.Random(1)
+  reference = cumulus.gdl90encoder.Encoder()
+  fast = cumulus.gdl90encoder.FastEncoder()
+
+  for name, kwargs in generate_encoder_calls(ENCODER_BENCH_CASES, rng):
+    expected = bytes(getattr(reference, name)(**kwargs))
+    actual = bytes(getattr(fast, name)(**kwargs))
+    if (expected != actual):
+      raise AssertionError(f'{name}({kwargs}): {expected.hex()} != {actual.hex()}')
+
+  results = {'conformance_cases': ENCODER_BENCH_CASES * 6}
+  report = {'latitude': 39.5, 'longitude': -104.8, 'altitude': 12500, 'hVelocity': 250, 'vVelocity': -500,
+    'trackHeading': 270, 'callSign': 'UAL1234', 'address': 0xa1b2c3}
+
+  for label, encoder in (('encoder', reference), ('fast_encoder', fast)):
+    start = time.perf_counter()
+    for x in range(0, ENCODER_BENCH_FRAMES):
+      encoder.msgTrafficReport(**report)
+    results[f'{label}_traffic_frames_per_s'] = ENCODER_BENCH_FRAMES / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for x in range(0, ENCODER_BENCH_FRAMES):
+      encoder.msgHeartbeat(ts = x)
+    results[f'{label}_heartbeat_frames_per_s'] = ENCODER_BENCH_FRAMES / (time.perf_counter() - start)
+
+  return results
+
+def _best_time(function):
+  """Best seconds per call of function out of HOT_PATH_REPEATS runs, each run repeating it for at least HOT_PATH_MIN_RUN_S"""
+  timer = timeit.Timer(function)
+  number = 1
+  while (timer.timeit(number) < HOT_PATH_MIN_RUN_S):
+    number *= 2
+
+  return min(timer.repeat(HOT_PATH_REPEATS, number)) / number
+
+def generate_fleet_frame(count, timestamp, rng):
+  """One frame's worth of input for count aircraft: target updates, their SBS1 sentences and their encoder arguments"""
+  updates = generate_target_updates(count, timestamp, rng)
+  sentences = []
+  reports = []
+
+  for update in updates:
+    sentences.append(f'MSG,3,1,1,{update["mode_s_code"]:06X},1,2024/01/01,00:00:00.000,2024/01/01,00:00:00.000,,'
+      f'{update["altitude"]:d},{update["horizontal_speed"]:d},{update["track"]:d},{update["lat"]:.5f},{update["lon"]:.5f},,,0,0,0,0')
+    reports.append({'latitude': update['lat'], 'longitude': update['lon'], 'altitude': update['altitude'],
+      'hVelocity': update['horizontal_speed'], 'vVelocity': 0, 'trackHeading': update['track'],
+      'callSign': f'N{update["mode_s_code"] % 99999:d}', 'address': update['mode_s_code']})
+
+  return (updates, sentences, reports)
+
+def bench_hot_paths():
+  """Per frame cost in us of the frame loop's hot paths with 10 to 10000 aircraft in view: encoding their traffic
+  reports, the GDL90 CRC, parsing their SBS1 sentences, merging and pruning them, and their distance from ownship"""
+  rng = random.Random(1)
+  results = {}
+  encoder = cumulus.gdl90encoder.Encoder()
+  fast_encoder = cumulus.gdl90encoder.FastEncoder()
+
+  for size in HOT_PATH_FLEET_SIZES:
+    (updates, sentences, reports) = generate_fleet_frame(size, 1000.0, rng)
+    sentence_bytes = [sentence.encode('ascii') for sentence in sentences]
+    payloads = [bytes(encoder._msgType10and20(20, 0, 0, report['address'], report['latitude'], report['longitude'], report['altitude'],
+      9, 8, 8, report['hVelocity'], report['vVelocity'], report['trackHeading'], 1, report['callSign'], 0)[1:-3]) for report in reports]
+
+    def encode(encoder):
+      for report in reports:
+        encoder.msgTrafficReport(**report)
+
+    results[f'encoder_traffic_report_us_per_frame_{size:d}'] = _best_time(lambda: encode(encoder)) * 1e6
+    results[f'fast_encoder_traffic_report_us_per_frame_{size:d}'] = _best_time(lambda: encode(fast_encoder)) * 1e6
+
+    def crc(function):
+      for payload in payloads:
+        function(payload)
+
+    results[f'crc_us_per_frame_{size:d}'] = _best_time(lambda: crc(cumulus.gdl90fcs.crcCompute)) * 1e6
+    results[f'crc_fast_us_per_frame_{size:d}'] = _best_time(lambda: crc(cumulus.gdl90fcs.crcComputeFast)) * 1e6
+
+    def parse_sentence():
+      for sentence in sentences:
+        cumulus.dump1090_provider.Dump1090Provider.parse_sentence(sentence)
+
+    results[f'parse_sentence_us_per_frame_{size:d}'] = _best_time(parse_sentence) * 1e6
+    results[f'parse_sentences_us_per_frame_{size:d}'] = _best_time(lambda: cumulus.dump1090_provider.Dump1090Provider.parse_sentences(sentence_bytes)) * 1e6
+
+    # Merge and prune as Cumulus.run does them, mailbox to table, with a tenth of the fleet going stale every frame
+    mailbox = cumulus.target_mailbox.TargetMailbox(max_pending_targets = max(size, cumulus.target_mailbox.MAX_PENDING_TARGETS))
+    table = cumulus.traffic_table.TrafficTable(cumulus.cumulus.DEFAULT_TARGET)
+    stale = size // 10
+    frame_updates = [{**update, 'last_seen': (1000.0 - cumulus.cumulus.MAX_TARGET_KEEP_TIMEOUT - 1) if (x < stale) else 1000.0}
+      for x, update in enumerate(updates)]
+
+    def merge_prune():
+      mailbox.merge(frame_updates)
+      table.upsert(mailbox.swap().values())
+      table.prune(1000.0, cumulus.cumulus.MAX_TARGET_KEEP_TIMEOUT)
+
+    results[f'merge_prune_us_per_frame_{size:d}'] = _best_time(merge_prune) * 1e6
+
+    table = cumulus.traffic_table.TrafficTable(cumulus.cumulus.DEFAULT_TARGET)
+    table.upsert(updates)
+    positions = [(update['lat'], update['lon']) for update in updates]
+
+    def distance():
+      for position in positions:
+        cumulus.cumulus.calculate_distance_between_coords((40.0, -105.0), position)
+
+    results[f'distance_us_per_frame_{size:d}'] = _best_time(distance) * 1e6
+    results[f'update_geometry_us_per_frame_{size:d}'] = _best_time(lambda: table.update_geometry(40.0, -105.0)) * 1e6
+
+  return results
+
+def bench_logging():
+  """Frame time in us of merging a frame of target updates and logging each one, with a print() per update as the
+  frame loop used to, and with the event log at info (updates not logged), at debug and at debug without a rate limit
+  Output goes to a line buffered os.devnull, which costs a write per line like a terminal, only less"""
+  rng = random.Random(1)
+  results = {}
+
+  with open(os.devnull, 'w', buffering = 1) as devnull:
+    for count in LOGGING_BENCH_UPDATES_PER_FRAME:
+      updates = generate_target_updates(count, 1000.0, rng)
+      table = cumulus.traffic_table.TrafficTable(cumulus.cumulus.DEFAULT_TARGET)
+      table.upsert(updates)
+
+      def print_frame():
+        (added, updated) = table.upsert(updates)
+        for mode_s_code in updated:
+          print(f'Updating {mode_s_code:x}', file = devnull)
+
+      results[f'print_us_per_frame_{count:d}'] = _best_time(print_frame) * 1e6
+
+      for label, level, rate_limit in (('info', cumulus.event_log.INFO, cumulus.event_log.DEFAULT_RATE_LIMIT),
+          ('debug', cumulus.event_log.DEBUG, cumulus.event_log.DEFAULT_RATE_LIMIT), ('debug_unlimited', cumulus.event_log.DEBUG, 0)):
+        log = cumulus.event_log.EventLog(devnull, level = level, rate_limit = rate_limit)
+
+        def log_frame():
+          (added, updated) = table.upsert(updates)
+          if (log.level <= cumulus.event_log.DEBUG):
+            for mode_s_code in updated:
+              log.debug('target_updated', 'Updating %x', mode_s_code)
+
+        results[f'event_log_{label}_us_per_frame_{count:d}'] = _best_time(log_frame) * 1e6
+        log.flush()
+        results[f'event_log_{label}_suppressed_{count:d}'] = log.suppressed_total
+        results[f'event_log_{label}_dropped_{count:d}'] = log.dropped_total
+
+  return results
+
+def _nmea_coordinate(value, width):
+  minutes = abs(value) % 1 * 60
+  return f'{int(abs(value)):0{width}d}{minutes:07.4f}'
+
+def generate_nmea(seconds, rate, rng):
+  """GGA, GNS, RMC, VTG and GSA from mixed talkers for a slow flight, rate fixes a second, some GSV and corrupted
+  sentences mixed in. Returns the lines and how many of them were corrupted and unsupported"""
+  lines = []
+  corrupted = 0
+  unsupported = 0
+  (lat, lon, alt, course, speed) = (39.5, -104.8, 1600.0, 45.0, 95.0)
+
+  for x in range(0, seconds * rate):
+    t = x / rate
+    lat += speed * 0.514444 * math.cos(math.radians(course)) / rate / 111320
+    lon += speed * 0.514444 * math.sin(math.radians(course)) / rate / (111320 * math.cos(math.radians(lat)))
+    course = (course + rng.uniform(-0.5, 0.5)) % 360
+    utc = f'{int(t // 3600) % 24:02d}{int(t // 60) % 60:02d}{t % 60:05.2f}'
+    position = f'{_nmea_coordinate(lat, 2)},{"N" if lat >= 0 else "S"},{_nmea_coordinate(lon, 3)},{"E" if lon >= 0 else "W"}'
+    talker = rng.choice(('GP', 'GN', 'GL'))
+
+    bodies = [f'{talker}GGA,{utc},{position},1,12,0.8,{alt:.1f},M,-21.0,M,,',
+      f'{talker}GNS,{utc},{position},AAN,14,0.8,{alt:.1f},-21.0,,,V',
+      f'{talker}RMC,{utc},A,{position},{speed:.2f},{course:.2f},010124,,,A',
+      f'{talker}VTG,{course:.2f},T,,M,{speed:.2f},N,{speed * 1.852:.2f},K,A',
+      f'{talker}GSA,A,3,04,05,09,12,24,25,29,31,,,,,1.4,0.8,1.1']
+    if (rng.random() < NMEA_BENCH_GSV_FRACTION):
+      bodies.append('GPGSV,3,1,11,03,03,111,00,04,15,270,00,06,01,010,00,13,06,292,00')
+      unsupported += 1
+
+    for body in bodies:
+      line = cumulus.nmea.format_sentence(body)
+      if (rng.random() < NMEA_BENCH_CORRUPT_FRACTION):
+        position = rng.randrange(1, len(line) - 5)
+        line = line[0:position] + bytes([line[position] ^ 0x01]) + line[position + 1:]
+        corrupted += 1
+        unsupported -= int(body.startswith('GPGSV'))
+      lines.append(line)
+
+  return (lines, corrupted, unsupported)
+
+def bench_nmea():
+  """Parse time of the built in NMEA parser against pynmea2 if it is installed, then sentences per second and error
+  counts of NmeaGpsProvider reading a fake GPS through a pty, as fast as the pty takes them"""
+  rng = random.Random(1)
+  (lines, corrupted, unsupported) = generate_nmea(NMEA_BENCH_SECONDS, NMEA_BENCH_RATE_HZ, rng)
+  results = {'sentences': len(lines), 'corrupted': corrupted, 'unsupported': unsupported}
+
+  def parse():
+    for line in lines:
+      try:
+        cumulus.nmea.parse(line)
+      except cumulus.nmea.NmeaError:
+        pass
+
+  results['parse_us_per_sentence'] = _best_time(parse) * 1e6 / len(lines)
+
+  try:
+    import pynmea2
+    text_lines = [line.decode('ascii') for line in lines]
+
+    def parse_pynmea2():
+      for line in text_lines:
+        try:
+          pynmea2.parse(line, check = True)
+        except pynmea2.ParseError:
+          pass
+
+    results['pynmea2_parse_us_per_sentence'] = _best_time(parse_pynmea2) * 1e6 / len(lines)
+  except ImportError:
+    pass
+
+  # The provider on the pty's slave end, the fake GPS writing to the master end
+  (master, slave) = os.openpty()
+  try:
+    provider = cumulus.nmea_gps_provider.NmeaGpsProvider(os.ttyname(slave), 115200)
+    provider.daemon = True
+    provider.start()
+
+    start = time.perf_counter()
+    payload = b''.join(lines)
+    for x in range(0, len(payload), 4096):
+      os.write(master, payload[x:x + 4096])
+
+    def handled():
+      return provider.sentences_total + provider.checksum_errors_total + provider.parse_errors_total + provider.unsupported_total
+
+    while (handled() < len(lines) and time.perf_counter() - start < NMEA_BENCH_TIMEOUT_S):
+      time.sleep(0.001)
+
+    results['pty_sentences_per_s'] = handled() / (time.perf_counter() - start)
+    results['pty_sentences_total'] = provider.sentences_total
+    results['pty_checksum_errors_total'] = provider.checksum_errors_total
+    results['pty_parse_errors_total'] = provider.parse_errors_total
+    results['pty_unsupported_total'] = provider.unsupported_total
+    results['pty_position_valid'] = (provider.snapshot.position_time > 0 and provider.snapshot.velocity_time > 0)
+  finally:
+    os.close(master)
+
+  return results
+
+def generate_ubx(seconds, rate, rng):
+  """NAV-PVT for a slow flight climbing at 500 fpm, rate fixes a second, with the NMEA a receiver keeps sending
+  and some corrupted frames mixed in. Returns the stream and how many frames were corrupted"""
+  frames = []
+  corrupted = 0
+  (lat, lon, height, course, speed, climb) = (39.5, -104.8, 1579.0, 45.0, 48.9, 2.54)
+  start = datetime.datetime(2024, 1, 1, tzinfo = datetime.timezone.utc).timestamp()
+
+  for x in range(0, seconds * rate):
+    t = start + (x / rate)
+    lat += speed * math.cos(math.radians(course)) / rate / 111320
+    lon += speed * math.sin(math.radians(course)) / rate / (111320 * math.cos(math.radians(lat)))
+    height += climb / rate
+    course = (course + rng.uniform(-0.5, 0.5)) % 360
+    utc = datetime.datetime.fromtimestamp(t, datetime.timezone.utc)
+    (vel_n, vel_e) = (speed * math.cos(math.radians(course)), speed * math.sin(math.radians(course)))
+
+    payload = cumulus.ubx.NAV_PVT_FORMAT.pack(int(t * 1000) % (7 * 86400000), utc.year, utc.month, utc.day, utc.hour, utc.minute, utc.second,
+      cumulus.ubx.NAV_PVT_VALID_DATE | cumulus.ubx.NAV_PVT_VALID_TIME | cumulus.ubx.NAV_PVT_FULLY_RESOLVED, 20, utc.microsecond * 1000,
+      cumulus.ubx.FIX_3D, cumulus.ubx.NAV_PVT_GNSS_FIX_OK, 0, 14, int(lon * 1e7), int(lat * 1e7), int(height * 1000), int((height + 21.0) * 1000),
+      1500, 2500, int(vel_n * 1000), int(vel_e * 1000), int(-climb * 1000), int(speed * 1000), int(course * 1e5), 300, 50000, 140,
+      0, 0, 0)
+    frame = cumulus.ubx.frame(cumulus.ubx.CLASS_NAV, cumulus.ubx.NAV_PVT, payload)
+    if (rng.random() < NMEA_BENCH_CORRUPT_FRACTION):
+      position = rng.randrange(6, len(frame) - 2)
+      frame = frame[0:position] + bytes([frame[position] ^ 0x01]) + frame[position + 1:]
+      corrupted += 1
+
+    frames.append(frame)
+    frames.append(cumulus.nmea.format_sentence('GPGSA,A,3,04,05,09,12,24,25,29,31,,,,,1.4,0.8,1.1'))
+
+  return (b''.join(frames), corrupted)
+
+def bench_ubx(ubx_file=None):
+  """Parse time per fix of NAV-PVT against the GGA, RMC, VTG and GSA NMEA needs for the same fix, then what
+  UbxGpsProvider makes of a generated stream, or of a recorded one (u-center .ubx log, raw receiver output)"""
+  rng = random.Random(1)
+  (stream, corrupted) = generate_ubx(NMEA_BENCH_SECONDS, NMEA_BENCH_RATE_HZ, rng)
+  fixes = NMEA_BENCH_SECONDS * NMEA_BENCH_RATE_HZ
+  results = {'fixes': fixes, 'corrupted': corrupted}
+
+  def parse():
+    reader = cumulus.ubx.UbxReader()
+    for x in range(0, len(stream), UBX_BENCH_CHUNK_BYTES):
+      for msg_class, msg_id, payload in reader.feed(stream[x:x + UBX_BENCH_CHUNK_BYTES]):
+        if (msg_id == cumulus.ubx.NAV_PVT):
+          cumulus.ubx.parse_nav_pvt(payload)
+
+  results['parse_us_per_fix'] = _best_time(parse) * 1e6 / fixes
+
+  nmea_lines = [line for line in generate_nmea(NMEA_BENCH_SECONDS, NMEA_BENCH_RATE_HZ, random.Random(1))[0] if line[3:6] != b'GNS' and line[3:6] != b'GSV']
+
+  def parse_nmea():
+    for line in nmea_lines:
+      try:
+        cumulus.nmea.parse(line)
+      except cumulus.nmea.NmeaError:
+        pass
+
+  results['nmea_parse_us_per_fix'] = _best_time(parse_nmea) * 1e6 / fixes
+
+  if (ubx_file != None):
+    with open(ubx_file, 'rb') as recording:
+      stream = recording.read()
+    results['recorded_bytes'] = len(stream)
+
+  provider = cumulus.ubx_gps_provider.UbxGpsProvider(None, 115200)
+  start = time.perf_counter()
+  for x in range(0, len(stream), UBX_BENCH_CHUNK_BYTES):
+    provider.process_bytes(stream[x:x + UBX_BENCH_CHUNK_BYTES])
+  elapsed = time.perf_counter() - start
+
+  results['provider_bytes_per_s'] = len(stream) / elapsed
+  results['provider_nav_pvt_total'] = provider.sentences_total - provider.acks_total - provider.naks_total
+  results['provider_checksum_errors_total'] = provider.checksum_errors_total
+  results['provider_parse_errors_total'] = provider.parse_errors_total
+  results['provider_unsupported_total'] = provider.unsupported_total
+  results['provider_skipped_bytes'] = provider.reader.skipped_bytes_total
+  results['provider_fix_3d'] = (provider.snapshot.fix == cumulus.nmea.FIX_3D)
+  if (provider.snapshot.v_speed != None):
+    results['provider_vertical_rate_fpm'] = cumulus.cumulus.meters_to_feet(provider.snapshot.v_speed) * 60
+
+  return results
+
+def _frame_work(x):
+  """Busy wait for a frame's worth of work, longer than the period now and then"""
+  work = FRAME_BENCH_WORK_S if (x % FRAME_BENCH_OVERRUN_EVERY != FRAME_BENCH_OVERRUN_EVERY - 1) else FRAME_BENCH_PERIOD_S * FRAME_BENCH_OVERRUN_FACTOR
+  end = time.perf_counter() + work
+  while (time.perf_counter() < end):
+    pass
+
+def _frame_results(label, starts):
+  """Jitter of frame starts against the ideal grid from the first one, and frames lost over the run"""
+  period = FRAME_BENCH_PERIOD_S
+  offsets = sorted(abs(((start - starts[0] + period / 2) % period) - period / 2) for start in starts)
+  expected = int((starts[-1] - starts[0]) / period) + 1
+  return {f'{label}_jitter_us_p50': offsets[len(offsets) // 2] * 1e6,
+    f'{label}_jitter_us_p99': offsets[min(int(len(offsets) * 0.99), len(offsets) - 1)] * 1e6,
+    f'{label}_frames_lost': expected - len(starts)}
+
+def bench_frame_scheduler():
+  """The frame loop as it was (sleep the rest of the period against the wall clock, a whole period after an overrun)
+  against FrameScheduler's monotonic deadlines, for the same work with the odd overrun. Jitter is how far frames
+  start from a fixed grid, frames lost how many fewer frames than the run's length has room for"""
+  results = {}
+
+  starts = []
+  for x in range(FRAME_BENCH_FRAMES):
+    timestamp_start = time.time()
+    starts.append(time.perf_counter())
+    _frame_work(x)
+
+    sleep_period = FRAME_BENCH_PERIOD_S - (time.time() - timestamp_start)
+    if (sleep_period < 0):
+      sleep_period = FRAME_BENCH_PERIOD_S
+    time.sleep(sleep_period)
+  results.update(_frame_results('sleep', starts))
+
+  starts = []
+  frame_clock = cumulus.frame_scheduler.FrameScheduler(FRAME_BENCH_PERIOD_S)
+  stats = cumulus.frame_stats.FrameStats(FRAME_BENCH_PERIOD_S)
+  for x in range(FRAME_BENCH_FRAMES):
+    now = time.monotonic()
+    stats.start_frame(frame_clock.start_frame(now))
+    starts.append(time.perf_counter())
+    _frame_work(x)
+    stats.end_frame()
+
+    frame_clock.next_deadline()
+    frame_clock.wait()
+  results.update(_frame_results('scheduler', starts))
+  results['scheduler_skipped'] = frame_clock.skipped_total
+  results['scheduler_overruns'] = stats.overruns_total
+
+  return results
+
+def _report_tier_counts(frame_period, next_pass, rng):
+  """Reports per tier from a ReportScheduler asked for due reports at the times next_pass(scheduler, now, rng) gives,
+  with every target updated before each pass"""
+  scheduler = cumulus.report_scheduler.ReportScheduler(cumulus.report_scheduler.parse_report_tiers(REPORT_TIERS_BENCH_SPEC),
+    frame_period = frame_period)
+  table = cumulus.traffic_table.TrafficTable(cumulus.cumulus.DEFAULT_TARGET)
+  updates = [{'mode_s_code': 0x100000 + x, 'lat': 40.0 + distance / 60.0, 'lon': -105.0, 'altitude': 5000}
+    for x, distance in enumerate(REPORT_TIERS_BENCH_DISTANCES_NM)]
+
+  # The targets turn up in a frame which is itself late
+  now = rng.uniform(0, REPORT_TIERS_BENCH_JITTER_S)
+  (added, updated) = table.upsert(updates)
+  scheduler.add(added, now)
+
+  counts = collections.Counter()
+  while (now < REPORT_TIERS_BENCH_FRAMES * cumulus.cumulus.UPDATE_PERIOD_S):
+    table.upsert(updates)
+    table.update_geometry(40.0, -105.0)
+    for target in scheduler.take_due_reports(table, now, own_altitude = 5000):
+      counts[target['mode_s_code']] += 1
+    now = next_pass(scheduler, now, rng)
+
+  return [counts[update['mode_s_code']] for update in updates]
+
+def bench_report_tiers():
+  """Reports per second of each tier against its configured rate, for the threaded engine's jittery 250 ms frames and
+  for the asyncio engine's passes a little after each deadline"""
+  rng = random.Random(1)
+  period = cumulus.cumulus.UPDATE_PERIOD_S
+  duration = REPORT_TIERS_BENCH_FRAMES * period
+  intervals = [tier.interval for tier in cumulus.report_scheduler.parse_report_tiers(REPORT_TIERS_BENCH_SPEC)]
+  results = {}
+
+  def next_frame(scheduler, now, rng):
+    return (round(now / period) + 1) * period + rng.uniform(0, REPORT_TIERS_BENCH_JITTER_S)
+
+  def next_deadline(scheduler, now, rng):
+    return scheduler.next_deadline() + rng.uniform(0, REPORT_TIERS_BENCH_JITTER_S)
+
+  for (label, frame_period, next_pass) in (('frames', period, next_frame), ('deadlines', 0, next_deadline)):
+    counts = _report_tier_counts(frame_period, next_pass, rng)
+    for (interval, count) in zip(intervals, counts):
+      if (abs(count - duration / interval) > 1):
+        raise AssertionError(f'{label}: {count:d} reports of the {interval:g} s tier in {duration:g} s, {duration / interval:g} configured')
+      results[f'{label}_{interval:g}s_tier_hz'] = count / duration
+
+  return results
+
+BENCHMARKS = {
+  'async_reports': bench_async_reports,
+  'beast_decoder': bench_beast_decoder,
+  'extrapolation': bench_extrapolation,
+  'frame_scheduler': bench_frame_scheduler,
+  'gdl90_encoder': bench_gdl90_encoder,
+  'hot_paths': bench_hot_paths,
+  'logging': bench_logging,
+  'mode_s_demodulator': bench_mode_s_demodulator,
+  'nmea': bench_nmea,
+  'report_tiers': bench_report_tiers,
+  'sbs1_reader': bench_sbs1_reader,
+  'traffic_table': bench_traffic_table,
+  'uat_decoder': bench_uat_decoder,
+  'uat_demodulator': bench_uat_demodulator,
+  'ubx': bench_ubx,
+}
+
+def metric_direction(key):
+  """1 if a bigger value of metric key is better, -1 if smaller is, 0 if it is only a count"""
+  if (key.endswith('_per_s') or '_per_s_' in key or key.endswith('_factor') or key in ('matched', 'recovered')):
+    return 1
+  elif ('_us_' in key or key.startswith('cpu_') or '_cpu_' in key or 'error' in key):
+    return -1
+
+  return 0
+
+def compare_results(baseline, results, threshold):
+  """Print every metric against the baseline run, returns the number of regressions beyond threshold"""
+  regressions = 0
+
+  for name, metrics in results.items():
+    base_metrics = baseline.get(name)
+    if (base_metrics == None):
+      continue
+
+    print(f'{name} against baseline')
+    for key, value in metrics.items():
+      base_value = base_metrics.get(key)
+      if (not isinstance(value, (int, float)) or not isinstance(base_value, (int, float)) or base_value == 0):
+        continue
+
+      change = (value - base_value) / abs(base_value)
+      direction = metric_direction(key)
+      regressed = (direction != 0 and (change * direction) < -threshold)
+      regressions += int(regressed)
+      print(f'  {key}: {base_value:.3f} -> {value:.3f} ({change * 100:+.1f}%){" REGRESSION" if regressed else ""}')
+
+  return regressions
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-b', help='Benchmark to run (default: all)', action='append', dest='benchmarks', choices=sorted(BENCHMARKS.keys()), default=None)
+  parser.add_argument('--dump978-log', help='Recorded dump978 output for the uat_decoder benchmark', default=None)
+  parser.add_argument('--iq-file', help='Recorded rtl_sdr u8 I/Q at 2.083334 Msps for the uat_demodulator benchmark', default=None)
+  parser.add_argument('--iq-1090-file', help='Recorded rtl_sdr u8 I/Q at 2 Msps for the mode_s_demodulator benchmark', default=None)
+  parser.add_argument('--dump1090-raw', help='dump1090 --raw output from the same 1090 capture, to compare against', default=None)
+  parser.add_argument('--ubx-file', help='Recorded UBX receiver output for the ubx benchmark', default=None)
+  parser.add_argument('--json', help='Write the results to this file as JSON', dest='json_path', default=None)
+  parser.add_argument('--compare', help='JSON results of an earlier run, print the change and exit 1 on any regression', dest='baseline_path', default=None)
+  parser.add_argument('--threshold', help='Change against the baseline counted as a regression, percent', type=float, default=DEFAULT_REGRESSION_THRESHOLD * 100)
+  args = parser.parse_args()
+
+  options = {'uat_decoder': {'dump978_log': args.dump978_log}, 'uat_demodulator': {'iq_file': args.iq_file},
+    'mode_s_demodulator': {'iq_file': args.iq_1090_file, 'dump1090_raw': args.dump1090_raw}, 'ubx': {'ubx_file': args.ubx_file}}
+
+  all_results = {}
+  for name in (args.benchmarks or BENCHMARKS.keys()):
+    results = BENCHMARKS[name](**options.get(name, {}))
+    all_results[name] = results
+    print(name)
+    for key, value in results.items():
+      print(f'  {key}: {value:.3f}' if isinstance(value, float) else f'  {key}: {value}')
+
+  if (args.json_path != None):
+    with open(args.json_path, 'w') as json_file:
+      json.dump({
+        'time': datetime.datetime.now().isoformat(timespec = 'seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'results': all_results,
+      }, json_file, indent = 2)
+
+  if (args.baseline_path != None):
+    with open(args.baseline_path, 'r') as baseline_file:
+      baseline = json.load(baseline_file)
+
+    if (compare_results(baseline['results'], all_results, args.threshold / 100) > 0):
+      sys.exit(1)
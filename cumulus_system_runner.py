@@ -7,9 +7,13 @@ import argparse
 import collections
 import subprocess
 import configparser
+import signal
 
 import cumulus.rtl_sdr_tools
 import cumulus.cumulus
+import cumulus.cumulus_async
+import cumulus.metrics
+import cumulus.supervisor
 import dump1090_runner
 
 IDLE_TIMEOUT = 5
@@ -22,15 +26,38 @@ if __name__ == '__main__':
   # Open config
   config = configparser.ConfigParser()
   config.read(args.config_path)
+  cumulus.supervisor.configure(config)
+  supervisor = cumulus.supervisor.SUPERVISOR
 
-  # Start dump1090
-  dump_1090_runner = dump1090_runner.Dump1090Runner(int(config['dump1090']['device_sn']))
-  dump_1090_runner.start()
+  # Stop the receivers on the way out rather than leave them holding the SDRs
+  stopping = threading.Event()
+  signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+  signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+
+  # Start dump1090, unless cumulus demodulates the 1090 I/Q itself or replays a recording
+  # The supervisor starts it on its own thread, alongside the 978 SDR which cumulus starts
+  replaying = (len(config.get('input_log', 'replay', fallback='').strip()) > 0)
+  if (config.get('dump1090', 'format', fallback='sbs1') != 'iq' and not replaying):
+    supervisor.add(dump1090_runner.Dump1090Runner(int(config['dump1090']['device_sn'])))
+
+  # Metrics endpoint for scraping, in Prometheus text format
+  metrics_port = config.getint('metrics', 'port', fallback=0)
+  if (metrics_port > 0):
+    metrics_server = cumulus.metrics.MetricsServer(metrics_port, config.get('metrics', 'address', fallback=cumulus.metrics.DEFAULT_ADDRESS))
+    metrics_server.start()
   
-  # Start cumulus
-  cumulus = cumulus.cumulus.Cumulus(config)
+  # Start cumulus, on threads or on the asyncio engine
+  if (config.get('cumulus', 'engine', fallback='threads') == 'asyncio'):
+    cumulus = cumulus.cumulus_async.AsyncCumulus(config)
+  else:
+    cumulus = cumulus.cumulus.Cumulus(config)
+
+  # Threads started by cumulus are daemons like it, so they don't hold up the exit
+  cumulus.daemon = True
   cumulus.start()
   
   # Idle loop
-  while (True):
-    time.sleep(IDLE_TIMEOUT)
\ No newline at end of file
+  while (not stopping.wait(IDLE_TIMEOUT)):
+    pass
+
+  supervisor.stop()
\ No newline at end of file
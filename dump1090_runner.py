@@ -1,30 +1,14 @@
 #!/usr/bin/env python3
 
-import time
-import os
-import threading
-import argparse
-import collections
-import subprocess
-import cumulus.rtl_sdr_tools
+import cumulus.supervisor
 
-NO_DEVICE_SLEEP_TIMEOUT = 10
+DUMP1090_PATH = './dump1090/dump1090'
 
-class Dump1090Runner(threading.Thread):
-  def __init__(self, device_serial):
-    super().__init__()
-    
-    self.device_serial = device_serial
-    
-  def run(self):
-    while True:
-      device_index = cumulus.rtl_sdr_tools.get_rtl_sdr_index_from_serial(self.device_serial)
+def dump1090_command(device_index):
+  return [DUMP1090_PATH, '--quiet', '--device-index', f'{device_index:d}', '--net']
 
-      if (device_index == None):
-        print('1090 SDR not found')
-        time.sleep(NO_DEVICE_SLEEP_TIMEOUT)
-        continue
-        
-      dump1090_process = subprocess.Popen(['./dump1090/dump1090', '--quiet', '--device-index', f'{device_index:d}', '--net'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-      dump1090_process.wait()
-      print('Warning: dump1090 exited')
\ No newline at end of file
+class Dump1090Runner(cumulus.supervisor.SupervisedPipeline):
+  """dump1090 on the SDR with serial number device_serial, restarted by the supervisor when it exits
+  Its output goes to the network, so its liveness is the message count of the provider reading it, see Supervisor.watch"""
+  def __init__(self, device_serial):
+    super().__init__('dump1090', device_serial, lambda device_index: [dump1090_command(device_index)])
\ No newline at end of file